@@ -1,10 +1,42 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import json
 from datetime import datetime
-from core.collections import users_collection , appointments_collection
+from core.collections import appointments_collection
+from core.schedules import get_schedule, as_utc, is_slot_start, slot_key
+from core.calendars import InvalidDateFilter, date_status_filters
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.hydration import hydrate_users, lookup, patient_details, doctor_details
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+from core.versioning import FIRST_VERSION, NEXT_VERSION, InvalidVersion, requested_version, version_filter, \
+    current_version, conflict_response
+
+
+SLOT_TAKEN_ERROR = "This time slot is already booked"
+APPOINTMENT_CHANGED_ERROR = "The appointment was changed by someone else; reload it and try again"
+
+
+def slot_error(doctor_id, appointment_date):
+    """Error message if `appointment_date` is not a slot start in the doctor's schedule."""
+    if not is_slot_start(get_schedule(doctor_id), appointment_date):
+        return "appointment_date is not a slot in this doctor's working hours"
+    return None
+
+
+def update_refused(appointment, owner, version):
+    """404, 403 or 409 if `appointment` is missing, not `owner`'s, or no longer at `version`; else None."""
+    if not appointment:
+        return JsonResponse({"error": "Appointment not found"}, status=404)
+    if any(appointment.get(field) != value for field, value in owner.items()):
+        return JsonResponse({"error": "You are not authorized to update this appointment"}, status=403)
+    if version is not None and current_version(appointment) != version:
+        return conflict_response(APPOINTMENT_CHANGED_ERROR, "appointment", appointment)
+    return None
 
 
 # Function for patients to book appointments
@@ -16,13 +48,11 @@ def book_appointment(request):
             # Get the logged-in user's ID from the request
             user_id = request.user_id
 
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a patient
-            if user.get("role") != "patient":
+            if user.role != "patient":
                 return JsonResponse({"error": "Only patients can book appointments"}, status=403)
 
             # Parse the request body
@@ -37,21 +67,32 @@ def book_appointment(request):
 
             # Convert appointment_date to a datetime object
             try:
-                appointment_date = datetime.fromisoformat(appointment_date)
+                appointment_date = as_utc(datetime.fromisoformat(appointment_date))
             except ValueError:
                 return JsonResponse({"error": "Invalid appointment_date format. Use ISO format (e.g., 2024-02-20T10:00:00Z)"}, status=400)
 
+            # The date must be one of the doctor's slots
+            error = slot_error(doctor_id, appointment_date)
+            if error:
+                return JsonResponse({"error": error}, status=400)
+
             # Create the appointment document
+            doctor_id = ObjectId(doctor_id)
             appointment = {
                 "patient_id": ObjectId(user_id),  # The logged-in patient's ID
-                "doctor_id": ObjectId(doctor_id),
+                "doctor_id": doctor_id,
                 "appointment_date": appointment_date,
+                "slot_key": slot_key(doctor_id, appointment_date),
                 "status": "Scheduled",  # Default status
-                "notes": notes if notes else ""  # Optional field
+                "notes": notes if notes else "",  # Optional field
+                "version": FIRST_VERSION
             }
 
-            # Insert the appointment into the collection
-            result = appointments_collection.insert_one(appointment)
+            # Insert the appointment; the unique slot_key index rejects a slot that is already taken
+            try:
+                result = appointments_collection.insert_one(appointment)
+            except DuplicateKeyError:
+                return JsonResponse({"error": SLOT_TAKEN_ERROR}, status=409)
 
             return JsonResponse({
                 "message": "Appointment booked successfully",
@@ -62,70 +103,95 @@ def book_appointment(request):
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
     
+def appointments_query(role, user_id):
+    """Query for the appointments `role` may list, or None if it may not list any."""
+    if role == "doctor":
+        return {"doctor_id": ObjectId(user_id)}
+    elif role == "patient":
+        return {"patient_id": ObjectId(user_id)}
+    return None
+
+
+def appointment_participant_fields(role):
+    # Patients also see who their doctor is
+    return ("patient_id", "doctor_id") if role == "patient" else ("patient_id",)
+
+
+def format_appointments(appointments, role, users):
+    """Shape raw appointments, attaching participant details from a `hydrate_users` lookup."""
+    formatted_appointments = []
+    for appointment in appointments:
+        appointment_date = appointment.get("appointment_date")
+        formatted_appointment = {
+            "_id": appointment["_id"],
+            "patient_id": appointment["patient_id"],
+            "doctor_id": appointment["doctor_id"],
+            "appointment_date": appointment_date,
+            # date/time are split out of appointment_date for older clients
+            "date": appointment_date.date() if appointment_date else None,
+            "time": appointment_date.strftime("%H:%M") if appointment_date else None,
+            "status": appointment.get("status"),
+            "notes": appointment.get("notes", ""),
+            "remarks": appointment.get("remarks")
+        }
+
+        # Attach patient details
+        patient = lookup(users, appointment["patient_id"])
+        if patient:
+            formatted_appointment["patient_details"] = patient_details(patient)
+
+        # Attach doctor details (if the logged-in user is a patient)
+        if role == "patient":
+            doctor = lookup(users, appointment["doctor_id"])
+            if doctor:
+                formatted_appointment["doctor_details"] = doctor_details(doctor)
+
+        formatted_appointments.append(formatted_appointment)
+    return formatted_appointments
+
+
 @jwt_required
 @csrf_exempt
 def get_appointments(request):
     if request.method == "GET":
         try:
-            # Get the logged-in user's ID from the request
-            user_id = request.user_id
-
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
-
-            # Determine the user's role
-            role = user.get("role")
+            # The caller's identity and role come from the access token
+            role = request.principal.role
 
             # Build the query based on the user's role
-            if role == "doctor":
-                query = {"doctor_id": ObjectId(user_id)}
-            elif role == "patient":
-                query = {"patient_id": ObjectId(user_id)}
-            else:
+            query = appointments_query(role, request.user_id)
+            if query is None:
                 return JsonResponse({"error": "Unauthorized access"}, status=403)
 
-            # Retrieve appointments based on the query
-            appointments = list(appointments_collection.find(query))
-
-            # Format the appointments list
-            formatted_appointments = []
-            for appointment in appointments:
-                formatted_appointment = {
-                    "_id": str(appointment["_id"]),  # Convert ObjectId to string
-                    "patient_id": str(appointment["patient_id"]),  # Convert ObjectId
-                    "doctor_id": str(appointment["doctor_id"]),  # Convert ObjectId
-                    "date": appointment.get("date"),
-                    "time": appointment.get("time"),
-                    "status": appointment.get("status"),
-                    "remarks": appointment.get("remarks")
-                }
-
-                # Fetch patient details
-                patient = users_collection.find_one({"_id": appointment["patient_id"]})
-                if patient:
-                    formatted_appointment["patient_details"] = {
-                        "first_name": patient["personal_details"]["first_name"],
-                        "last_name": patient["personal_details"]["last_name"],
-                        "age": patient["personal_details"]["age"],
-                        "gender": patient["personal_details"]["gender"]
-                    }
-
-                # Fetch doctor details (if the logged-in user is a patient)
-                if role == "patient":
-                    doctor = users_collection.find_one({"_id": appointment["doctor_id"]})
-                    if doctor:
-                        formatted_appointment["doctor_details"] = {
-                            "first_name": doctor["personal_details"]["first_name"],
-                            "last_name": doctor["personal_details"]["last_name"],
-                            "specialization": doctor.get("specialization", "")
-                        }
-
-                formatted_appointments.append(formatted_appointment)
+            # Narrow to ?from=/?to= and ?status= if given
+            try:
+                query.update(date_status_filters(request, "appointment_date"))
+            except InvalidDateFilter as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # Read the requested page
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # Retrieve one page of appointments in date order
+            appointments, next_cursor = find_page(appointments_collection, query, page, sort_key="appointment_date")
+
+            # A repeat load of an unchanged page skips hydration and serialization
+            etag = page_etag(request, appointments, next_cursor)
+            response = not_modified(request, etag)
+            if response:
+                return response
+
+            # Fetch every referenced participant in one round trip
+            users = hydrate_users(appointments, *appointment_participant_fields(role))
 
             # Return the list of appointments with personal details
-            return JsonResponse({"appointments": formatted_appointments}, status=200)
+            return with_etag(BSONResponse({
+                "appointments": format_appointments(appointments, role, users),
+                "next_cursor": next_cursor
+            }, status=200), etag)
 
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
@@ -142,10 +208,8 @@ def update_appointment(request):
             # Get the logged-in user's ID from the request
             user_id = request.user_id
 
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Parse the request body
             data = json.loads(request.body)
@@ -158,53 +222,86 @@ def update_appointment(request):
             if not appointment_id:
                 return JsonResponse({"error": "Missing appointment_id"}, status=400)
 
-            # Fetch the appointment from the database
-            appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-            if not appointment:
-                return JsonResponse({"error": "Appointment not found"}, status=404)
+            # The version the caller last read, if it wants a conflict rather than an overwrite
+            try:
+                version = requested_version(data)
+            except InvalidVersion as e:
+                return JsonResponse({"error": str(e)}, status=400)
 
-            # Check if the logged-in user is the doctor or patient associated with the appointment
-            if user["role"] == "doctor" and str(appointment["doctor_id"]) != user_id:
-                return JsonResponse({"error": "You are not authorized to update this appointment"}, status=403)
-            elif user["role"] == "patient" and str(appointment["patient_id"]) != user_id:
-                return JsonResponse({"error": "You are not authorized to update this appointment"}, status=403)
+            # Only the doctor or patient associated with the appointment may update it
+            owner = {}
+            if user.role == "doctor":
+                owner["doctor_id"] = ObjectId(user_id)
+            elif user.role == "patient":
+                owner["patient_id"] = ObjectId(user_id)
 
             # Prepare the update data based on the user's role
             update_data = {}
-            if user["role"] == "patient":
+            if user.role == "patient":
                 if new_doctor_id:
                     update_data["doctor_id"] = ObjectId(new_doctor_id)
                 if new_appointment_date:
                     try:
-                        update_data["appointment_date"] = datetime.fromisoformat(new_appointment_date)
+                        update_data["appointment_date"] = as_utc(datetime.fromisoformat(new_appointment_date))
                     except ValueError:
                         return JsonResponse({"error": "Invalid appointment_date format. Use ISO format (e.g., 2024-02-20T10:00:00Z)"}, status=400)
-            elif user["role"] == "doctor":
+            elif user.role == "doctor":
                 if new_appointment_date:
                     try:
-                        update_data["appointment_date"] = datetime.fromisoformat(new_appointment_date)
+                        update_data["appointment_date"] = as_utc(datetime.fromisoformat(new_appointment_date))
                     except ValueError:
                         return JsonResponse({"error": "Invalid appointment_date format. Use ISO format (e.g., 2024-02-20T10:00:00Z)"}, status=400)
                 if new_notes:
                     update_data["notes"] = new_notes
 
-            # Update the appointment
-            if update_data:
-                appointments_collection.update_one(
-                    {"_id": ObjectId(appointment_id)},
-                    {"$set": update_data}
+            # Nothing to change: return the appointment as it stands
+            if not update_data:
+                appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
+                return update_refused(appointment, owner, version) or BSONResponse({
+                    "message": "Appointment updated successfully",
+                    "appointment": appointment
+                }, status=200)
+
+            # Moving to another doctor or time means reserving the new slot
+            if "doctor_id" in update_data or "appointment_date" in update_data:
+                doctor_id = update_data.get("doctor_id", owner.get("doctor_id"))
+                appointment_date = update_data.get("appointment_date")
+                if doctor_id is None or appointment_date is None:
+                    # A patient moving only the doctor or only the time keeps the other from the
+                    # stored appointment; the update below is then conditioned on the version read
+                    appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
+                    refused = update_refused(appointment, owner, version)
+                    if refused:
+                        return refused
+                    version = current_version(appointment)
+                    doctor_id = doctor_id or appointment["doctor_id"]
+                    appointment_date = appointment_date or appointment["appointment_date"]
+                error = slot_error(doctor_id, appointment_date)
+                if error:
+                    return JsonResponse({"error": error}, status=400)
+                update_data["slot_key"] = slot_key(doctor_id, appointment_date)
+
+            # Update and return the appointment in one round trip, only if it is still the
+            # caller's and still at the version they read; the unique slot_key index rejects
+            # a slot that is already taken
+            update_data["updated_at"] = datetime.utcnow()
+            try:
+                updated_appointment = appointments_collection.find_one_and_update(
+                    {"_id": ObjectId(appointment_id), **owner, **version_filter(version)},
+                    {"$set": update_data, **NEXT_VERSION},
+                    return_document=ReturnDocument.AFTER
                 )
+            except DuplicateKeyError:
+                return JsonResponse({"error": SLOT_TAKEN_ERROR}, status=409)
 
-            # Fetch the updated appointment
-            updated_appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-
-            # Convert ObjectId to string for JSON serialization
-            updated_appointment["_id"] = str(updated_appointment["_id"])
-            updated_appointment["patient_id"] = str(updated_appointment["patient_id"])
-            updated_appointment["doctor_id"] = str(updated_appointment["doctor_id"])
+            # No match: say whether it is missing, someone else's, or changed since it was read
+            if updated_appointment is None:
+                appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
+                return update_refused(appointment, owner, version) or conflict_response(
+                    APPOINTMENT_CHANGED_ERROR, "appointment", appointment)
 
             # Return the updated appointment
-            return JsonResponse({
+            return BSONResponse({
                 "message": "Appointment updated successfully",
                 "appointment": updated_appointment
             }, status=200)
@@ -221,11 +318,9 @@ def cancel_appointment(request, appointment_id):
             # Get the logged-in user's ID
             user_id = request.user_id
 
-            # Verify user exists and is a patient
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
-            if user.get("role") != "patient":
+            # The caller's identity and role come from the access token
+            user = request.principal
+            if user.role != "patient":
                 return JsonResponse({"error": "Only patients can cancel appointments"}, status=403)
 
             # Find the appointment
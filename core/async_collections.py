@@ -0,0 +1,15 @@
+from core.async_mongodb import db
+
+users_collection = db["Users"]
+medical_history_collection = db["MedicalHistory"]
+prescriptions_collection = db["Prescriptions"]
+appointments_collection = db["Appointments"]
+medical_records_collection = db["MedicalRecords"]
+billing_collection = db["Billing"]
+test_results_collection = db["TestResults"]
+messages_collection = db["Messages"]
+consultations_collection = db["Consultations"]
+billing_rollups_collection = db["BillingDailyRollups"]
+conversations_collection = db["Conversations"]
+doctor_schedules_collection = db["DoctorSchedules"]
+event_tickets_collection = db["EventTickets"]
@@ -0,0 +1,7 @@
+from pymongo import AsyncMongoClient
+from core.mongodb import MONGO_URI, LazyClient, LazyDatabase, client_options
+
+# Async MongoDB connection for the ASGI views; created on first use in each worker
+# process and bound to that worker's event loop
+client = LazyClient(lambda: AsyncMongoClient(MONGO_URI, **client_options()))
+db = LazyDatabase(client)
@@ -0,0 +1,466 @@
+"""
+Async variants of the `core` views, served instead of the sync ones when ASYNC_VIEWS is on.
+
+Read endpoints talk to MongoDB through the async client so a slow query only parks
+its own coroutine. Write endpoints keep their sync implementation and run on the
+thread pool, off the event loop.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async, markcoroutinefunction
+from bson import ObjectId
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from pymongo import ASCENDING, DESCENDING
+from core import async_collections, user_store
+from core import users, medical_records, prescriptions, appointments, billings, test_results, \
+messages, consultations, billing_analytics, conversations, schedules, calendars
+from core.users import jwt_required
+from core.hydration import ahydrate_users
+from core.pagination import InvalidPageRequest, page_params, afind_page
+from core.streaming import wants_stream, astream_response
+from core.responses import BSONResponse
+from core.user_directory import user_directory, is_cached_role, directory_page
+from core.conditional import document_validator, etag_for, not_modified, page_etag, page_validator, with_etag
+from core.calendars import InvalidDateFilter, date_status_filters
+
+
+def offload(view):
+    """Serve a blocking view from the event loop by running it on the thread pool."""
+    # The views only use pymongo, which is thread-safe, so they need no dedicated thread
+    threaded_view = sync_to_async(view, thread_sensitive=False)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await threaded_view(request, *args, **kwargs)
+    return markcoroutinefunction(wrapper)
+
+
+def _page_or_error(request):
+    try:
+        return page_params(request), None
+    except InvalidPageRequest as e:
+        return None, JsonResponse({"error": str(e)}, status=400)
+
+
+# Write endpoints
+create_user_view = offload(users.create_user_view)
+register_user = offload(users.register_user)
+authenticate_user = offload(users.authenticate_user)
+post_medical_record = offload(medical_records.post_medical_record)
+post_medical_records_bulk = offload(medical_records.post_medical_records_bulk)
+post_medical_history = offload(medical_records.post_medical_history)
+post_prescription = offload(prescriptions.post_prescription)
+post_prescriptions_bulk = offload(prescriptions.post_prescriptions_bulk)
+book_appointment = offload(appointments.book_appointment)
+update_appointment = offload(appointments.update_appointment)
+cancel_appointment = offload(appointments.cancel_appointment)
+manage_billing = offload(billings.manage_billing)
+post_test_result = offload(test_results.post_test_result)
+post_test_results_bulk = offload(test_results.post_test_results_bulk)
+send_message = offload(messages.send_message)
+mark_threads_read = offload(conversations.mark_threads_read)
+post_meeting_link = offload(consultations.post_meeting_link)
+doctor_schedule = offload(schedules.doctor_schedule)
+get_free_slots = offload(schedules.get_free_slots)
+
+# Admin analytics read small rollup sets; not worth a second implementation
+get_revenue = offload(billing_analytics.get_revenue)
+get_payment_methods = offload(billing_analytics.get_payment_methods)
+get_outstanding_balances = offload(billing_analytics.get_outstanding_balances)
+
+
+async def get_users_view(request):
+    """Retrieve users from MongoDB, optionally filtered by role, and exclude the password field."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        query = {}
+        role = request.GET.get("role")
+        if role:
+            query["role"] = role
+
+        if wants_stream(request):
+            cursor = user_store.ausers_cursor(query)
+
+            async def format_batch(batch):
+                return batch
+            return astream_response(request, cursor, "users", format_batch)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        if is_cached_role(role):
+            directory, validator = await user_directory.aget(role)
+            found, next_cursor = directory_page(directory, page)
+        else:
+            found, next_cursor = await user_store.afind_users_page(query, page)
+            validator = page_validator(found, next_cursor)
+
+        etag = etag_for(request, validator)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        return with_etag(BSONResponse({"users": found, "next_cursor": next_cursor}, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+async def get_user_by_id_view(request, user_id):
+    """Retrieve a user by their ID from MongoDB without returning the password."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        user = await user_store.aget_user(user_id, "profile")
+        if not user:
+            return JsonResponse({"error": "User not found"}, status=404)
+        etag = etag_for(request, document_validator(user))
+        response = not_modified(request, etag)
+        if response:
+            return response
+        return with_etag(BSONResponse({"user": user}, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_medical_records(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        role = request.principal.role
+        query = medical_records.medical_records_query(role, request.user_id)
+        if query is None:
+            return JsonResponse({"error": "Unauthorized access"}, status=403)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        records, next_cursor = await afind_page(async_collections.medical_records_collection, query, page)
+        etag = page_etag(request, records, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        users_by_id = await ahydrate_users(records, *medical_records.medical_record_participant_fields(role))
+        return with_etag(BSONResponse({
+            "medical_records": medical_records.format_medical_records(records, role, users_by_id),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_patient_prescriptions(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        if request.principal.role != "patient":
+            return JsonResponse({"error": "Only patients can view their prescriptions"}, status=403)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        query = {"patient_id": ObjectId(request.user_id)}
+        found, next_cursor = await afind_page(async_collections.prescriptions_collection, query, page)
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        doctors = await ahydrate_users(found, "doctor_id")
+        return with_etag(BSONResponse({
+            "prescriptions": prescriptions.format_prescriptions(found, doctors),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_appointments(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        role = request.principal.role
+        query = appointments.appointments_query(role, request.user_id)
+        if query is None:
+            return JsonResponse({"error": "Unauthorized access"}, status=403)
+        try:
+            query.update(date_status_filters(request, "appointment_date"))
+        except InvalidDateFilter as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        found, next_cursor = await afind_page(
+            async_collections.appointments_collection, query, page, sort_key="appointment_date"
+        )
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        users_by_id = await ahydrate_users(found, *appointments.appointment_participant_fields(role))
+        return with_etag(BSONResponse({
+            "appointments": appointments.format_appointments(found, role, users_by_id),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_user_bills(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        user_role = request.principal.role
+        query = billings.bills_query(user_role, request.user_id, request.GET.get("payment_status"))
+        if query is None:
+            return JsonResponse({"error": "Unauthorized access"}, status=403)
+
+        async def format_batch(bills):
+            users_by_id = await ahydrate_users(bills, *billings.bill_participant_fields(user_role))
+            return billings.format_bills(bills, user_role, users_by_id)
+
+        if wants_stream(request):
+            cursor = async_collections.billing_collection.find(query).sort("_id", ASCENDING)
+            return astream_response(request, cursor, "bills", format_batch)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        bills, next_cursor = await afind_page(async_collections.billing_collection, query, page)
+        etag = page_etag(request, bills, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        return with_etag(BSONResponse({"bills": await format_batch(bills), "next_cursor": next_cursor}, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_test_results(request):
+    try:
+        user_role = request.principal.role
+        query = test_results.test_results_query(user_role, request.user_id)
+        if query is None:
+            return JsonResponse({"error": "Unauthorized access"}, status=403)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        found, next_cursor = await afind_page(async_collections.test_results_collection, query, page)
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        users_by_id = await ahydrate_users(found, test_results.test_result_participant_field(user_role))
+        return with_etag(BSONResponse({
+            "test_results": test_results.format_test_results(found, user_role, users_by_id),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_messages(request):
+    try:
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        query = {"receiver_id": ObjectId(request.user_id)}
+        found, next_cursor = await afind_page(
+            async_collections.messages_collection, query, page, sort_key="sent_at", direction=DESCENDING
+        )
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        senders = await ahydrate_users(found, "sender_id", view="display_name")
+        return with_etag(
+            BSONResponse({"messages": messages.format_messages(found, senders), "next_cursor": next_cursor}, status=200), etag
+        )
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_calendar(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        role = request.principal.role
+        if calendars.participant_query(role, request.user_id) is None:
+            return JsonResponse({"error": "Unauthorized role"}, status=403)
+        try:
+            start, end, view = calendars.calendar_window(request)
+        except InvalidDateFilter as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        appointment_query, consultation_query = calendars.calendar_queries(role, request.user_id, start, end)
+        found_appointments = await (
+            async_collections.appointments_collection.find(appointment_query, calendars.APPOINTMENT_CALENDAR_PROJECTION)
+            .sort("appointment_date", ASCENDING).limit(calendars.CALENDAR_MAX_ENTRIES + 1).to_list()
+        )
+        found_consultations = await (
+            async_collections.consultations_collection.find(consultation_query, calendars.CONSULTATION_CALENDAR_PROJECTION)
+            .sort("consultation_date", ASCENDING).limit(calendars.CALENDAR_MAX_ENTRIES + 1).to_list()
+        )
+        etag = etag_for(request, page_validator(found_appointments), page_validator(found_consultations))
+        response = not_modified(request, etag)
+        if response:
+            return response
+        other_field = "patient_id" if role == "doctor" else "doctor_id"
+        names = await ahydrate_users(
+            found_appointments + found_consultations, other_field, view="display_name"
+        )
+        return with_etag(BSONResponse(
+            calendars.build_calendar(role, found_appointments, found_consultations, names, start, end, view), status=200
+        ), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_conversations(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        query = {"participants": ObjectId(request.user_id)}
+        found, next_cursor = await afind_page(
+            async_collections.conversations_collection, query, page,
+            sort_key="last_message_at", direction=DESCENDING
+        )
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        return with_etag(BSONResponse({
+            "conversations": conversations.format_conversations(found, request.user_id),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_thread_messages(request, thread_id):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        error = conversations.thread_access_error(thread_id, request.user_id)
+        if error:
+            return error
+        thread_id = conversations.canonical_thread_id(thread_id)
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        conversation = await async_collections.conversations_collection.find_one({"_id": thread_id}, {"names": 1})
+        if not conversation:
+            return JsonResponse({"error": "Conversation not found"}, status=404)
+
+        found, next_cursor = await afind_page(
+            async_collections.messages_collection, {"thread_id": thread_id}, page,
+            sort_key="sent_at", direction=DESCENDING
+        )
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        return with_etag(BSONResponse({
+            "thread_id": thread_id,
+            "messages": conversations.format_thread_messages(found, conversation.get("names", {}), request.user_id),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_meeting_details(request, consultation_id):
+    try:
+        if not ObjectId.is_valid(consultation_id):
+            return JsonResponse({"error": "Invalid consultation ID format"}, status=400)
+
+        user_role = request.principal.role
+        if user_role not in ["doctor", "patient"]:
+            return JsonResponse({"error": "Unauthorized role"}, status=403)
+
+        consultation = await async_collections.consultations_collection.find_one({"_id": ObjectId(consultation_id)})
+        error = consultations.meeting_access_error(consultation, request.user_id)
+        if error:
+            return error
+
+        etag = etag_for(request, document_validator(consultation))
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        other_user = await user_store.aget_user(
+            consultation.get(consultations.other_participant_field(user_role)), "clinical_summary"
+        )
+        return with_etag(
+            BSONResponse(consultations.format_meeting_details(consultation, user_role, other_user), status=200), etag
+        )
+    except Exception as e:
+        return JsonResponse({"error": f"Internal server error: {str(e)}"}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+async def get_user_consultations(request):
+    try:
+        user_role = request.principal.role
+        if user_role not in ["doctor", "patient"]:
+            return JsonResponse({"error": "Unauthorized role"}, status=403)
+
+        user_id = ObjectId(request.user_id)
+        query = {"doctor_id": user_id} if user_role == "doctor" else {"patient_id": user_id}
+        try:
+            query.update(date_status_filters(request, "consultation_date"))
+        except InvalidDateFilter as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        page, error = _page_or_error(request)
+        if error:
+            return error
+
+        found, next_cursor = await afind_page(
+            async_collections.consultations_collection, query, page,
+            sort_key="consultation_date", direction=DESCENDING
+        )
+        etag = page_etag(request, found, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+        participants = await ahydrate_users(found, consultations.other_participant_field(user_role))
+        return with_etag(BSONResponse({
+            "consultations": consultations.format_consultations(found, user_role, participants),
+            "next_cursor": next_cursor
+        }, status=200), etag)
+    except Exception as e:
+        return JsonResponse({"error": "Internal server error"}, status=500)
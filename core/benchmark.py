@@ -0,0 +1,408 @@
+"""
+Endpoint benchmarks for every route in core/urls.py.
+
+`seed` fills a dedicated database with core.synthetic, and `run` drives each
+`Scenario` through Django's test client with a pool of authenticated callers. Requests go through the full
+middleware and URL stack, so the numbers include authentication, metrics,
+hydration and serialization, just not the network or the WSGI/ASGI server.
+
+Per scenario the report has latency percentiles, throughput and the MongoDB
+round trips per request taken from RequestMetricsMiddleware. Round trips do not
+depend on the machine, so unlike latencies they are compared exactly against a
+baseline. The `events/` stream is long-lived and is not benchmarked.
+"""
+import asyncio
+import itertools
+import json
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+from django.conf import settings
+from django.test import AsyncClient, Client
+from core import collections as c
+from core import synthetic
+from core.conversations import thread_id_for
+from core.middleware import HTTP_MONGO_COMMANDS
+from core.mongodb import client, db
+from core.schedules import default_schedule, slot_key
+from core.synthetic import weekday_slots
+from core.versioning import FIRST_VERSION
+
+API_PREFIX = "/api/"
+
+# Latency regressions smaller than this are noise, whatever the percentage
+NOISE_FLOOR_MS = 1.0
+
+# Patients per unit of --scale; the other volumes follow core.synthetic's defaults
+PATIENTS_PER_SCALE = 1000
+
+
+class BenchmarkError(Exception):
+    """Raised when the benchmark cannot run against the configured database."""
+
+
+def check_database(force=False):
+    """Refuse to seed (and drop) a database that does not look like a scratch one."""
+    if "bench" not in db.name and not force:
+        raise BenchmarkError(
+            f"Refusing to reset database {db.name!r}; point MONGO_DATABASE at a database "
+            "whose name contains 'bench' or pass --force."
+        )
+
+
+def seed(scale=1, seed_value=0):
+    """Replace the database's contents with `scale` units of synthetic data; returns the counts."""
+    client.drop_database(db.name)
+    return synthetic.generate(seed=seed_value, patients=PATIENTS_PER_SCALE * scale)
+
+
+class BenchmarkContext:
+    """Ids and access tokens of the benchmark callers, plus per-request unique values."""
+
+    def __init__(self):
+        # The patient and doctor of the first consultation that also has an appointment and a record
+        pair = None
+        for consultation in c.consultations_collection.find({}, {"patient_id": 1, "doctor_id": 1}).sort("_id", 1).limit(100):
+            query = {"patient_id": consultation["patient_id"], "doctor_id": consultation["doctor_id"]}
+            appointment = c.appointments_collection.find_one(query, {"_id": 1})
+            record = c.medical_records_collection.find_one(query, {"_id": 1})
+            if appointment and record:
+                pair = consultation, appointment, record
+                break
+        if pair is None:
+            raise BenchmarkError("The benchmark database has not been seeded; run without --no-seed.")
+        consultation, appointment, record = pair
+        patient_id, doctor_id = consultation["patient_id"], consultation["doctor_id"]
+        self.consultation_id = str(consultation["_id"])
+        self.appointment_id = str(appointment["_id"])
+        self.medical_record_id = str(record["_id"])
+        self.thread_id = thread_id_for(patient_id, doctor_id)
+
+        callers = {
+            "patient": c.users_collection.find_one({"_id": patient_id}, {"username": 1}),
+            "doctor": c.users_collection.find_one({"_id": doctor_id}, {"username": 1}),
+            "receptionist": c.users_collection.find_one({"username": synthetic.username("receptionist", 0)}, {"username": 1}),
+            "admin": c.users_collection.find_one({"username": synthetic.username("admin", 0)}, {"username": 1}),
+        }
+        if not all(callers.values()):
+            raise BenchmarkError("The benchmark database has no receptionist or admin; run without --no-seed.")
+        self.ids = {role: str(user["_id"]) for role, user in callers.items()}
+        self.usernames = {role: user["username"] for role, user in callers.items()}
+        self.tokens = {role: self._login(name) for role, name in self.usernames.items()}
+
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # Bookings start a year out, after anything an earlier run booked
+        first_day = date.today() + timedelta(days=365)
+        latest = c.appointments_collection.find_one({"doctor_id": doctor_id}, {"appointment_date": 1},
+                                                    sort=[("appointment_date", -1)])
+        if latest and latest["appointment_date"].date() >= first_day:
+            first_day = latest["appointment_date"].date() + timedelta(days=1)
+        self._free_slots = weekday_slots(default_schedule(), first_day, 1)
+
+    @staticmethod
+    def _login(username):
+        response = Client().post(
+            f"{API_PREFIX}login/",
+            json.dumps({"username": username, "password": synthetic.SYNTHETIC_PASSWORD}),
+            content_type="application/json",
+        )
+        if response.status_code != 200:
+            raise BenchmarkError(f"Could not log in as {username}: {response.status_code} {response.content[:200]!r}")
+        return response.json()["access_token"]
+
+    def unique(self):
+        with self._lock:
+            return next(self._counter)
+
+    def free_slot(self):
+        """A slot of the benchmark doctor that no earlier request has booked."""
+        with self._lock:
+            return next(self._free_slots)
+
+
+class Scenario:
+    """One route as one kind of caller: `build(ctx)` returns `(path, body)` for a request.
+
+    `prepare(ctx)`, if given, runs untimed before each request and returns keyword
+    arguments for `build`, for requests that consume something (a bill to pay, an
+    appointment to cancel).
+    """
+
+    def __init__(self, name, method, role, build, expect=200, prepare=None):
+        self.name = name
+        self.method = method
+        self.role = role
+        self.build = build
+        self.expect = expect
+        self.prepare = prepare
+
+
+def _bulk(make):
+    return lambda ctx: {"items": [make(ctx) for _ in range(50)]}
+
+
+def _record(ctx):
+    return {"patient_id": ctx.ids["patient"], "record_type": "Visit Note",
+            "description": "Benchmark visit", "file_url": "https://files.bench.example/visit.pdf"}
+
+
+def _prescription(ctx):
+    return {"patient_id": ctx.ids["patient"],
+            "medications": [{"name": "Metformin", "dosage": "500mg", "frequency": "daily"}]}
+
+
+def _test_result(ctx):
+    return {"medical_record_id": ctx.medical_record_id, "patient_id": ctx.ids["patient"],
+            "test_name": "CBC", "test_date": "2024-05-01", "results": {"hemoglobin": 13.5}}
+
+
+def _new_user(ctx, role="patient"):
+    n = ctx.unique()
+    return {"username": f"bench-new-{time.time_ns()}-{n}", "password": synthetic.SYNTHETIC_PASSWORD, "role": role,
+            "personal_details": {"first_name": "New", "last_name": f"User{n}"},
+            "contact": {"email": f"new{n}@bench.example"}}
+
+
+def _unpaid_bill(ctx):
+    result = c.billing_collection.insert_one({
+        "patient_id": ObjectId(ctx.ids["patient"]), "total_amount": 100, "payment_status": "Unpaid",
+        "services": ["Consultation"], "created_at": datetime.utcnow(), "version": FIRST_VERSION,
+    })
+    return {"billing_id": str(result.inserted_id)}
+
+
+def _cancellable_appointment(ctx):
+    slot = ctx.free_slot()
+    result = c.appointments_collection.insert_one({
+        "patient_id": ObjectId(ctx.ids["patient"]), "doctor_id": ObjectId(ctx.ids["doctor"]),
+        "appointment_date": slot, "slot_key": slot_key(ctx.ids["doctor"], slot),
+        "status": "Scheduled", "notes": "", "version": FIRST_VERSION,
+    })
+    return {"appointment_id": str(result.inserted_id)}
+
+
+def _today():
+    return date.today().isoformat()
+
+
+SCENARIOS = [
+    Scenario("login", "POST", None,
+             lambda ctx: ("login/", {"username": ctx.usernames["patient"], "password": synthetic.SYNTHETIC_PASSWORD})),
+    Scenario("create_user", "POST", None, lambda ctx: ("users/", _new_user(ctx)), expect=201),
+    Scenario("register_user", "POST", "admin", lambda ctx: ("register/user/", _new_user(ctx)), expect=201),
+    Scenario("list_users", "GET", "admin", lambda ctx: ("all/users/", None)),
+    Scenario("list_doctors", "GET", "patient", lambda ctx: ("all/users/?role=doctor", None)),
+    Scenario("get_user", "GET", "patient", lambda ctx: (f"users/{ctx.ids['doctor']}/", None)),
+    Scenario("post_medical_record", "POST", "doctor",
+             lambda ctx: ("post/medical-records/", _record(ctx)), expect=201),
+    Scenario("post_medical_records_bulk", "POST", "doctor",
+             lambda ctx: ("post/medical-records/bulk/", _bulk(_record)(ctx)), expect=201),
+    Scenario("list_medical_records", "GET", "patient", lambda ctx: ("get/user/medical-records/", None)),
+    Scenario("post_medical_history", "POST", "doctor",
+             lambda ctx: ("medical-history/", {"patient_id": ctx.ids["patient"], "conditions": ["Hypertension"],
+                                               "documents": ["https://files.bench.example/history.pdf"]}),
+             expect=201),
+    Scenario("post_prescription", "POST", "doctor",
+             lambda ctx: ("post/prescriptions/", _prescription(ctx)), expect=201),
+    Scenario("post_prescriptions_bulk", "POST", "doctor",
+             lambda ctx: ("post/prescriptions/bulk/", _bulk(_prescription)(ctx)), expect=201),
+    Scenario("list_prescriptions", "GET", "patient", lambda ctx: ("get/patient/prescriptions/", None)),
+    Scenario("book_appointment", "POST", "patient",
+             lambda ctx: ("book/appointments/", {"doctor_id": ctx.ids["doctor"],
+                                                 "appointment_date": ctx.free_slot().isoformat()}),
+             expect=201),
+    Scenario("list_appointments", "GET", "doctor", lambda ctx: ("get/user/appointments/", None)),
+    Scenario("update_appointment", "PATCH", "doctor",
+             lambda ctx: ("update/user/appointments/", {"appointment_id": ctx.appointment_id,
+                                                        "notes": f"Benchmark note {ctx.unique()}"})),
+    Scenario("cancel_appointment", "DELETE", "patient",
+             lambda ctx, appointment_id: (f"cancel/appointments/{appointment_id}/", None),
+             prepare=_cancellable_appointment),
+    Scenario("calendar_week", "GET", "doctor", lambda ctx: (f"get/calendar/?view=week&date={_today()}", None)),
+    Scenario("get_schedule", "GET", "doctor", lambda ctx: ("doctor/schedule/", None)),
+    Scenario("put_schedule", "PUT", "doctor", lambda ctx: ("doctor/schedule/", default_schedule())),
+    Scenario("free_slots", "GET", "patient",
+             lambda ctx: (f"doctors/{ctx.ids['doctor']}/slots/?from={_today()}"
+                          f"&to={(date.today() + timedelta(days=6)).isoformat()}", None)),
+    Scenario("post_bill", "POST", "receptionist",
+             lambda ctx: ("post/bill/", {"patient_id": ctx.ids["patient"], "total_amount": 150,
+                                         "services": ["Consultation"]}),
+             expect=201),
+    Scenario("pay_bill", "POST", "patient",
+             lambda ctx, billing_id: ("post/bill/", {"billing_id": billing_id, "payment_method": "card"}),
+             prepare=_unpaid_bill),
+    Scenario("list_bills", "GET", "patient", lambda ctx: ("get/user/bills/", None)),
+    Scenario("billing_revenue", "GET", "admin", lambda ctx: ("analytics/billing/revenue/?period=month", None)),
+    Scenario("billing_payment_methods", "GET", "admin", lambda ctx: ("analytics/billing/payment-methods/", None)),
+    Scenario("billing_outstanding", "GET", "admin", lambda ctx: ("analytics/billing/outstanding/", None)),
+    Scenario("post_test_result", "POST", "doctor",
+             lambda ctx: ("post/test/results/", _test_result(ctx)), expect=201),
+    Scenario("post_test_results_bulk", "POST", "doctor",
+             lambda ctx: ("post/test/results/bulk/", _bulk(_test_result)(ctx)), expect=201),
+    Scenario("list_test_results", "GET", "patient", lambda ctx: ("get/user/test/results/", None)),
+    Scenario("send_message", "POST", "patient",
+             lambda ctx: ("send/message/", {"receiver_id": ctx.ids["doctor"], "message": "Benchmark message"}),
+             expect=201),
+    Scenario("list_messages", "GET", "doctor", lambda ctx: ("get/message/", None)),
+    Scenario("list_conversations", "GET", "patient", lambda ctx: ("get/conversations/", None)),
+    Scenario("thread_messages", "GET", "patient",
+             lambda ctx: (f"get/conversations/{ctx.thread_id}/messages/", None)),
+    Scenario("mark_threads_read", "POST", "doctor",
+             lambda ctx: ("conversations/read/", {"thread_ids": [ctx.thread_id]})),
+    Scenario("post_meeting_link", "POST", "doctor",
+             lambda ctx: ("post/meeting/link/", {"patient_id": ctx.ids["patient"],
+                                                 "meeting_link": "https://meet.bench.example/new",
+                                                 "consultation_date": datetime.utcnow().isoformat()}),
+             expect=201),
+    Scenario("meeting_detail", "GET", "patient", lambda ctx: (f"get/meeting/link/{ctx.consultation_id}/", None)),
+    Scenario("list_meetings", "GET", "patient", lambda ctx: ("get/meeting/link/", None)),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _mongo_commands():
+    samples = HTTP_MONGO_COMMANDS.samples().values()
+    return sum(state["sum"] for state in samples), sum(state["count"] for state in samples)
+
+
+def _request_args(scenario, ctx, kwargs):
+    path, body = scenario.build(ctx, **kwargs)
+    headers = {"Authorization": f"Bearer {ctx.tokens[scenario.role]}"} if scenario.role else {}
+    data = json.dumps(body) if body is not None else ""
+    return scenario.method, f"{API_PREFIX}{path}", data, headers
+
+
+def _summarize(scenario, results, elapsed, mongo_before, mongo_after):
+    latencies = sorted(latency for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    commands = mongo_after[0] - mongo_before[0]
+    requests = mongo_after[1] - mongo_before[1]
+    return {
+        "method": scenario.method,
+        "role": scenario.role,
+        "requests": len(results),
+        "errors": sum(count for status, count in statuses.items() if status != str(scenario.expect)),
+        "status_codes": statuses,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else 0.0,
+        "mongo_round_trips": round(commands / requests, 2) if requests else 0.0,
+    }
+
+
+def run_scenario(scenario, ctx, requests=200, concurrency=4, warmup=10):
+    """Time `requests` calls of `scenario` from `concurrency` threads of sync clients."""
+    local = threading.local()
+
+    def call(_):
+        kwargs = scenario.prepare(ctx) if scenario.prepare else {}
+        method, path, data, headers = _request_args(scenario, ctx, kwargs)
+        if not hasattr(local, "client"):
+            local.client = Client()
+        started = time.perf_counter()
+        response = local.client.generic(method, path, data, content_type="application/json", headers=headers)
+        return time.perf_counter() - started, response.status_code
+
+    for i in range(warmup):
+        call(i)
+    mongo_before = _mongo_commands()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+    return _summarize(scenario, results, elapsed, mongo_before, _mongo_commands())
+
+
+def arun_scenario(scenario, ctx, requests=200, concurrency=4, warmup=10):
+    """`run_scenario` against the async views: `concurrency` requests in flight on one event loop."""
+
+    async def call(client, semaphore):
+        async with semaphore:
+            kwargs = await asyncio.to_thread(scenario.prepare, ctx) if scenario.prepare else {}
+            method, path, data, headers = _request_args(scenario, ctx, kwargs)
+            started = time.perf_counter()
+            response = await client.generic(method, path, data, content_type="application/json", headers=headers)
+            return time.perf_counter() - started, response.status_code
+
+    async def main():
+        client, semaphore = AsyncClient(), asyncio.Semaphore(concurrency)
+        for _ in range(warmup):
+            await call(client, semaphore)
+        mongo_before = _mongo_commands()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(client, semaphore) for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+        return _summarize(scenario, results, elapsed, mongo_before, _mongo_commands())
+
+    return asyncio.run(main())
+
+
+def select(names=None):
+    """The scenarios named in `names` (all of them if empty), in SCENARIOS order."""
+    if not names:
+        return list(SCENARIOS)
+    known = {scenario.name for scenario in SCENARIOS}
+    unknown = set(names) - known
+    if unknown:
+        raise BenchmarkError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+    return [scenario for scenario in SCENARIOS if scenario.name in names]
+
+
+def run(scenarios, requests=200, concurrency=4, warmup=10, on_result=None):
+    """Run every scenario in turn; returns the report (`meta` plus `scenarios` by name)."""
+    ctx = BenchmarkContext()
+    runner = arun_scenario if settings.ASYNC_VIEWS else run_scenario
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = runner(scenario, ctx, requests, concurrency, warmup)
+        if on_result:
+            on_result(scenario.name, results[scenario.name])
+    return {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "views": "async" if settings.ASYNC_VIEWS else "sync",
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "database": db.name,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "scenarios": results,
+    }
+
+
+def compare(current, baseline, max_regression=0.2):
+    """Human-readable regressions of `current` against `baseline`; empty when there are none.
+
+    Latency counts as regressed when p95 grows by more than `max_regression` (a
+    fraction) and by at least NOISE_FLOOR_MS; round trips and errors must not grow
+    at all.
+    """
+    regressions = []
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + max_regression) and now["p95_ms"] - before["p95_ms"] >= NOISE_FLOOR_MS:
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now["mongo_round_trips"] > before["mongo_round_trips"]:
+            regressions.append(f"{name}: MongoDB round trips {before['mongo_round_trips']} -> {now['mongo_round_trips']}")
+        if now["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {now['errors']}")
+    return regressions
@@ -0,0 +1,316 @@
+"""
+Billing analytics for admins: revenue per day/week/month, outstanding balance per
+patient and the payment-method breakdown.
+
+Revenue and payment methods are read from BillingDailyRollups, one small document
+per calendar day (UTC) that manage_billing updates with `$inc` whenever a bill is
+created or paid, so a dashboard reads a few hundred rows instead of every bill.
+`python manage.py rebuild_billing_rollups` recomputes them from Billing, with
+bill writes stopped.
+Outstanding balances are aggregated from the unpaid bills directly.
+"""
+import logging
+from datetime import datetime, timedelta
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+from core.collections import db, billing_collection, billing_rollups_collection
+from core.indexes import REQUIRED_INDEXES
+from core.users import jwt_required
+from core.hydration import hydrate_users, lookup, full_name
+from core.responses import BSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Where rebuild_rollups writes the new rollups before renaming them into place
+ROLLUP_STAGING = "BillingDailyRollups_rebuild"
+
+# Rollup field holding the start of each reporting period
+PERIOD_FIELDS = {"day": "date", "week": "week", "month": "month"}
+
+
+class InvalidAnalyticsRequest(ValueError):
+    """Raised for unusable query parameters."""
+
+
+def _day(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def rollup_keys(moment):
+    """The rollup `_id` for `moment` and the period starts stored on it."""
+    day = _day(moment)
+    return day.strftime("%Y-%m-%d"), {
+        "date": day,
+        "week": day - timedelta(days=day.weekday()),  # ISO weeks start on Monday
+        "month": day.replace(day=1),
+    }
+
+
+def method_key(payment_method):
+    # Payment methods become field names; keep them valid and un-nested
+    return str(payment_method).replace(".", "_").replace("$", "_") or "unknown"
+
+
+def _apply(moment, increments):
+    rollup_id, periods = rollup_keys(moment)
+    try:
+        billing_rollups_collection.update_one(
+            {"_id": rollup_id},
+            {"$inc": increments, "$setOnInsert": periods},
+            upsert=True
+        )
+    except PyMongoError:
+        # The bill itself is stored; the rollup catches up on the next rebuild
+        logger.exception("Failed to update billing rollup %s; run rebuild_billing_rollups", rollup_id)
+
+
+def record_bill_created(bill):
+    # Like rebuild_rollups, bills without a creation date are not counted
+    if not isinstance(bill.get("created_at"), datetime):
+        return
+    amount = bill["total_amount"]
+    _apply(bill["created_at"], {"billed_amount": amount, "billed_count": 1})
+
+
+def record_bill_paid(bill, payment_method, paid_at):
+    amount = bill["total_amount"]
+    method = method_key(payment_method)
+    _apply(paid_at, {
+        "paid_amount": amount,
+        "paid_count": 1,
+        f"payment_methods.{method}.amount": amount,
+        f"payment_methods.{method}.count": 1,
+    })
+
+
+def rebuild_rollups():
+    """Recompute every rollup document from Billing.
+
+    Returns `(days, undated)`: the number of days written and the number of bills
+    left out of the billed totals because they have no `created_at` date.
+
+    Bills created or paid while this runs may be left out: their `$inc` lands on
+    the collection this replaces. Run it while bill writes are stopped.
+    """
+    rollups = {}
+
+    def rollup_for(day):
+        rollup_id, periods = rollup_keys(day)
+        return rollups.setdefault(rollup_id, {
+            "_id": rollup_id, **periods,
+            "billed_amount": 0, "billed_count": 0, "paid_amount": 0, "paid_count": 0,
+            "payment_methods": {}
+        })
+
+    # Bills created per day
+    dated = {"created_at": {"$type": "date"}}
+    billed = billing_collection.aggregate([
+        {"$match": dated},
+        {"$group": {
+            "_id": {"$dateToString": {"date": "$created_at", "format": "%Y-%m-%d"}},
+            "amount": {"$sum": "$total_amount"},
+            "count": {"$sum": 1}
+        }}
+    ])
+    for row in billed:
+        rollup = rollup_for(datetime.strptime(row["_id"], "%Y-%m-%d"))
+        rollup["billed_amount"] += row["amount"]
+        rollup["billed_count"] += row["count"]
+
+    # Bills paid per day and method
+    paid = billing_collection.aggregate([
+        {"$match": {"payment_status": "Paid", "paid_at": {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"date": "$paid_at", "format": "%Y-%m-%d"}},
+                "method": "$payment_method"
+            },
+            "amount": {"$sum": "$total_amount"},
+            "count": {"$sum": 1}
+        }}
+    ])
+    for row in paid:
+        rollup = rollup_for(datetime.strptime(row["_id"]["day"], "%Y-%m-%d"))
+        rollup["paid_amount"] += row["amount"]
+        rollup["paid_count"] += row["count"]
+        method = rollup["payment_methods"].setdefault(method_key(row["_id"].get("method")), {"amount": 0, "count": 0})
+        method["amount"] += row["amount"]
+        method["count"] += row["count"]
+
+    # Build the new set aside and swap it in with one rename, so readers see either the
+    # old rollups or the new ones, never a half-written mix
+    staging = db[ROLLUP_STAGING]
+    staging.drop()
+    staging.create_indexes(REQUIRED_INDEXES[billing_rollups_collection.name])
+    if rollups:
+        staging.insert_many(list(rollups.values()), ordered=False)
+    staging.rename(billing_rollups_collection.name, dropTarget=True)
+    return len(rollups), billing_collection.count_documents({"$nor": [dated]})
+
+
+def _date_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return _day(datetime.fromisoformat(value))
+    except ValueError:
+        raise InvalidAnalyticsRequest(f"Invalid {name} date, expected YYYY-MM-DD")
+
+
+def date_range_match(request):
+    """`$match` on rollup dates for the inclusive ?from=&to= range."""
+    start, end = _date_param(request, "from"), _date_param(request, "to")
+    match = {}
+    if start:
+        match["$gte"] = start
+    if end:
+        match["$lte"] = end
+    return {"date": match} if match else {}
+
+
+def revenue_pipeline(period, match):
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": f"${PERIOD_FIELDS[period]}",
+            "billed_amount": {"$sum": "$billed_amount"},
+            "billed_count": {"$sum": "$billed_count"},
+            "paid_amount": {"$sum": "$paid_amount"},
+            "paid_count": {"$sum": "$paid_count"}
+        }},
+        {"$sort": {"_id": ASCENDING}}
+    ]
+
+
+def payment_methods_pipeline(match):
+    return [
+        {"$match": match},
+        {"$project": {"methods": {"$objectToArray": {"$ifNull": ["$payment_methods", {}]}}}},
+        {"$unwind": "$methods"},
+        {"$group": {
+            "_id": "$methods.k",
+            "amount": {"$sum": "$methods.v.amount"},
+            "count": {"$sum": "$methods.v.count"}
+        }},
+        {"$sort": {"amount": -1}}
+    ]
+
+
+def outstanding_pipeline(limit):
+    return [
+        {"$match": {"payment_status": "Unpaid"}},
+        {"$group": {
+            "_id": "$patient_id",
+            "outstanding_amount": {"$sum": "$total_amount"},
+            "unpaid_bills": {"$sum": 1}
+        }},
+        {"$sort": {"outstanding_amount": -1}},
+        {"$limit": limit}
+    ]
+
+
+def _admin_error(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    if request.principal.role != "admin":
+        return JsonResponse({"error": "Only admins can view billing analytics"}, status=403)
+    return None
+
+
+@csrf_exempt
+@jwt_required
+def get_revenue(request):
+    error = _admin_error(request)
+    if error:
+        return error
+
+    try:
+        # Read the grouping period and date range
+        period = request.GET.get("period", "day")
+        if period not in PERIOD_FIELDS:
+            return JsonResponse({"error": f"period must be one of {', '.join(PERIOD_FIELDS)}"}, status=400)
+        try:
+            match = date_range_match(request)
+        except InvalidAnalyticsRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Sum the daily rollups into the requested periods
+        rows = billing_rollups_collection.aggregate(revenue_pipeline(period, match))
+
+        return BSONResponse({
+            "period": period,
+            "revenue": [{
+                "period_start": row["_id"].date(),
+                "billed_amount": row["billed_amount"],
+                "billed_count": row["billed_count"],
+                "paid_amount": row["paid_amount"],
+                "paid_count": row["paid_count"]
+            } for row in rows]
+        }, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+def get_payment_methods(request):
+    error = _admin_error(request)
+    if error:
+        return error
+
+    try:
+        try:
+            match = date_range_match(request)
+        except InvalidAnalyticsRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Sum each method's share across the daily rollups
+        rows = billing_rollups_collection.aggregate(payment_methods_pipeline(match))
+
+        return BSONResponse({
+            "payment_methods": [
+                {"payment_method": row["_id"], "amount": row["amount"], "count": row["count"]}
+                for row in rows
+            ]
+        }, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+def get_outstanding_balances(request):
+    error = _admin_error(request)
+    if error:
+        return error
+
+    try:
+        try:
+            limit = int(request.GET.get("limit", 100))
+        except ValueError:
+            return JsonResponse({"error": "limit must be an integer"}, status=400)
+        if limit <= 0:
+            return JsonResponse({"error": "limit must be positive"}, status=400)
+
+        # Sum unpaid bills per patient, largest balances first
+        rows = list(billing_collection.aggregate(outstanding_pipeline(limit)))
+
+        # Fetch the patients' names in one round trip
+        patients = hydrate_users(rows, "_id")
+
+        balances = []
+        for row in rows:
+            patient = lookup(patients, row["_id"])
+            balances.append({
+                "patient_id": row["_id"],
+                "patient_name": full_name(patient) if patient else None,
+                "outstanding_amount": row["outstanding_amount"],
+                "unpaid_bills": row["unpaid_bills"]
+            })
+
+        return BSONResponse({"outstanding": balances}, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
@@ -1,10 +1,23 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
 import json
 from datetime import datetime
-from core.collections import users_collection ,billing_collection
+from core.collections import billing_collection
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.streaming import wants_stream, stream_response
+from core.hydration import hydrate_users, lookup, billed_by, full_name
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+from core.billing_analytics import record_bill_created, record_bill_paid
+from core.versioning import FIRST_VERSION, NEXT_VERSION, InvalidVersion, requested_version, version_filter, \
+    conflict_response
+
+
+BILL_CHANGED_ERROR = "The bill was changed by someone else; reload it and try again"
+
 
 @jwt_required
 @csrf_exempt
@@ -13,12 +26,11 @@ def manage_billing(request):
         try:
             # Get the logged-in user's ID from the request
             user_id = request.user_id
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
 
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
-            user_role = user.get("role")
+            user_role = user.role
 
             # Parse request data
             data = json.loads(request.body)
@@ -33,14 +45,22 @@ def manage_billing(request):
                 if not all([patient_id, total_amount, services]):
                     return JsonResponse({"error": "Missing required fields for billing"}, status=400)
 
+                # Amounts are summed into the revenue rollups, so they must be numbers
+                if isinstance(total_amount, bool) or not isinstance(total_amount, (int, float)):
+                    return JsonResponse({"error": "total_amount must be a number"}, status=400)
+
                 billing = {
                     "patient_id": ObjectId(patient_id),
                     "total_amount": total_amount,
                     "payment_status": "Unpaid",
                     "services": services,
-                    "created_at": datetime.utcnow()
+                    "created_at": datetime.utcnow(),
+                    "version": FIRST_VERSION
                 }
                 result = billing_collection.insert_one(billing)
+
+                # Count the new bill in its day's rollup
+                record_bill_created(billing)
                 return JsonResponse({"message": "Billing added successfully", "billing_id": str(result.inserted_id)}, status=201)
 
             elif user_role == "patient":
@@ -48,15 +68,35 @@ def manage_billing(request):
                 if not all([billing_id, payment_method]):
                     return JsonResponse({"error": "Billing ID and Payment method are required"}, status=400)
 
-                billing = billing_collection.find_one({"_id": ObjectId(billing_id), "patient_id": ObjectId(user_id)})
-                if not billing:
-                    return JsonResponse({"error": "Billing record not found"}, status=404)
-
-                billing_collection.update_one(
-                    {"_id": ObjectId(billing_id)},
-                    {"$set": {"payment_status": "Paid", "payment_method": payment_method, "paid_at": datetime.utcnow()}}
+                # The version the patient last read, if they want a conflict rather than a silent no-op
+                try:
+                    version = requested_version(data)
+                except InvalidVersion as e:
+                    return JsonResponse({"error": str(e)}, status=400)
+
+                # Mark the bill paid and return it in one round trip, only if it is the
+                # patient's, still unpaid and still at the version they read
+                paid_at = datetime.utcnow()
+                billing = billing_collection.find_one_and_update(
+                    {"_id": ObjectId(billing_id), "patient_id": ObjectId(user_id), "payment_status": {"$ne": "Paid"},
+                     **version_filter(version)},
+                    {"$set": {"payment_status": "Paid", "payment_method": payment_method, "paid_at": paid_at, "updated_at": paid_at},
+                     **NEXT_VERSION},
+                    return_document=ReturnDocument.AFTER
                 )
-                return JsonResponse({"message": "Payment successful"}, status=200)
+
+                if billing is None:
+                    billing = billing_collection.find_one({"_id": ObjectId(billing_id), "patient_id": ObjectId(user_id)})
+                    if not billing:
+                        return JsonResponse({"error": "Billing record not found"}, status=404)
+                    # Already paid: a retry without a version still succeeds; one with a stale version is told what changed
+                    if version is not None:
+                        return conflict_response(BILL_CHANGED_ERROR, "billing", billing)
+                    return BSONResponse({"message": "Payment successful", "billing": billing}, status=200)
+
+                # Only the request that actually flipped the bill to Paid counts it as revenue
+                record_bill_paid(billing, payment_method, paid_at)
+                return BSONResponse({"message": "Payment successful", "billing": billing}, status=200)
 
             else:
                 return JsonResponse({"error": "Unauthorized action"}, status=403)
@@ -66,71 +106,98 @@ def manage_billing(request):
 
     return JsonResponse({"error": "Method not allowed"}, status=405)
 
-@jwt_required
-@csrf_exempt
+def bills_query(user_role, user_id, payment_status=None):
+    """Query for the bills `user_role` may list, or None if it may not list any."""
+    # Define the query based on user role
+    if user_role == "receptionist":
+        query = {"receptionist_id": ObjectId(user_id)}  # Receptionist sees bills they created
+    elif user_role == "patient":
+        query = {"patient_id": ObjectId(user_id)}  # Patient sees only their own bills
+    elif user_role == "admin":
+        query = {}  # Admin sees all bills
+    else:
+        return None
+
+    # Apply payment_status filter if provided in the request
+    if payment_status:
+        query["payment_status"] = payment_status  # Example: {"payment_status": "Unpaid"}
+    return query
+
+
+def bill_participant_fields(user_role):
+    # Patients see who billed them, receptionists see who was billed
+    if user_role == "patient":
+        return ("receptionist_id",)
+    elif user_role == "receptionist":
+        return ("patient_id",)
+    return ()
+
+
+def format_bills(bills, user_role, users):
+    """Shape raw bills for `user_role`, attaching the other party from a `hydrate_users` lookup."""
+    formatted_bills = []
+    for bill in bills:
+        # Look up patient and receptionist details
+        patient = lookup(users, bill["patient_id"])
+        receptionist = lookup(users, bill.get("receptionist_id"))
+
+        bill_data = {
+            "_id": bill["_id"],
+            "total_amount": bill["total_amount"],
+            "payment_status": bill["payment_status"],
+            "services": bill["services"],
+            "created_at": bill["created_at"],
+        }
+
+        if user_role == "patient" and receptionist:
+            # Patient sees who billed them
+            bill_data["billed_by"] = billed_by(receptionist)
+        elif user_role == "receptionist" and patient:
+            # Receptionist sees patient details
+            bill_data["billed_for"] = full_name(patient)
+
+        formatted_bills.append(bill_data)
+    return formatted_bills
 
 
+@jwt_required
+@csrf_exempt
 def get_user_bills(request):
     if request.method == "GET":
         try:
-            # Get logged-in user's ID and role
-            user_id = request.user_id
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            # The caller's identity and role come from the access token
+            user_role = request.principal.role
 
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            query = bills_query(user_role, request.user_id, request.GET.get("payment_status"))
+            if query is None:
+                return JsonResponse({"error": "Unauthorized access"}, status=403)
 
-            user_role = user.get("role")
-            query = {}
+            def format_batch(bills):
+                # Fetch every referenced patient and receptionist in one round trip
+                users = hydrate_users(bills, *bill_participant_fields(user_role))
+                return format_bills(bills, user_role, users)
 
-            # Define the query based on user role
-            if user_role == "receptionist":
-                query["receptionist_id"] = ObjectId(user_id)  # Receptionist sees bills they created
-            elif user_role == "patient":
-                query["patient_id"] = ObjectId(user_id)  # Patient sees only their own bills
-            elif user_role == "admin":
-                query = {}  # Admin sees all bills
-            else:
-                return JsonResponse({"error": "Unauthorized access"}, status=403)
+            # Large exports stream straight from the cursor instead of being paged
+            if wants_stream(request):
+                cursor = billing_collection.find(query).sort("_id", ASCENDING)
+                return stream_response(request, cursor, "bills", format_batch)
 
-            # Apply payment_status filter if provided in the request
-            payment_status = request.GET.get("payment_status")
-            if payment_status:
-                query["payment_status"] = payment_status  # Example: {"payment_status": "Unpaid"}
-
-            # Fetch bills from the database
-            bills = list(billing_collection.find(query))
-
-            # Format response
-            formatted_bills = []
-            for bill in bills:
-                # Fetch patient and receptionist details
-                patient = users_collection.find_one({"_id": bill["patient_id"]})
-                receptionist = users_collection.find_one({"_id": bill.get("receptionist_id")})
-
-                bill_data = {
-                    "_id": str(bill["_id"]),
-                    "total_amount": bill["total_amount"],
-                    "payment_status": bill["payment_status"],
-                    "services": bill["services"],
-                    "created_at": bill["created_at"].isoformat(),
-                }
+            # Read the requested page
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # Fetch one page of bills from the database
+            bills, next_cursor = find_page(billing_collection, query, page)
+
+            # A repeat load of an unchanged page skips hydration and serialization
+            etag = page_etag(request, bills, next_cursor)
+            response = not_modified(request, etag)
+            if response:
+                return response
 
-                if user_role == "patient" and receptionist:
-                    # Patient sees who billed them
-                    bill_data["billed_by"] = {
-                        "first_name": receptionist["personal_details"]["first_name"],
-                        "last_name": receptionist["personal_details"]["last_name"],
-                        "email": receptionist["contact"]["email"],
-                        "phone": receptionist["contact"]["phone"]
-                    }
-                elif user_role == "receptionist" and patient:
-                    # Receptionist sees patient details
-                    bill_data["billed_for"] = f"{patient['personal_details']['first_name']} {patient['personal_details']['last_name']}"
-
-                formatted_bills.append(bill_data)
-
-            return JsonResponse({"bills": formatted_bills}, status=200)
+            return with_etag(BSONResponse({"bills": format_batch(bills), "next_cursor": next_cursor}, status=200), etag)
 
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
@@ -0,0 +1,88 @@
+"""
+Helpers for the bulk ingestion endpoints.
+
+A bulk request body is `{"items": [...]}` (or a bare JSON array). Every item is
+validated on its own, the valid ones go to MongoDB in a single unordered
+`insert_many`, and the response reports one result per item, in request order,
+so a lab interface can retry exactly the items that failed.
+"""
+import json
+from django.conf import settings
+from django.http import JsonResponse
+from pymongo.errors import BulkWriteError
+
+
+class InvalidBulkRequest(ValueError):
+    """Raised when the body is not a usable list of items."""
+
+
+def bulk_items(request):
+    """The list of items in a bulk request body."""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        raise InvalidBulkRequest("Request body must be JSON")
+
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise InvalidBulkRequest("Expected a non-empty list of items")
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise InvalidBulkRequest(f"At most {settings.BULK_MAX_ITEMS} items per request")
+    return items
+
+
+def insert_items(collection, items, build_document):
+    """
+    Validate `items` with `build_document(item) -> (document, error)` and insert the
+    valid ones with one unordered `insert_many`. Returns one result dict per item.
+    """
+    results = [None] * len(items)
+    documents = []
+    positions = []  # Request index of each document in `documents`
+
+    # Validate every item before touching the database
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            document, error = None, "Item must be an object"
+        else:
+            document, error = build_document(item)
+        if error:
+            results[index] = {"index": index, "ok": False, "error": error}
+        else:
+            documents.append(document)
+            positions.append(index)
+
+    if not documents:
+        return results
+
+    # Unordered, so one bad document does not stop the rest of the batch
+    failed = {}
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            failed[write_error["index"]] = write_error.get("errmsg", "Write failed")
+
+    # insert_many fills in `_id` on each document, inserted or not
+    for offset, (index, document) in enumerate(zip(positions, documents)):
+        if offset in failed:
+            results[index] = {"index": index, "ok": False, "error": failed[offset]}
+        else:
+            results[index] = {"index": index, "ok": True, "id": str(document["_id"])}
+    return results
+
+
+def bulk_response(results):
+    """201 when every item was stored, 400 when none was, 207 for a partial batch."""
+    inserted = sum(1 for result in results if result["ok"])
+    if inserted == len(results):
+        status = 201
+    elif inserted == 0:
+        status = 400
+    else:
+        status = 207
+    return JsonResponse({
+        "inserted": inserted,
+        "failed": len(results) - inserted,
+        "results": results
+    }, status=status)
@@ -0,0 +1,178 @@
+"""
+Date-range and status filters for the appointment and consultation lists, and a
+compact day/week calendar.
+
+Every filter is applied on top of the caller's participant field, so each query
+is a bounded scan of a `(doctor_id|patient_id, <date>, _id)` index.
+"""
+from datetime import datetime, time, timedelta
+from bson import ObjectId
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from pymongo import ASCENDING
+from core.collections import appointments_collection, consultations_collection
+from core.users import jwt_required
+from core.hydration import hydrate_users, lookup, full_name
+from core.schedules import as_utc
+from core.responses import BSONResponse
+from core.conditional import etag_for, not_modified, page_validator, with_etag
+
+CALENDAR_VIEWS = {"day": 1, "week": 7}
+
+# Appointments, and separately consultations, shown in one calendar at most
+CALENDAR_MAX_ENTRIES = settings.API_MAX_PAGE_SIZE
+
+# Only what a calendar cell shows, plus `updated_at` for the ETag
+APPOINTMENT_CALENDAR_PROJECTION = {"appointment_date": 1, "status": 1, "patient_id": 1, "doctor_id": 1, "updated_at": 1}
+CONSULTATION_CALENDAR_PROJECTION = {
+    "consultation_date": 1, "status": 1, "patient_id": 1, "doctor_id": 1, "meeting_link": 1, "updated_at": 1
+}
+
+
+class InvalidDateFilter(ValueError):
+    """Raised for unusable from/to/status query parameters."""
+
+
+def _parse_bound(value, name, end=False):
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidDateFilter(f"Invalid {name}, expected an ISO date or datetime")
+    moment = as_utc(moment)
+    # A bare date as the upper bound includes that whole day
+    if end and len(value) == 10:
+        moment += timedelta(days=1)
+    return moment
+
+
+def date_status_filters(request, date_field):
+    """Query conditions for ?from=, ?to= (inclusive dates) and ?status=a,b on `date_field`."""
+    conditions = {}
+
+    date_range = {}
+    if request.GET.get("from"):
+        date_range["$gte"] = _parse_bound(request.GET["from"], "from")
+    if request.GET.get("to"):
+        date_range["$lt"] = _parse_bound(request.GET["to"], "to", end=True)
+    if "$gte" in date_range and "$lt" in date_range and date_range["$lt"] <= date_range["$gte"]:
+        raise InvalidDateFilter("to must not be before from")
+    if date_range:
+        conditions[date_field] = date_range
+
+    statuses = [status for status in request.GET.get("status", "").split(",") if status]
+    if len(statuses) == 1:
+        conditions["status"] = statuses[0]
+    elif statuses:
+        conditions["status"] = {"$in": statuses}
+    return conditions
+
+
+def participant_query(role, user_id):
+    """The caller's side of an appointment or consultation, or None for other roles."""
+    if role == "doctor":
+        return {"doctor_id": ObjectId(user_id)}
+    elif role == "patient":
+        return {"patient_id": ObjectId(user_id)}
+    return None
+
+
+def calendar_window(request):
+    """`(start, end, view)` for ?view=day|week&date=YYYY-MM-DD; weeks start on Monday."""
+    view = request.GET.get("view", "day")
+    if view not in CALENDAR_VIEWS:
+        raise InvalidDateFilter(f"view must be one of {', '.join(CALENDAR_VIEWS)}")
+    try:
+        day = datetime.fromisoformat(request.GET["date"]).date() if request.GET.get("date") else datetime.utcnow().date()
+    except ValueError:
+        raise InvalidDateFilter("Invalid date, expected YYYY-MM-DD")
+    if view == "week":
+        day -= timedelta(days=day.weekday())
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=CALENDAR_VIEWS[view]), view
+
+
+def calendar_entries(kind, documents, date_field, other_field, names):
+    entries = []
+    for document in documents:
+        other = lookup(names, document.get(other_field))
+        entry = {
+            "type": kind,
+            "id": document["_id"],
+            "start": document.get(date_field),
+            "status": document.get("status"),
+            "with": {"id": document.get(other_field), "name": full_name(other) if other else None},
+        }
+        if kind == "consultation":
+            entry["meeting_link"] = document.get("meeting_link")
+        entries.append(entry)
+    return entries
+
+
+def calendar_queries(role, user_id, start, end):
+    base = participant_query(role, user_id)
+    return (
+        {**base, "appointment_date": {"$gte": start, "$lt": end}},
+        {**base, "consultation_date": {"$gte": start, "$lt": end}},
+    )
+
+
+def build_calendar(role, appointments, consultations, names, start, end, view):
+    """The calendar payload; `truncated` says entries past CALENDAR_MAX_ENTRIES of a kind were left out.
+
+    Each list is read with a limit of CALENDAR_MAX_ENTRIES + 1, so one more than the cap means there were more.
+    """
+    truncated = len(appointments) > CALENDAR_MAX_ENTRIES or len(consultations) > CALENDAR_MAX_ENTRIES
+    appointments, consultations = appointments[:CALENDAR_MAX_ENTRIES], consultations[:CALENDAR_MAX_ENTRIES]
+    other_field = "patient_id" if role == "doctor" else "doctor_id"
+    entries = (
+        calendar_entries("appointment", appointments, "appointment_date", other_field, names)
+        + calendar_entries("consultation", consultations, "consultation_date", other_field, names)
+    )
+    entries.sort(key=lambda entry: (entry["start"] is None, entry["start"] or start))
+    return {"view": view, "start": start, "end": end, "entries": entries, "truncated": truncated}
+
+
+@csrf_exempt
+@jwt_required
+def get_calendar(request):
+    if request.method == "GET":
+        try:
+            role = request.principal.role
+            if participant_query(role, request.user_id) is None:
+                return JsonResponse({"error": "Unauthorized role"}, status=403)
+
+            # Work out the day or week being shown
+            try:
+                start, end, view = calendar_window(request)
+            except InvalidDateFilter as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            appointment_query, consultation_query = calendar_queries(role, request.user_id, start, end)
+
+            # Two bounded index scans over the window, projected to what the calendar shows;
+            # one entry over the cap tells build_calendar the window was truncated
+            appointments = list(
+                appointments_collection.find(appointment_query, APPOINTMENT_CALENDAR_PROJECTION)
+                .sort("appointment_date", ASCENDING).limit(CALENDAR_MAX_ENTRIES + 1)
+            )
+            consultations = list(
+                consultations_collection.find(consultation_query, CONSULTATION_CALENDAR_PROJECTION)
+                .sort("consultation_date", ASCENDING).limit(CALENDAR_MAX_ENTRIES + 1)
+            )
+
+            # A repeat load of an unchanged window skips the name lookup
+            etag = etag_for(request, page_validator(appointments), page_validator(consultations))
+            response = not_modified(request, etag)
+            if response:
+                return response
+
+            # Names of the other participants in one round trip
+            other_field = "patient_id" if role == "doctor" else "doctor_id"
+            names = hydrate_users(appointments + consultations, other_field, view="display_name")
+
+            return with_etag(BSONResponse(build_calendar(role, appointments, consultations, names, start, end, view), status=200), etag)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
@@ -8,4 +8,8 @@ medical_records_collection = db["MedicalRecords"]
 billing_collection = db["Billing"]
 test_results_collection = db["TestResults"]
 messages_collection = db["Messages"]
-consultations_collection = db ["Consultations"]
\ No newline at end of file
+consultations_collection = db ["Consultations"]
+billing_rollups_collection = db["BillingDailyRollups"]
+conversations_collection = db["Conversations"]
+doctor_schedules_collection = db["DoctorSchedules"]
+event_tickets_collection = db["EventTickets"]
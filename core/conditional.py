@@ -0,0 +1,76 @@
+"""
+ETags and conditional GETs for the list and detail views.
+
+A list's validator is computed from the page the view has just read: the `_id`
+and `updated_at` of each document and whether another page follows. Inserts
+and deletes change which documents the page holds and updates move
+`updated_at`, so every write path that modifies a document in place sets
+`updated_at`. No query beyond the page read itself is needed, and a client
+sending the ETag back in If-None-Match gets a 304 without the page being
+hydrated or serialized.
+
+The ETag also covers the full path (so every page and filter has its own) and
+the caller. Changes to hydrated participant details such as names do not move it,
+which is why the tags are weak.
+"""
+import hashlib
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+from core.metrics import Counter
+
+CONDITIONAL_GETS = Counter(
+    "http_conditional_get_total",
+    "GETs carrying If-None-Match, by whether the client's copy was still current.",
+    ["outcome"],
+)
+
+
+def _stamp(document):
+    last_updated = document.get("updated_at")
+    return f"{document['_id']}:{last_updated.isoformat() if last_updated else ''}"
+
+
+def page_validator(documents, next_cursor=None):
+    """Validator for a page the view has already read: its documents and whether more follow."""
+    return f"{len(documents)}:{','.join(map(_stamp, documents))}:{next_cursor or ''}"
+
+
+def document_validator(document):
+    """Validator for a single document the view has already read."""
+    return f"1:{_stamp(document)}"
+
+
+def etag_for(request, *validators):
+    """Weak ETag for this request's path and caller over `validators`."""
+    principal = getattr(request, "principal", None)
+    caller = f"{principal.user_id}:{principal.role}" if principal else ""
+    raw = "|".join([request.get_full_path(), caller, *validators])
+    return f'W/"{hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()}"'
+
+
+def page_etag(request, documents, next_cursor=None):
+    return etag_for(request, page_validator(documents, next_cursor))
+
+
+def _weak(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def not_modified(request, etag):
+    """A 304 if the client's If-None-Match already names `etag`, else None."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return None
+    tags = parse_etags(header)
+    if "*" in tags or _weak(etag) in {_weak(tag) for tag in tags}:
+        CONDITIONAL_GETS.inc(outcome="not_modified")
+        return with_etag(HttpResponseNotModified(), etag)
+    CONDITIONAL_GETS.inc(outcome="modified")
+    return None
+
+
+def with_etag(response, etag):
+    response["ETag"] = etag
+    # Clients may keep the body but must revalidate before reusing it
+    response["Cache-Control"] = "private, no-cache"
+    return response
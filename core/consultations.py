@@ -1,10 +1,17 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from pymongo import DESCENDING
 import json
 from datetime import datetime
-from core.collections import users_collection , consultations_collection
+from core.collections import consultations_collection
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.hydration import hydrate_users, lookup
+from core.user_store import get_user
+from core.responses import BSONResponse
+from core.conditional import document_validator, etag_for, not_modified, page_etag, with_etag
+from core.calendars import InvalidDateFilter, date_status_filters
 
 @jwt_required
 @csrf_exempt
@@ -14,13 +21,11 @@ def post_meeting_link(request):
             # Get the logged-in user's ID from the request
             user_id = request.user_id
 
-            # Fetch the user from the MongoDB database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a doctor
-            if user.get("role") != "doctor":
+            if user.role != "doctor":
                 return JsonResponse({"error": "Only doctors can upload meeting links"}, status=403)
 
             # Parse the request body
@@ -47,7 +52,7 @@ def post_meeting_link(request):
                 "meeting_link": meeting_link,
                 "consultation_date": consultation_date,
                 "status": "Scheduled",
-                "uploaded_by": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
+                "uploaded_by": user.full_name,
                 "created_at": datetime.utcnow()
             }
 
@@ -65,6 +70,58 @@ def post_meeting_link(request):
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
     
+def format_meeting_details(consultation, user_role, other_user):
+    """Shape a consultation for one participant, given the other participant's user document."""
+    # Prepare base meeting details
+    meeting_data = {
+        "_id": consultation["_id"],
+        "meeting_link": consultation.get("meeting_link"),
+        "consultation_date": consultation.get("consultation_date", consultation.get("created_at")),
+        "status": consultation.get("status"),
+        "notes": consultation.get("notes"),
+    }
+
+    # Add participant details based on role
+    if user_role == "doctor":
+        patient = other_user
+        if patient:
+            meeting_data["patient_details"] = {
+                "first_name": patient.get("personal_details", {}).get("first_name"),
+                "last_name": patient.get("personal_details", {}).get("last_name"),
+                "age": patient.get("personal_details", {}).get("age"),
+                "gender": patient.get("personal_details", {}).get("gender"),
+                "email": patient.get("personal_details", {}).get("email"),
+                "phone": patient.get("personal_details", {}).get("phone")
+            }
+    else:  # user is patient
+        doctor = other_user
+        if doctor:
+            meeting_data["doctor_details"] = {
+                "first_name": doctor.get("personal_details", {}).get("first_name"),
+                "last_name": doctor.get("personal_details", {}).get("last_name"),
+                "specialization": doctor.get("specialization"),
+                "email": doctor.get("personal_details", {}).get("email"),
+                "phone": doctor.get("personal_details", {}).get("phone"),
+                "license_number": doctor.get("license_number")
+            }
+    return meeting_data
+
+
+def meeting_access_error(consultation, user_id):
+    """Error response if `user_id` may not see `consultation`, else None."""
+    if not consultation:
+        return JsonResponse({"error": "Consultation not found"}, status=404)
+
+    # Check if user is part of this consultation
+    if not (ObjectId(user_id) == consultation.get("doctor_id") or ObjectId(user_id) == consultation.get("patient_id")):
+        return JsonResponse({"error": "Unauthorized access to this consultation"}, status=403)
+    return None
+
+
+def other_participant_field(user_role):
+    return "patient_id" if user_role == "doctor" else "doctor_id"
+
+
 @jwt_required
 @csrf_exempt
 def get_meeting_details(request, consultation_id):
@@ -78,69 +135,54 @@ def get_meeting_details(request, consultation_id):
         if not ObjectId.is_valid(consultation_id):
             return JsonResponse({"error": "Invalid consultation ID format"}, status=400)
 
-        # Fetch user details
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            return JsonResponse({"error": "User not found"}, status=404)
-
-        user_role = user.get("role")
+        # The caller's identity and role come from the access token
+        user_role = request.principal.role
         if user_role not in ["doctor", "patient"]:
             return JsonResponse({"error": "Unauthorized role"}, status=403)
 
         # Fetch the consultation from MongoDB
         consultation = consultations_collection.find_one({"_id": ObjectId(consultation_id)})
-        if not consultation:
-            return JsonResponse({"error": "Consultation not found"}, status=404)
+        error = meeting_access_error(consultation, user_id)
+        if error:
+            return error
 
-        # Check if user is part of this consultation
-        doctor_id = consultation.get("doctor_id")
-        patient_id = consultation.get("patient_id")
-        
-        if not (ObjectId(user_id) == doctor_id or ObjectId(user_id) == patient_id):
-            return JsonResponse({"error": "Unauthorized access to this consultation"}, status=403)
-
-        # Prepare base meeting details
-        meeting_data = {
-            "_id": str(consultation["_id"]),
-            "meeting_link": consultation.get("meeting_link"),
-            "consultation_date": consultation.get("consultation_date", consultation.get("created_at")),
-            "status": consultation.get("status"),
-            "notes": consultation.get("notes"),
-        }
-
-        # Format date if it exists
-        if meeting_data["consultation_date"] and isinstance(meeting_data["consultation_date"], datetime):
-            meeting_data["consultation_date"] = meeting_data["consultation_date"].isoformat()
-
-        # Add participant details based on role
-        if user_role == "doctor":
-            patient = users_collection.find_one({"_id": patient_id})
-            if patient:
-                meeting_data["patient_details"] = {
-                    "first_name": patient.get("personal_details", {}).get("first_name"),
-                    "last_name": patient.get("personal_details", {}).get("last_name"),
-                    "age": patient.get("personal_details", {}).get("age"),
-                    "gender": patient.get("personal_details", {}).get("gender"),
-                    "email": patient.get("personal_details", {}).get("email"),
-                    "phone": patient.get("personal_details", {}).get("phone")
-                }
-        else:  # user is patient
-            doctor = users_collection.find_one({"_id": doctor_id})
-            if doctor:
-                meeting_data["doctor_details"] = {
-                    "first_name": doctor.get("personal_details", {}).get("first_name"),
-                    "last_name": doctor.get("personal_details", {}).get("last_name"),
-                    "specialization": doctor.get("specialization"),
-                    "email": doctor.get("personal_details", {}).get("email"),
-                    "phone": doctor.get("personal_details", {}).get("phone"),
-                    "license_number": doctor.get("license_number")
-                }
-
-        return JsonResponse(meeting_data, status=200)
+        # The consultation itself is the validator; a 304 skips the participant lookup
+        etag = etag_for(request, document_validator(consultation))
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        # Fetch the other participant
+        other_user = get_user(consultation.get(other_participant_field(user_role)), "clinical_summary")
+
+        return with_etag(BSONResponse(format_meeting_details(consultation, user_role, other_user), status=200), etag)
 
     except Exception as e:
         return JsonResponse({"error": f"Internal server error: {str(e)}"}, status=500)
-    
+
+
+def format_consultations(consultations, user_role, participants):
+    """Shape raw consultations, attaching the other participant from a `hydrate_users` lookup."""
+    formatted_consultations = []
+    for consultation in consultations:
+        # Get the other participant's details
+        other_user = lookup(participants, consultation[other_participant_field(user_role)])
+
+        formatted_consultations.append({
+            "id": consultation["_id"],
+            "date": consultation.get("consultation_date", consultation.get("created_at")),
+            "status": consultation.get("status", "scheduled"),
+            "meeting_link": consultation.get("meeting_link", ""),
+            "participant": {
+                "name": f"{other_user['personal_details']['first_name']} {other_user['personal_details']['last_name']}" if other_user else "Unknown",
+                "role": "patient" if user_role == "doctor" else "doctor",
+                "specialization": other_user.get("specialization", "") if user_role == "patient" and other_user else ""
+            },
+            "notes": consultation.get("notes", "")[:100]  # Truncate long notes
+        })
+    return formatted_consultations
+
+
 @jwt_required
 @csrf_exempt
 def get_user_consultations(request):
@@ -153,43 +195,43 @@ def get_user_consultations(request):
         if not ObjectId.is_valid(user_id):
             return JsonResponse({"error": "Invalid user ID format"}, status=400)
 
-        # 2. Get user document and role
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            return JsonResponse({"error": "User not found"}, status=404)
-
-        user_role = user.get("role")
+        # 2. The caller's identity and role come from the access token
+        user_role = request.principal.role
         if user_role not in ["doctor", "patient"]:
             return JsonResponse({"error": "Unauthorized role"}, status=403)
 
-        # 3. Build query based on user role
+        # 3. Build query based on user role, narrowed to ?from=/?to= and ?status= if given
         query = {"doctor_id": ObjectId(user_id)} if user_role == "doctor" else {"patient_id": ObjectId(user_id)}
+        try:
+            query.update(date_status_filters(request, "consultation_date"))
+        except InvalidDateFilter as e:
+            return JsonResponse({"error": str(e)}, status=400)
 
-        # 4. Get all consultations
-        consultations = list(consultations_collection.find(query).sort("consultation_date", -1))
-
-        # 5. Process and format the results
-        formatted_consultations = []
-        for consultation in consultations:
-            # Get the other participant's details
-            other_participant_id = consultation["patient_id"] if user_role == "doctor" else consultation["doctor_id"]
-            other_user = users_collection.find_one({"_id": other_participant_id})
-
-            formatted_consultations.append({
-                "id": str(consultation["_id"]),
-                "date": consultation.get("consultation_date", consultation.get("created_at")).isoformat(),
-                "status": consultation.get("status", "scheduled"),
-                "meeting_link": consultation.get("meeting_link", ""),
-                "participant": {
-                    "name": f"{other_user['personal_details']['first_name']} {other_user['personal_details']['last_name']}" if other_user else "Unknown",
-                    "role": "patient" if user_role == "doctor" else "doctor",
-                    "specialization": other_user.get("specialization", "") if user_role == "patient" and other_user else ""
-                },
-                "notes": consultation.get("notes", "")[:100]  # Truncate long notes
-            })
-
-        # 6. Return all consultations
-        return JsonResponse({"consultations": formatted_consultations}, status=200)
+        # Read the requested page
+        try:
+            page = page_params(request)
+        except InvalidPageRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # 4. Get one page of consultations, newest first
+        consultations, next_cursor = find_page(
+            consultations_collection, query, page, sort_key="consultation_date", direction=DESCENDING
+        )
+
+        # A repeat load of an unchanged page skips hydration and serialization
+        etag = page_etag(request, consultations, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        # 5. Fetch every other participant in one round trip
+        participants = hydrate_users(consultations, other_participant_field(user_role))
+
+        # 6. Return the page of consultations
+        return with_etag(BSONResponse({
+            "consultations": format_consultations(consultations, user_role, participants),
+            "next_cursor": next_cursor
+        }, status=200), etag)
 
     except Exception as e:
-        return JsonResponse({"error": "Internal server error"}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": "Internal server error"}, status=500)
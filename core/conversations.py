@@ -0,0 +1,237 @@
+"""
+Conversation threads between two users.
+
+Every pair of users shares one thread. Its summary document in Conversations
+(participants, their display names, the last message and a per-user unread
+counter) is upserted by send_message with a single atomic update, so the inbox
+is one indexed query over summaries and never touches Messages. Each message
+carries the `thread_id` of its thread for the per-thread history.
+"""
+import json
+from datetime import datetime
+from bson import ObjectId
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from pymongo import DESCENDING
+from core.collections import conversations_collection, messages_collection
+from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+
+# Characters of the last message kept on the thread summary
+MESSAGE_PREVIEW_LENGTH = 140
+
+
+def thread_id_for(user_a, user_b):
+    """Deterministic id of the thread between two users, whichever of them sends and however the ids are spelled."""
+    return ":".join(sorted([str(ObjectId(user_a)), str(ObjectId(user_b))]))
+
+
+def thread_participants(thread_id):
+    """The two canonical user ids encoded in `thread_id`, or None if it is malformed."""
+    parts = thread_id.split(":")
+    if len(parts) != 2 or not all(ObjectId.is_valid(part) for part in parts):
+        return None
+    return [str(ObjectId(part)) for part in parts]
+
+
+def canonical_thread_id(thread_id):
+    """`thread_id` as stored, for a thread id that passed `thread_access_error`."""
+    return thread_id_for(*thread_participants(thread_id))
+
+
+def participant_name(first_name, last_name, role):
+    return {"first_name": first_name, "last_name": last_name, "role": role}
+
+
+def record_message(message, sender_name, receiver_name):
+    """Fold a newly inserted message into its thread summary."""
+    sender_id, receiver_id = str(message["sender_id"]), str(message["receiver_id"])
+    conversations_collection.update_one(
+        {"_id": message["thread_id"]},
+        {
+            "$setOnInsert": {
+                "participants": sorted([message["sender_id"], message["receiver_id"]]),
+                f"unread.{sender_id}": 0,
+            },
+            "$set": {
+                # Names are refreshed on every message so the inbox never has to look users up
+                f"names.{sender_id}": sender_name,
+                f"names.{receiver_id}": receiver_name,
+                "last_message": {
+                    "message_id": message["_id"],
+                    "sender_id": message["sender_id"],
+                    "preview": message["message"][:MESSAGE_PREVIEW_LENGTH],
+                },
+                "last_message_at": message["sent_at"],
+                "updated_at": message["sent_at"],
+            },
+            "$inc": {f"unread.{receiver_id}": 1},
+        },
+        upsert=True
+    )
+
+
+def format_conversations(conversations, user_id):
+    """Shape thread summaries from the point of view of `user_id`."""
+    conversation_list = []
+    for conversation in conversations:
+        other_id = next((str(p) for p in conversation["participants"] if str(p) != user_id), user_id)
+        last_message = conversation.get("last_message", {})
+        conversation_list.append({
+            "thread_id": conversation["_id"],
+            "participant": {"id": other_id, **conversation.get("names", {}).get(other_id, {})},
+            "last_message": {
+                "message_id": last_message.get("message_id"),
+                "from_me": str(last_message.get("sender_id")) == user_id,
+                "preview": last_message.get("preview", ""),
+            },
+            "last_message_at": conversation.get("last_message_at"),
+            "unread": conversation.get("unread", {}).get(user_id, 0),
+        })
+    return conversation_list
+
+
+def format_thread_messages(messages, names, user_id):
+    return [{
+        "message_id": msg["_id"],
+        "sender": {"id": msg["sender_id"], **names.get(str(msg["sender_id"]), {})},
+        "from_me": str(msg["sender_id"]) == user_id,
+        "message": msg["message"],
+        "status": msg.get("status"),
+        "timestamp": msg.get("sent_at"),
+    } for msg in messages]
+
+
+def thread_access_error(thread_id, user_id):
+    participants = thread_participants(thread_id)
+    if participants is None:
+        return JsonResponse({"error": "Invalid thread ID"}, status=400)
+    if str(ObjectId(user_id)) not in participants:
+        return JsonResponse({"error": "Conversation not found"}, status=404)
+    return None
+
+
+@csrf_exempt
+@jwt_required
+def get_conversations(request):
+    if request.method == "GET":
+        try:
+            user_id = request.user_id
+
+            # Read the requested page
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # Repeat loads are answered from the validator alone
+            query = {"participants": ObjectId(user_id)}
+            # One indexed query over the caller's thread summaries, most recent first
+            conversations, next_cursor = find_page(
+                conversations_collection, query, page,
+                sort_key="last_message_at", direction=DESCENDING
+            )
+            etag = page_etag(request, conversations, next_cursor)
+            response = not_modified(request, etag)
+            if response:
+                return response
+
+            return with_etag(BSONResponse({
+                "conversations": format_conversations(conversations, user_id),
+                "next_cursor": next_cursor
+            }, status=200), etag)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+@csrf_exempt
+@jwt_required
+def get_thread_messages(request, thread_id):
+    if request.method == "GET":
+        try:
+            user_id = request.user_id
+
+            # Only the two participants may read a thread
+            error = thread_access_error(thread_id, user_id)
+            if error:
+                return error
+            thread_id = canonical_thread_id(thread_id)
+
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # The summary carries both participants' names
+            conversation = conversations_collection.find_one({"_id": thread_id}, {"names": 1})
+            if not conversation:
+                return JsonResponse({"error": "Conversation not found"}, status=404)
+
+            # Fetch one page of the thread, newest first
+            messages, next_cursor = find_page(
+                messages_collection, {"thread_id": thread_id}, page, sort_key="sent_at", direction=DESCENDING
+            )
+
+            # A repeat load of an unchanged page skips hydration and serialization
+            etag = page_etag(request, messages, next_cursor)
+            response = not_modified(request, etag)
+            if response:
+                return response
+
+            return with_etag(BSONResponse({
+                "thread_id": thread_id,
+                "messages": format_thread_messages(messages, conversation.get("names", {}), user_id),
+                "next_cursor": next_cursor
+            }, status=200), etag)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+@csrf_exempt
+@jwt_required
+def mark_threads_read(request):
+    if request.method == "POST":
+        try:
+            user_id = request.user_id
+
+            # Parse the threads to mark as read
+            data = json.loads(request.body)
+            thread_ids = data.get("thread_ids")
+            if not isinstance(thread_ids, list) or not thread_ids:
+                return JsonResponse({"error": "thread_ids must be a non-empty list"}, status=400)
+            for thread_id in thread_ids:
+                if not isinstance(thread_id, str):
+                    return JsonResponse({"error": "Invalid thread ID"}, status=400)
+                error = thread_access_error(thread_id, user_id)
+                if error:
+                    return error
+            thread_ids = [canonical_thread_id(thread_id) for thread_id in thread_ids]
+
+            # Mark the caller's unread messages as read one thread at a time, and take exactly
+            # that many off the thread's unread counter; a message sent meanwhile keeps the
+            # increment send_message gave it
+            now = datetime.utcnow()
+            messages_updated = 0
+            for thread_id in dict.fromkeys(thread_ids):
+                result = messages_collection.update_many(
+                    {"thread_id": thread_id, "receiver_id": ObjectId(user_id), "status": "unread"},
+                    {"$set": {"status": "read", "read_at": now, "updated_at": now}}
+                )
+                if result.modified_count:
+                    conversations_collection.update_one(
+                        {"_id": thread_id},
+                        {"$inc": {f"unread.{user_id}": -result.modified_count}, "$set": {"updated_at": now}}
+                    )
+                    messages_updated += result.modified_count
+
+            return JsonResponse({"message": "Marked as read", "messages_updated": messages_updated}, status=200)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
@@ -0,0 +1,318 @@
+"""
+Server-Sent Events for new messages, appointment changes and consultations.
+
+Each ASGI worker runs one EventHub. While at least one client is connected, the
+hub follows a single change stream over the database and fans every relevant
+change out to the queues of the users it concerns. If change streams are not
+available (a standalone mongod has none) the hub polls instead: one query per
+collection per EVENTS_POLL_INTERVAL for the connected users only, which picks up
+new documents and documents whose `updated_at` moved, but not deletions.
+
+Browsers cannot send an Authorization header with EventSource, so they first
+POST to events/ticket/ and open the stream with `?ticket=...`: a random value
+valid for EVENTS_TICKET_TTL seconds and for one stream only.
+"""
+import asyncio
+import hashlib
+import logging
+import secrets
+from datetime import datetime, timedelta
+from bson import ObjectId
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from pymongo.errors import OperationFailure, PyMongoError
+from core import async_collections
+from core.async_mongodb import db
+from core.metrics import Counter, Gauge
+from core.responses import dumps
+from core.users import jwt_required
+
+logger = logging.getLogger(__name__)
+
+SSE_CONNECTIONS = Gauge(
+    "sse_connections",
+    "Clients currently connected to the event stream.",
+)
+SSE_EVENTS = Counter(
+    "sse_events_total",
+    "Events delivered to event-stream clients, by type.",
+    ["type"],
+)
+SSE_DROPPED = Counter(
+    "sse_clients_dropped_total",
+    "Event-stream clients disconnected because they fell too far behind.",
+)
+
+# Change stream errors that mean "this deployment has no change streams"
+CHANGE_STREAMS_UNSUPPORTED = {40573, 40324, 136}
+
+
+def message_event(document):
+    return "message", [document.get("receiver_id")], {
+        "message_id": str(document["_id"]),
+        "thread_id": document.get("thread_id"),
+        "sender_id": str(document.get("sender_id")),
+        "message": document.get("message"),
+        "timestamp": document.get("sent_at"),
+    }
+
+
+def appointment_event(document):
+    return "appointment", [document.get("patient_id"), document.get("doctor_id")], {
+        "appointment_id": str(document["_id"]),
+        "appointment_date": document.get("appointment_date"),
+        "status": document.get("status"),
+        "doctor_id": str(document.get("doctor_id")),
+        "patient_id": str(document.get("patient_id")),
+    }
+
+
+def consultation_event(document):
+    return "consultation", [document.get("patient_id"), document.get("doctor_id")], {
+        "consultation_id": str(document["_id"]),
+        "consultation_date": document.get("consultation_date"),
+        "status": document.get("status"),
+        "doctor_id": str(document.get("doctor_id")),
+        "patient_id": str(document.get("patient_id")),
+    }
+
+
+# Collection name -> (async collection attribute, recipient fields, event builder)
+WATCHED = {
+    "Messages": ("messages_collection", ("receiver_id",), message_event),
+    "Appointments": ("appointments_collection", ("patient_id", "doctor_id"), appointment_event),
+    "Consultations": ("consultations_collection", ("patient_id", "doctor_id"), consultation_event),
+}
+
+
+class EventHub:
+    def __init__(self):
+        self._subscribers = {}  # user_id -> set of queues
+        self._task = None
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        SSE_CONNECTIONS.inc()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+        SSE_CONNECTIONS.dec()
+        # Nobody left to tell; stop watching until the next client connects
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, document_type, recipients, payload):
+        for recipient in recipients:
+            if recipient is None:
+                continue
+            for queue in list(self._subscribers.get(str(recipient), ())):
+                try:
+                    queue.put_nowait((document_type, payload))
+                except asyncio.QueueFull:
+                    # A client this far behind reconnects and refetches instead of growing the queue
+                    SSE_DROPPED.inc()
+                    self._drop(str(recipient), queue)
+
+    def _drop(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)  # End-of-stream marker for the reader
+
+    def _dispatch(self, collection_name, document):
+        _, _, build = WATCHED[collection_name]
+        self.publish(*build(document))
+
+    async def _run(self):
+        try:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if e.code not in CHANGE_STREAMS_UNSUPPORTED:
+                    raise
+                logger.info("Change streams unavailable (%s); polling every %ss", e, settings.EVENTS_POLL_INTERVAL)
+                await self._poll()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Connected clients keep their heartbeats; the next subscriber restarts the hub
+            logger.exception("Event hub stopped")
+
+    async def _watch(self):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(WATCHED)},
+            "operationType": {"$in": ["insert", "update", "replace"]},
+        }}]
+        resume_token = None
+        while True:
+            try:
+                async with await db.watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get("fullDocument")
+                        if document is not None:
+                            self._dispatch(change["ns"]["coll"], document)
+            except OperationFailure:
+                raise
+            except PyMongoError:
+                # Transient (e.g. failover); resume where we left off
+                logger.warning("Change stream interrupted; resuming", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _poll(self):
+        # Each poll re-reads the last EVENTS_POLL_OVERLAP seconds, so documents stamped
+        # by a process whose clock runs behind, or committed after an earlier poll went
+        # past their _id, are still picked up; `seen` keeps them from being sent twice
+        overlap = timedelta(seconds=settings.EVENTS_POLL_OVERLAP)
+        seen = {}
+        since = datetime.utcnow()
+        # Changes from before the first client connected are not news
+        await self._poll_once(since - overlap, seen, dispatch=False)
+        while True:
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+            window_start, since = since - overlap, datetime.utcnow()
+            await self._poll_once(window_start, seen)
+            # Forget documents the window no longer reaches
+            for key in [key for key, (_, stamp) in seen.items() if stamp < window_start]:
+                del seen[key]
+
+    async def _poll_once(self, window_start, seen, dispatch=True):
+        """Dispatch the connected users' documents created or updated since `window_start`
+        that `seen` has not recorded in their current state."""
+        user_ids = [ObjectId(user_id) for user_id in list(self._subscribers)]
+        if not user_ids:
+            return
+        for collection_name, (attribute, recipient_fields, _) in WATCHED.items():
+            collection = getattr(async_collections, attribute)
+            query = {
+                "$and": [
+                    {"$or": [{field: {"$in": user_ids}} for field in recipient_fields]},
+                    {"$or": [{"_id": {"$gte": ObjectId.from_datetime(window_start)}},
+                             {"updated_at": {"$gte": window_start}}]},
+                ]
+            }
+            try:
+                async for document in collection.find(query).sort("_id", 1):
+                    key = (collection_name, document["_id"])
+                    updated_at = document.get("updated_at")
+                    if key in seen and seen[key][0] == updated_at:
+                        continue
+                    created_at = document["_id"].generation_time.replace(tzinfo=None)
+                    seen[key] = (updated_at, max(created_at, updated_at or created_at))
+                    if dispatch:
+                        self._dispatch(collection_name, document)
+            except PyMongoError:
+                logger.warning("Event poll on %s failed", collection_name, exc_info=True)
+
+
+_hub = None
+
+
+def event_hub():
+    """The process-wide hub, created on first use."""
+    global _hub
+    if _hub is None:
+        _hub = EventHub()
+    return _hub
+
+
+def format_event(event_type, payload):
+    data = dumps(payload).decode()
+    return f"event: {event_type}\ndata: {data}\n\n"
+
+
+async def _event_stream(user_id):
+    hub = event_hub()
+    queue = hub.subscribe(user_id)
+    try:
+        # Tell EventSource how long to wait before reconnecting
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line; keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            event_type, payload = event
+            SSE_EVENTS.inc(type=event_type)
+            yield format_event(event_type, payload)
+    finally:
+        hub.unsubscribe(user_id, queue)
+
+
+def _ticket_key(ticket):
+    # Only a hash is stored, so the tickets collection cannot be replayed
+    return hashlib.sha256(ticket.encode("utf-8")).hexdigest()
+
+
+async def redeem_ticket(ticket):
+    """The user a stream ticket was issued to, or None; each ticket opens one stream."""
+    document = await async_collections.event_tickets_collection.find_one_and_delete(
+        {"_id": _ticket_key(ticket), "expires_at": {"$gt": datetime.utcnow()}}
+    )
+    return document["user_id"] if document else None
+
+
+def _stream_response(user_id):
+    response = StreamingHttpResponse(_event_stream(user_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Disable proxy buffering (nginx)
+    return response
+
+
+@csrf_exempt
+@jwt_required
+async def _events_view(request):
+    return _stream_response(request.user_id)
+
+
+@csrf_exempt
+@jwt_required
+async def issue_event_ticket(request):
+    """A single-use ticket for opening one event stream within EVENTS_TICKET_TTL seconds."""
+    if request.method == "POST":
+        try:
+            ticket = secrets.token_urlsafe(32)
+            await async_collections.event_tickets_collection.insert_one({
+                "_id": _ticket_key(ticket),
+                "user_id": request.user_id,
+                "expires_at": datetime.utcnow() + timedelta(seconds=settings.EVENTS_TICKET_TTL),
+            })
+            return JsonResponse({"ticket": ticket, "expires_in": settings.EVENTS_TICKET_TTL}, status=201)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+async def get_events(request):
+    """Stream the caller's new messages, appointment changes and consultations as SSE."""
+    if request.method == "GET":
+        # EventSource cannot set headers, so browsers authenticate with a ticket instead of the
+        # access token, which would otherwise end up in access logs
+        ticket = request.GET.get("ticket")
+        if ticket:
+            user_id = await redeem_ticket(ticket)
+            if user_id is None:
+                return JsonResponse({"error": "Invalid or expired ticket"}, status=401)
+            return _stream_response(user_id)
+        return await _events_view(request)
+    else:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
@@ -0,0 +1,73 @@
+from bson import ObjectId
+from core.user_store import get_users, aget_users
+
+
+def collect_ids(documents, *fields):
+    """Collect the distinct ObjectIds referenced by `fields` across `documents`."""
+    ids = set()
+    for document in documents:
+        for field in fields:
+            value = document.get(field)
+            if value is None:
+                continue
+            if not isinstance(value, ObjectId):
+                if not ObjectId.is_valid(value):
+                    continue
+                value = ObjectId(value)
+            ids.add(value)
+    return ids
+
+
+def hydrate_users(documents, *fields, view="clinical_summary"):
+    """Return a `{_id: user}` lookup for all participants referenced by `documents`.
+
+    `view` names the `core.user_store` projection; the default carries the participant
+    fields the list views render.
+    """
+    return get_users(collect_ids(documents, *fields), view)
+
+
+async def ahydrate_users(documents, *fields, view="clinical_summary"):
+    """`hydrate_users` over the async client."""
+    return await aget_users(collect_ids(documents, *fields), view)
+
+
+def lookup(users, user_id):
+    """Find a participant in a lookup built by `hydrate_users`."""
+    if user_id is None:
+        return None
+    if not isinstance(user_id, ObjectId):
+        if not ObjectId.is_valid(user_id):
+            return None
+        user_id = ObjectId(user_id)
+    return users.get(user_id)
+
+
+def patient_details(patient):
+    return {
+        "first_name": patient["personal_details"]["first_name"],
+        "last_name": patient["personal_details"]["last_name"],
+        "age": patient["personal_details"]["age"],
+        "gender": patient["personal_details"]["gender"]
+    }
+
+
+def doctor_details(doctor):
+    return {
+        "first_name": doctor["personal_details"]["first_name"],
+        "last_name": doctor["personal_details"]["last_name"],
+        "specialization": doctor.get("specialization", "")
+    }
+
+
+def billed_by(receptionist):
+    return {
+        "first_name": receptionist["personal_details"]["first_name"],
+        "last_name": receptionist["personal_details"]["last_name"],
+        "email": receptionist["contact"]["email"],
+        "phone": receptionist["contact"]["phone"]
+    }
+
+
+def full_name(user):
+    return f"{user['personal_details']['first_name']} {user['personal_details']['last_name']}"
@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from core.collections import db
+
+
+def _index(keys, name, **options):
+    # Building in the background keeps the collection writable while the index builds
+    return IndexModel(keys, name=name, background=True, **options)
+
+
+# The index set every collection is expected to carry, keyed by collection name.
+# List indexes end in _id so keyset pagination (core.pagination) walks them in order.
+REQUIRED_INDEXES = {
+    "Users": [
+        _index([("username", ASCENDING)], "username_1"),
+        _index([("role", ASCENDING), ("_id", ASCENDING)], "role_1__id_1"),
+    ],
+    "Appointments": [
+        # Lists, date-range filters, calendars and free-slot search, all in date order
+        _index([("patient_id", ASCENDING), ("appointment_date", ASCENDING), ("_id", ASCENDING)], "patient_id_1_appointment_date_1__id_1"),
+        _index([("doctor_id", ASCENDING), ("appointment_date", ASCENDING), ("_id", ASCENDING)], "doctor_id_1_appointment_date_1__id_1"),
+        # One booking per doctor slot; appointments from before slot keys are exempt
+        _index([("slot_key", ASCENDING)], "slot_key_1", unique=True,
+               partialFilterExpression={"slot_key": {"$exists": True}}),
+    ],
+    "Messages": [
+        _index([("receiver_id", ASCENDING), ("sent_at", DESCENDING), ("_id", DESCENDING)], "receiver_id_1_sent_at_-1__id_-1"),
+        _index([("thread_id", ASCENDING), ("sent_at", DESCENDING), ("_id", DESCENDING)], "thread_id_1_sent_at_-1__id_-1"),
+    ],
+    "Conversations": [
+        # Inbox: the caller's threads, most recent first
+        _index([("participants", ASCENDING), ("last_message_at", DESCENDING), ("_id", DESCENDING)], "participants_1_last_message_at_-1__id_-1"),
+    ],
+    "Billing": [
+        _index([("patient_id", ASCENDING), ("payment_status", ASCENDING), ("_id", ASCENDING)], "patient_id_1_payment_status_1__id_1"),
+        _index([("patient_id", ASCENDING), ("_id", ASCENDING)], "patient_id_1__id_1"),
+        _index([("receptionist_id", ASCENDING), ("_id", ASCENDING)], "receptionist_id_1__id_1"),
+        _index([("payment_status", ASCENDING), ("_id", ASCENDING)], "payment_status_1__id_1"),
+        # Covers the outstanding-balance aggregation ($match on status, $group on patient)
+        _index([("payment_status", ASCENDING), ("patient_id", ASCENDING), ("total_amount", ASCENDING)], "payment_status_1_patient_id_1_total_amount_1"),
+    ],
+    "BillingDailyRollups": [
+        _index([("date", ASCENDING)], "date_1"),
+    ],
+    "EventTickets": [
+        # MongoDB deletes tickets once they expire
+        _index([("expires_at", ASCENDING)], "expires_at_1", expireAfterSeconds=0),
+    ],
+    "Consultations": [
+        _index([("doctor_id", ASCENDING), ("consultation_date", DESCENDING), ("_id", DESCENDING)], "doctor_id_1_consultation_date_-1__id_-1"),
+        _index([("patient_id", ASCENDING), ("consultation_date", DESCENDING), ("_id", DESCENDING)], "patient_id_1_consultation_date_-1__id_-1"),
+    ],
+    "MedicalRecords": [
+        _index([("patient_id", ASCENDING), ("_id", ASCENDING)], "patient_id_1__id_1"),
+        _index([("doctor_id", ASCENDING), ("_id", ASCENDING)], "doctor_id_1__id_1"),
+    ],
+    "Prescriptions": [
+        _index([("patient_id", ASCENDING), ("_id", ASCENDING)], "patient_id_1__id_1"),
+    ],
+    "TestResults": [
+        _index([("patient_id", ASCENDING), ("_id", ASCENDING)], "patient_id_1__id_1"),
+        _index([("doctor_id", ASCENDING), ("_id", ASCENDING)], "doctor_id_1__id_1"),
+    ],
+}
+
+
+def ensure_indexes():
+    """Create every declared index that does not exist yet; returns `{collection: [names]}`."""
+    created = {}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = set(collection.index_information())
+        missing = [index for index in indexes if index.document["name"] not in existing]
+        if missing:
+            created[collection_name] = collection.create_indexes(missing)
+    return created
+
+
+def missing_indexes():
+    """Return `{collection: [names]}` for declared indexes absent from the database."""
+    missing = {}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = set(collection.index_information())
+        names = [index.document["name"] for index in indexes if index.document["name"] not in existing]
+        if names:
+            missing[collection_name] = names
+    return missing
+
+
+def index_usage():
+    """Return `{collection: {index_name: ops}}` from `$indexStats` since the last server restart."""
+    usage = {}
+    for collection_name in REQUIRED_INDEXES:
+        collection = db[collection_name]
+        try:
+            stats = collection.aggregate([{"$indexStats": {}}])
+            usage[collection_name] = {stat["name"]: stat["accesses"]["ops"] for stat in stats}
+        except OperationFailure:
+            # $indexStats needs the indexStats privilege; report nothing rather than fail
+            usage[collection_name] = {}
+    return usage
+
+
+def unused_indexes():
+    """Return `{collection: [names]}` for indexes that `$indexStats` has never seen used."""
+    unused = {}
+    for collection_name, stats in index_usage().items():
+        names = [name for name, ops in stats.items() if name != "_id_" and ops == 0]
+        if names:
+            unused[collection_name] = names
+    return unused
+
+
+def undeclared_indexes():
+    """Return `{collection: [names]}` for indexes in the database that nothing here declares."""
+    undeclared = {}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        declared = {index.document["name"] for index in indexes} | {"_id_"}
+        names = [name for name in collection.index_information() if name not in declared]
+        if names:
+            undeclared[collection_name] = names
+    return undeclared
+
+
+def verify_required_indexes():
+    """Refuse to start when MONGO_STRICT_INDEXES is on and a declared index is missing."""
+    if not getattr(settings, "MONGO_STRICT_INDEXES", False):
+        return
+    missing = missing_indexes()
+    if missing:
+        details = "; ".join(f"{name}: {', '.join(indexes)}" for name, indexes in missing.items())
+        raise ImproperlyConfigured(
+            f"Missing required MongoDB indexes ({details}). Run `python manage.py ensure_indexes`."
+        )
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from core.collections import conversations_collection, messages_collection
+from core.conversations import MESSAGE_PREVIEW_LENGTH, participant_name, thread_id_for
+from core.hydration import hydrate_users, lookup
+
+
+class Command(BaseCommand):
+    help = "Assign thread_id to messages sent before conversations existed and rebuild the Conversations summaries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Writes per bulk request.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        # Tag old messages with their thread
+        updates, tagged = [], 0
+        cursor = messages_collection.find({"thread_id": {"$exists": False}}, {"sender_id": 1, "receiver_id": 1})
+        for message in cursor:
+            updates.append(UpdateOne(
+                {"_id": message["_id"]},
+                {"$set": {"thread_id": thread_id_for(message["sender_id"], message["receiver_id"])}}
+            ))
+            if len(updates) >= batch_size:
+                tagged += messages_collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            tagged += messages_collection.bulk_write(updates, ordered=False).modified_count
+        self.stdout.write(f"Tagged {tagged} message(s) with a thread_id.")
+
+        # Last message of every thread
+        threads = list(messages_collection.aggregate([
+            {"$sort": {"sent_at": ASCENDING, "_id": ASCENDING}},
+            {"$group": {"_id": "$thread_id", "last": {"$last": "$$ROOT"}}},
+        ], allowDiskUse=True))
+
+        # Unread messages per thread and receiver
+        unread_counts = {}
+        for row in messages_collection.aggregate([
+            {"$match": {"status": "unread"}},
+            {"$group": {"_id": {"thread_id": "$thread_id", "receiver_id": "$receiver_id"}, "count": {"$sum": 1}}},
+        ]):
+            unread_counts[(row["_id"]["thread_id"], str(row["_id"]["receiver_id"]))] = row["count"]
+
+        users = hydrate_users([thread["last"] for thread in threads], "sender_id", "receiver_id")
+
+        replacements = []
+        for thread in threads:
+            last = thread["last"]
+            participants = sorted([last["sender_id"], last["receiver_id"]])
+            unread = {
+                str(participant): unread_counts.get((thread["_id"], str(participant)), 0)
+                for participant in participants
+            }
+
+            names = {}
+            for participant in participants:
+                user = lookup(users, participant) or {}
+                details = user.get("personal_details", {})
+                names[str(participant)] = participant_name(details.get("first_name"), details.get("last_name"), user.get("role"))
+
+            replacements.append(ReplaceOne({"_id": thread["_id"]}, {
+                "_id": thread["_id"],
+                "participants": participants,
+                "names": names,
+                "last_message": {
+                    "message_id": last["_id"],
+                    "sender_id": last["sender_id"],
+                    "preview": last["message"][:MESSAGE_PREVIEW_LENGTH],
+                },
+                "last_message_at": last["sent_at"],
+                "unread": unread,
+            }, upsert=True))
+
+        for start in range(0, len(replacements), batch_size):
+            conversations_collection.bulk_write(replacements[start:start + batch_size], ordered=False)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(replacements)} conversation(s)."))
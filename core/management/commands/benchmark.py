@@ -0,0 +1,71 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from core.benchmark import BenchmarkError, check_database, compare, run, seed, select
+
+
+class Command(BaseCommand):
+    help = "Seed a scratch database and benchmark every API route: latency percentiles, throughput and MongoDB round trips."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=1, help="Thousands of patients to seed (see core.synthetic for the rest).")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated data.")
+        parser.add_argument("--no-seed", action="store_true", help="Reuse the data of an earlier run.")
+        parser.add_argument("--requests", type=int, default=200, help="Timed requests per scenario.")
+        parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once.")
+        parser.add_argument("--warmup", type=int, default=10, help="Untimed requests before each scenario.")
+        parser.add_argument("--only", nargs="+", metavar="SCENARIO", help="Run just these scenarios.")
+        parser.add_argument("--output", help="Write the report to this JSON file.")
+        parser.add_argument("--baseline", help="Compare against this earlier report and fail on regressions.")
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=0.2,
+            help="Allowed p95 latency growth over the baseline, as a fraction (default 0.2).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Seed even if MONGO_DATABASE does not contain 'bench'. The database is dropped first.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            scenarios = select(options["only"])
+            if not options["no_seed"]:
+                check_database(options["force"])
+                counts = seed(options["scale"], options["seed"])
+                self.stdout.write("Seeded " + ", ".join(f"{count} {name}" for name, count in sorted(counts.items())))
+
+            self.stdout.write(f"{'scenario':<28} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'mongo':>6} {'errors':>6}")
+            report = run(
+                scenarios,
+                requests=options["requests"],
+                concurrency=options["concurrency"],
+                warmup=options["warmup"],
+                on_result=self._print_result,
+            )
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        report["meta"].update(scale=options["scale"], seed=options["seed"])
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare(report, baseline, options["max_regression"])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}.")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}."))
+
+    def _print_result(self, name, result):
+        line = (
+            f"{name:<28} {result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms {result['p99_ms']:>6.1f}ms "
+            f"{result['throughput_rps']:>8.1f} {result['mongo_round_trips']:>6.1f} {result['errors']:>6}"
+        )
+        self.stdout.write(self.style.ERROR(line) if result["errors"] else line)
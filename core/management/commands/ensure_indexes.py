@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.indexes import ensure_indexes, missing_indexes, unused_indexes, undeclared_indexes
+
+
+class Command(BaseCommand):
+    help = "Create the MongoDB indexes declared in core.indexes and report missing or unused ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report; do not create anything.",
+        )
+        parser.add_argument(
+            "--strict",
+            action="store_true",
+            help="Exit with an error if a declared index is missing.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check"]:
+            created = ensure_indexes()
+            for collection_name, names in created.items():
+                self.stdout.write(self.style.SUCCESS(f"Created on {collection_name}: {', '.join(names)}"))
+            if not created:
+                self.stdout.write("All declared indexes already exist.")
+
+        missing = missing_indexes()
+        for collection_name, names in missing.items():
+            self.stdout.write(self.style.ERROR(f"Missing on {collection_name}: {', '.join(names)}"))
+
+        for collection_name, names in undeclared_indexes().items():
+            self.stdout.write(self.style.WARNING(f"Undeclared on {collection_name}: {', '.join(names)}"))
+
+        for collection_name, names in unused_indexes().items():
+            self.stdout.write(self.style.WARNING(f"Unused on {collection_name}: {', '.join(names)}"))
+
+        if options["strict"] and missing:
+            raise CommandError("Required indexes are missing.")
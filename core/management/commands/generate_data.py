@@ -0,0 +1,46 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from core.mongodb import client, db
+from core.synthetic import DISTRIBUTIONS, generate, is_empty
+
+
+class Command(BaseCommand):
+    help = "Fill the database with deterministic synthetic users, appointments, records, bills and messages."
+
+    def add_arguments(self, parser):
+        for name, (default, help_text) in DISTRIBUTIONS.items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}",
+                dest=name,
+                type=type(default),
+                default=default,
+                help=f"{help_text} (default {default})",
+            )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same data.")
+        parser.add_argument(
+            "--as-of",
+            type=date.fromisoformat,
+            default=None,
+            help="Date (YYYY-MM-DD) every generated date is relative to (default today).",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many.")
+        parser.add_argument("--workers", type=int, default=4, help="insert_many calls in flight at once.")
+        parser.add_argument("--drop", action="store_true", help="Drop the database first if it holds any data.")
+
+    def handle(self, *args, **options):
+        if not is_empty():
+            if not options["drop"]:
+                raise CommandError(f"Database {db.name!r} is not empty; pass --drop to replace its contents.")
+            client.drop_database(db.name)
+
+        distributions = {name: options[name] for name in DISTRIBUTIONS}
+        counts = generate(
+            seed=options["seed"],
+            as_of=options["as_of"],
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            **distributions,
+        )
+        for collection_name, inserted in sorted(counts.items()):
+            self.stdout.write(f"{collection_name}: {inserted}")
+        self.stdout.write(self.style.SUCCESS(f"Generated {sum(counts.values())} document(s) in {db.name!r}."))
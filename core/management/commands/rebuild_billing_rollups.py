@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.billing_analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ("Recompute the BillingDailyRollups documents from the Billing collection. "
+            "Bills created or paid while it runs may be missed, so stop bill writes first.")
+
+    def handle(self, *args, **options):
+        days, undated = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt billing rollups for {days} day(s)."))
+        if undated:
+            self.stdout.write(self.style.WARNING(
+                f"{undated} bill(s) have no created_at date and were left out of the billed totals."
+            ))
@@ -0,0 +1,22 @@
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from core.users import revoke_user_tokens
+
+
+class Command(BaseCommand):
+    help = "Invalidate every access token issued so far to the given users, e.g. after a compromise."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="+", help="Ids of the users whose tokens to revoke.")
+
+    def handle(self, *args, **options):
+        for user_id in options["user_ids"]:
+            if not ObjectId.is_valid(user_id):
+                raise CommandError(f"Invalid user id: {user_id}")
+            user = revoke_user_tokens(user_id)
+            if user is None:
+                raise CommandError(f"User not found: {user_id}")
+            self.stdout.write(f"{user_id}: tokens before version {user['token_version']} revoked")
+        self.stdout.write(self.style.SUCCESS(
+            f"Revoked tokens of {len(options['user_ids'])} user(s); every worker refuses them "
+            f"within TOKEN_VERSION_TTL seconds."))
@@ -1,11 +1,43 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from bson.errors import InvalidId
 import json
 from datetime import datetime
-from core.collections import users_collection ,db, medical_history_collection, \
-medical_records_collection
+from core.collections import db, medical_history_collection, medical_records_collection
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.hydration import hydrate_users, lookup, patient_details, doctor_details
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+from core.bulk import InvalidBulkRequest, bulk_items, insert_items, bulk_response
+
+
+def build_medical_record(data, user):
+    """Medical record document for one posted item, or (None, error) if the item is invalid."""
+    patient_id = data.get("patient_id")
+    record_type = data.get("record_type")
+    description = data.get("description")
+    file_url = data.get("file_url")
+
+    # Validate required fields
+    if not all([patient_id, record_type, description, file_url]):
+        return None, "Missing required fields"
+
+    try:
+        patient_id = ObjectId(patient_id)
+    except (InvalidId, TypeError):
+        return None, "Invalid patient_id"
+
+    return {
+        "patient_id": patient_id,
+        "doctor_id": ObjectId(user.user_id),  # The logged-in doctor's ID
+        "record_type": record_type,
+        "description": description,
+        "file_url": file_url,
+        "uploaded_at": datetime.utcnow()
+    }, None
+
 
 @csrf_exempt
 @jwt_required
@@ -13,38 +45,20 @@ def post_medical_record(request):
     medical_records_collection = db["MedicalRecords"]
     if request.method == "POST":
         try:
-            # Get the logged-in user's ID from the request
-            user_id = request.user_id
-
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a doctor
-            if user.get("role") != "doctor":
+            if user.role != "doctor":
                 return JsonResponse({"error": "Only doctors can post medical records"}, status=403)
 
             # Parse the request body
             data = json.loads(request.body)
-            patient_id = data.get("patient_id")
-            record_type = data.get("record_type")
-            description = data.get("description")
-            file_url = data.get("file_url")
 
-            # Validate required fields
-            if not all([patient_id, record_type, description, file_url]):
-                return JsonResponse({"error": "Missing required fields"}, status=400)
-
-            # Create the medical record
-            medical_record = {
-                "patient_id": ObjectId(patient_id),
-                "doctor_id": ObjectId(user_id),  # The logged-in doctor's ID
-                "record_type": record_type,
-                "description": description,
-                "file_url": file_url,
-                "uploaded_at": datetime.utcnow()
-            }
+            # Validate the fields and create the medical record
+            medical_record, error = build_medical_record(data, user)
+            if error:
+                return JsonResponse({"error": error}, status=400)
 
             # Insert the record into the MedicalRecords collection
             result = medical_records_collection.insert_one(medical_record)
@@ -59,6 +73,32 @@ def post_medical_record(request):
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
 
+@csrf_exempt
+@jwt_required
+def post_medical_records_bulk(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        # The caller's identity and role come from the access token; checked once for the whole batch
+        user = request.principal
+        if user.role != "doctor":
+            return JsonResponse({"error": "Only doctors can post medical records"}, status=403)
+
+        # Parse the list of medical records
+        try:
+            items = bulk_items(request)
+        except InvalidBulkRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Validate each item and insert the valid ones in one round trip
+        results = insert_items(medical_records_collection, items, lambda item: build_medical_record(item, user))
+
+        return bulk_response(results)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
 # Function to post medical history (only for doctors)
 @jwt_required
 @csrf_exempt
@@ -69,13 +109,11 @@ def post_medical_history(request):
             # Get the logged-in user's ID from the request
             user_id = request.user_id
 
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a doctor
-            if user.get("role") != "doctor":
+            if user.role != "doctor":
                 return JsonResponse({"error": "Only doctors can post medical history"}, status=403)
 
             # Parse the request body
@@ -110,63 +148,72 @@ def post_medical_history(request):
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
 
+def medical_records_query(role, user_id):
+    """Query for the medical records `role` may list, or None if it may not list any."""
+    if role == "doctor":
+        return {"doctor_id": ObjectId(user_id)}
+    elif role == "patient":
+        return {"patient_id": ObjectId(user_id)}
+    return None
+
+
+def medical_record_participant_fields(role):
+    # Patients also see which doctor wrote the record
+    return ("patient_id", "doctor_id") if role == "patient" else ("patient_id",)
+
+
+def format_medical_records(medical_records, role, users):
+    """Attach participant details from a `hydrate_users` lookup to raw medical records."""
+    for record in medical_records:
+        # Attach patient details
+        patient = lookup(users, record["patient_id"])
+        if patient:
+            record["patient_details"] = patient_details(patient)
+
+        # Attach doctor details (if the logged-in user is a patient)
+        if role == "patient":
+            doctor = lookup(users, record["doctor_id"])
+            if doctor:
+                record["doctor_details"] = doctor_details(doctor)
+    return medical_records
+
+
 @jwt_required
 def get_medical_records(request):
     if request.method == "GET":
         try:
-            # Get the logged-in user's ID from the request
-            user_id = request.user_id
-
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
-
-            # Determine the user's role
-            role = user.get("role")
+            # The caller's identity and role come from the access token
+            role = request.principal.role
 
             # Build the query based on the user's role
-            if role == "doctor":
-                query = {"doctor_id": ObjectId(user_id)}
-            elif role == "patient":
-                query = {"patient_id": ObjectId(user_id)}
-            else:
+            query = medical_records_query(role, request.user_id)
+            if query is None:
                 return JsonResponse({"error": "Unauthorized access"}, status=403)
 
-            # Retrieve medical records based on the query
-            medical_records = list(medical_records_collection.find(query))
-
-            # Fetch personal details for each medical record
-            for record in medical_records:
-                # Fetch patient details
-                patient = users_collection.find_one({"_id": record["patient_id"]})
-                if patient:
-                    record["patient_details"] = {
-                        "first_name": patient["personal_details"]["first_name"],
-                        "last_name": patient["personal_details"]["last_name"],
-                        "age": patient["personal_details"]["age"],
-                        "gender": patient["personal_details"]["gender"]
-                    }
-
-                # Fetch doctor details (if the logged-in user is a patient)
-                if role == "patient":
-                    doctor = users_collection.find_one({"_id": record["doctor_id"]})
-                    if doctor:
-                        record["doctor_details"] = {
-                            "first_name": doctor["personal_details"]["first_name"],
-                            "last_name": doctor["personal_details"]["last_name"],
-                            "specialization": doctor.get("specialization", "")
-                        }
-
-                # Convert ObjectId to string for JSON serialization
-                record["_id"] = str(record["_id"])
-                record["patient_id"] = str(record["patient_id"])
-                record["doctor_id"] = str(record["doctor_id"])
+            # Read the requested page
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # Retrieve one page of medical records based on the query
+            medical_records, next_cursor = find_page(medical_records_collection, query, page)
+
+            # A repeat load of an unchanged page skips hydration and serialization
+            etag = page_etag(request, medical_records, next_cursor)
+            response = not_modified(request, etag)
+            if response:
+                return response
+
+            # Fetch every referenced participant in one round trip
+            users = hydrate_users(medical_records, *medical_record_participant_fields(role))
 
             # Return the list of medical records with personal details
-            return JsonResponse({"medical_records": medical_records}, status=200, safe=False)
+            return with_etag(BSONResponse({
+                "medical_records": format_medical_records(medical_records, role, users),
+                "next_cursor": next_cursor
+            }, status=200), etag)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
-    
\ No newline at end of file
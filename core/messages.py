@@ -1,10 +1,17 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from pymongo import DESCENDING
 import json
 from datetime import datetime
-from core.collections import users_collection, messages_collection
+from core.collections import messages_collection
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.hydration import hydrate_users, lookup
+from core.user_store import get_user
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+from core.conversations import thread_id_for, participant_name, record_message
 
 @jwt_required
 @csrf_exempt
@@ -13,12 +20,11 @@ def send_message(request):
         try:
             # Get the logged-in user's ID
             sender_id = request.user_id
-            sender = users_collection.find_one({"_id": ObjectId(sender_id)})
 
-            if not sender:
-                return JsonResponse({"error": "Sender not found"}, status=404)
+            # The caller's identity and role come from the access token
+            sender = request.principal
 
-            sender_role = sender.get("role")
+            sender_role = sender.role
 
             # Parse request data
             data = json.loads(request.body)
@@ -29,7 +35,7 @@ def send_message(request):
                 return JsonResponse({"error": "Receiver ID and message are required"}, status=400)
 
             # Check if the receiver exists
-            receiver = users_collection.find_one({"_id": ObjectId(receiver_id)})
+            receiver = get_user(receiver_id, "display_name")
 
             if not receiver:
                 return JsonResponse({"error": "Receiver not found"}, status=404)
@@ -53,15 +59,25 @@ def send_message(request):
                 "receiver_id": ObjectId(receiver_id),
                 "message": message_content,
                 "sent_at": datetime.utcnow(),
-                "status": "unread"
+                "status": "unread",
+                "thread_id": thread_id_for(sender_id, receiver_id)
             }
 
             # Insert message into Messages collection
             result = messages_collection.insert_one(message)
 
+            # Update the thread summary: last message and the receiver's unread count
+            receiver_details = receiver.get("personal_details", {})
+            record_message(
+                message,
+                participant_name(sender.first_name, sender.last_name, sender_role),
+                participant_name(receiver_details.get("first_name"), receiver_details.get("last_name"), receiver_role)
+            )
+
             return JsonResponse({
                 "message": "Message sent successfully",
-                "message_id": str(result.inserted_id)
+                "message_id": str(result.inserted_id),
+                "thread_id": message["thread_id"]
             }, status=201)
 
         except Exception as e:
@@ -69,40 +85,54 @@ def send_message(request):
 
     return JsonResponse({"error": "Method not allowed"}, status=405)
 
+def format_messages(messages, senders):
+    """Shape raw messages, attaching sender details from a `hydrate_users` lookup."""
+    message_list = []
+    for msg in messages:
+        sender = lookup(senders, msg["sender_id"]) or {}
+
+        message_list.append({
+            "message_id": msg["_id"],
+            "sender": {
+                "first_name": sender.get("personal_details", {}).get("first_name", "Unknown"),
+                "last_name": sender.get("personal_details", {}).get("last_name", "Unknown"),
+                "role": sender.get("role", "Unknown")
+            },
+            "message": msg["message"],
+            "timestamp": msg.get("sent_at", "Unknown")  # Fix: Provide default if missing
+        })
+    return message_list
+
+
 @jwt_required
 @csrf_exempt
 def get_messages(request):
     try:
         # Get the logged-in user's ID
-        user_id = request.user_id  # Assuming user_id is available in the request
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-
-        if not user:
-            return JsonResponse({"error": "User not found"}, status=404)
+        user_id = request.user_id  # Set by jwt_required from the access token
 
-        # Fetch messages where the logged-in user is the receiver
-        messages = messages_collection.find({"receiver_id": ObjectId(user_id)}).sort("created_at", -1)
+        # Read the requested page
+        try:
+            page = page_params(request)
+        except InvalidPageRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Repeat loads are answered from the validator alone
+        query = {"receiver_id": ObjectId(user_id)}
+        # Fetch one page of messages where the logged-in user is the receiver, newest first
+        messages, next_cursor = find_page(
+            messages_collection, query, page, sort_key="sent_at", direction=DESCENDING
+        )
+        etag = page_etag(request, messages, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        # Fetch every sender in one round trip
+        senders = hydrate_users(messages, "sender_id", view="display_name")
 
         # Format messages with sender details
-        message_list = []
-        for msg in messages:
-            sender = users_collection.find_one(
-                {"_id": ObjectId(msg["sender_id"])}, 
-                {"personal_details.first_name": 1, "personal_details.last_name": 1, "role": 1}
-            )
-
-            message_list.append({
-                "message_id": str(msg["_id"]),
-                "sender": {
-                    "first_name": sender.get("personal_details", {}).get("first_name", "Unknown"),
-                    "last_name": sender.get("personal_details", {}).get("last_name", "Unknown"),
-                    "role": sender.get("role", "Unknown")
-                },
-                "message": msg["message"],
-                "timestamp": msg.get("sent_at", "Unknown")  # Fix: Provide default if missing
-            })
-
-        return JsonResponse({"messages": message_list}, status=200)
+        return with_etag(BSONResponse({"messages": format_messages(messages, senders), "next_cursor": next_cursor}, status=200), etag)
 
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": str(e)}, status=500)
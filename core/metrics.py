@@ -0,0 +1,247 @@
+"""
+Small in-process metrics registry (counters, gauges and histograms with labels).
+
+Metrics register themselves in REGISTRY when they are created, at import time of
+the module that owns them. Updates only touch a dict under a lock. With
+METRICS_MULTIPROCESS_DIR set, every process periodically dumps a snapshot there
+and the /metrics endpoint merges all of them, so a scrape that lands on any
+gunicorn worker reports the whole server.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from django.conf import settings
+
+
+REGISTRY = {}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """Snapshot of `{label_values: value}`."""
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; values are `{"buckets": [...], "sum": s, "count": n}`."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            return {
+                key: {"buckets": list(state["buckets"]), "sum": state["sum"], "count": state["count"]}
+                for key, state in self._values.items()
+            }
+
+
+def snapshot():
+    """JSON-ready dump of every registered metric in this process."""
+    dumped = {}
+    for metric in list(REGISTRY.values()):
+        entry = {
+            "type": metric.type,
+            "help": metric.documentation,
+            "labelnames": list(metric.labelnames),
+            "samples": [[list(key), value] for key, value in metric.samples().items()],
+        }
+        if metric.type == "histogram":
+            entry["buckets"] = list(metric.buckets)
+        dumped[metric.name] = entry
+    return dumped
+
+
+def _merge_value(metric_type, current, value):
+    if current is None:
+        return value if metric_type != "histogram" else {
+            "buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]
+        }
+    if metric_type == "histogram":
+        current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+        current["sum"] += value["sum"]
+        current["count"] += value["count"]
+        return current
+    return current + value
+
+
+def merge_snapshots(snapshots):
+    """Sum counters, gauges and histograms with the same name and labels across snapshots."""
+    merged = {}
+    for dumped in snapshots:
+        for name, entry in dumped.items():
+            target = merged.setdefault(name, {**entry, "samples": {}})
+            for key, value in entry["samples"]:
+                key = tuple(key)
+                target["samples"][key] = _merge_value(entry["type"], target["samples"].get(key), value)
+    for entry in merged.values():
+        entry["samples"] = [[list(key), value] for key, value in entry["samples"].items()]
+    return merged
+
+
+# Multi-process aggregation
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _process_file(directory, pid):
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def flush(force=False):
+    """Write this process's snapshot to METRICS_MULTIPROCESS_DIR, at most once per interval."""
+    global _last_flush
+    directory = settings.METRICS_MULTIPROCESS_DIR
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        _last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename so readers never see a half-written file
+        fd, path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        with os.fdopen(fd, "w") as handle:
+            json.dump(snapshot(), handle)
+        os.replace(path, _process_file(directory, os.getpid()))
+    finally:
+        _flush_lock.release()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Snapshot of the whole server: every process's file when multi-process, else this process."""
+    directory = settings.METRICS_MULTIPROCESS_DIR
+    if not directory:
+        return snapshot()
+
+    flush(force=True)
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not (filename.startswith("metrics-") and filename.endswith(".json")):
+            continue
+        try:
+            pid = int(filename[len("metrics-"):-len(".json")])
+            with open(os.path.join(directory, filename)) as handle:
+                dumped = json.load(handle)
+        except (ValueError, OSError):
+            continue
+        if not _is_alive(pid):
+            # Counters of recycled workers still count; their gauges no longer describe anything
+            dumped = {name: entry for name, entry in dumped.items() if entry["type"] != "gauge"}
+        snapshots.append(dumped)
+    return merge_snapshots(snapshots)
+
+
+# Prometheus text exposition format
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(dumped):
+    lines = []
+    for name in sorted(dumped):
+        entry = dumped[name]
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['type']}")
+        names = entry["labelnames"]
+        for values, value in entry["samples"]:
+            if entry["type"] == "histogram":
+                for bound, count in zip(entry["buckets"], value["buckets"]):
+                    lines.append(f"{name}_bucket{_labels(names, values, [('le', _number(float(bound)))])} {count}")
+                lines.append(f"{name}_bucket{_labels(names, values, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{_labels(names, values)} {_number(float(value['sum']))}")
+                lines.append(f"{name}_count{_labels(names, values)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,90 @@
+"""
+HTTP request metrics.
+
+RequestMetricsMiddleware counts requests per route, method and status class and
+records latency, response size and MongoDB round trips per request. It sits
+first in MIDDLEWARE so the numbers include every other middleware.
+"""
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from core import metrics
+from core.metrics import Counter, Histogram
+from core.mongo_monitoring import stop_tracking, track_request
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by route, method and status class.",
+    ["route", "method", "status"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response (streamed bodies excluded), by route and method.",
+    ["route", "method"],
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes",
+    "Size of non-streaming response bodies, by route.",
+    ["route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+HTTP_MONGO_COMMANDS = Histogram(
+    "http_request_mongo_commands",
+    "MongoDB round trips made while handling one request, by route.",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+HTTP_MONGO_SECONDS = Histogram(
+    "http_request_mongo_seconds",
+    "Total MongoDB time spent while handling one request, by route.",
+    ["route"],
+)
+
+
+def _route(request):
+    # The URL pattern, not the path, so ids do not explode the label set
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "unmatched"
+
+
+def _record(request, response, started, stats):
+    route = _route(request)
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=f"{response.status_code // 100}xx")
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+    if not response.streaming:
+        HTTP_RESPONSE_BYTES.observe(len(response.content), route=route)
+    HTTP_MONGO_COMMANDS.observe(stats.commands, route=route)
+    HTTP_MONGO_SECONDS.observe(stats.seconds, route=route)
+    metrics.flush()
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats, token = track_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_tracking(token)
+        _record(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats, token = track_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_tracking(token)
+        _record(request, response, started, stats)
+        return response
@@ -0,0 +1,188 @@
+"""
+PyMongo event listeners that feed core.metrics.
+
+CommandLatencyListener times every command per collection and command name;
+PoolWaitListener records how long requests wait to check a connection out of
+the pool. Together they separate "Mongo is slow" from "we are starved for
+connections". Commands are also tallied against the current request, if one is
+being tracked, so the HTTP middleware can report round trips per request, and
+recorded one by one while a request is being profiled (see core.query_profiler).
+"""
+import contextvars
+import threading
+from pymongo import monitoring
+from core.metrics import Counter, Gauge, Histogram
+
+
+# Mongo commands are mostly sub-millisecond to tens of ms; keep resolution there
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_seconds",
+    "MongoDB command round-trip time by collection and command.",
+    ["collection", "command"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total",
+    "MongoDB commands that returned an error, by collection and command.",
+    ["collection", "command"],
+)
+MONGO_POOL_WAIT_SECONDS = Histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool.",
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "Connection checkouts that failed, by reason (e.g. timeout).",
+    ["reason"],
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_connections_checked_out",
+    "Connections currently checked out of the pool.",
+)
+
+
+class RequestMongoStats:
+    __slots__ = ("commands", "seconds")
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+
+
+_request_stats = contextvars.ContextVar("request_mongo_stats", default=None)
+
+
+def track_request():
+    """Start counting commands issued from the current context; returns (stats, token)."""
+    stats = RequestMongoStats()
+    return stats, _request_stats.set(stats)
+
+
+def stop_tracking(token):
+    _request_stats.reset(token)
+
+
+class ProfiledCommand:
+    __slots__ = ("collection", "name", "command", "seconds", "failed")
+
+    def __init__(self, collection, name, command):
+        self.collection = collection
+        self.name = name
+        self.command = command
+        self.seconds = 0.0
+        self.failed = False
+
+
+_request_profile = contextvars.ContextVar("request_mongo_profile", default=None)
+
+
+def start_profiling():
+    """Record every command issued from the current context; returns (commands, token)."""
+    commands = []
+    return commands, _request_profile.set(commands)
+
+
+def stop_profiling(token):
+    _request_profile.reset(token)
+
+
+def command_collection(command_name, command):
+    """Collection a command targets, or '' for database/admin commands."""
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+class CommandLatencyListener(monitoring.CommandListener):
+    def __init__(self):
+        # Succeeded/failed events do not carry the command document, so remember
+        # the collection from the started event until the reply arrives
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(event):
+        return event.request_id, event.connection_id
+
+    def started(self, event):
+        collection = command_collection(event.command_name, event.command)
+        profiled = None
+        profile = _request_profile.get()
+        if profile is not None:
+            profiled = ProfiledCommand(collection, event.command_name, event.command)
+            profile.append(profiled)
+        with self._lock:
+            self._pending[self._key(event)] = (collection, profiled)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.commands += 1
+
+    def _finish(self, event):
+        with self._lock:
+            return self._pending.pop(self._key(event), ("", None))
+
+    def _observe(self, event):
+        collection, profiled = self._finish(event)
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMAND_SECONDS.observe(seconds, collection=collection, command=event.command_name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.seconds += seconds
+        if profiled is not None:
+            profiled.seconds = seconds
+        return collection, profiled
+
+    def succeeded(self, event):
+        self._observe(event)
+
+    def failed(self, event):
+        collection, profiled = self._observe(event)
+        MONGO_COMMAND_FAILURES.inc(collection=collection, command=event.command_name)
+        if profiled is not None:
+            profiled.failed = True
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc()
+        if event.duration is not None:
+            MONGO_POOL_WAIT_SECONDS.observe(event.duration)
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.inc(reason=event.reason)
+        if event.duration is not None:
+            MONGO_POOL_WAIT_SECONDS.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+def event_listeners():
+    """Fresh listener instances for a new client."""
+    return [CommandLatencyListener(), PoolWaitListener()]
@@ -1,15 +1,122 @@
+"""
+MongoDB clients, created on first use in each process.
+
+`client` and `db` stand in for this process's MongoClient and database, so
+modules can bind collections (`db["Users"]`) at import time without connecting.
+The real client is created the first time one of them is used. A forked child
+(a gunicorn worker of a preloaded app) forgets the parent's client and creates
+its own, since PyMongo clients are not safe to use across a fork. `warm_up`
+connects ahead of the first request; gunicorn.conf.py calls it in each worker.
+"""
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from pymongo import MongoClient
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from core.mongo_monitoring import event_listeners
 
 # MongoDB Configuration
-MONGO_URI = os.getenv('MONGO_URI')
+MONGO_URI = settings.MONGO_URI
+
+DATABASE_NAME = settings.MONGO_DATABASE
+
+
+def client_options():
+    """Pool sizing, timeouts and monitoring shared by the sync and async clients."""
+    return {
+        "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        "event_listeners": event_listeners(),
+    }
+
+
+class LazyClient:
+    """A client built by `factory` on first use, and built again after a fork."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._forget()
+        os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self):
+        # In a child the parent's client (and a lock some parent thread held) must not be touched
+        self._client = None
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return client
+
+    def collection(self, name):
+        """This process's Collection object for `name` in DATABASE_NAME."""
+        try:
+            return self._collections[name]
+        except KeyError:
+            collection = self._collections[name] = self.get()[DATABASE_NAME][name]
+            return collection
+
+    def close(self):
+        """Close the client if this process has created one; the next use creates a new one."""
+        with self._lock:
+            client, self._client, self._collections = self._client, None, {}
+        if client is not None:
+            client.close()
+
+    def __getitem__(self, name):
+        return self.get()[name]
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+
+class LazyDatabase:
+    """DATABASE_NAME on a LazyClient; `db[name]` is a LazyCollection."""
+
+    def __init__(self, lazy_client):
+        self._client = lazy_client
+        self.name = DATABASE_NAME
+
+    def __getitem__(self, name):
+        return LazyCollection(self._client, name)
+
+    def __getattr__(self, attr):
+        return getattr(self._client.get()[DATABASE_NAME], attr)
+
+
+class LazyCollection:
+    """A collection that resolves to the current process's client on every use."""
+
+    __slots__ = ("_client", "name")
+
+    def __init__(self, lazy_client, name):
+        self._client = lazy_client
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._client.collection(self.name), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({DATABASE_NAME!r}, {self.name!r})"
+
+
+def warm_up(connections=1):
+    """Connect now instead of on the first request, with up to `connections` pooled sockets open."""
+    connections = max(1, connections)
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        # Concurrent pings each check out a connection, so the pool opens that many
+        list(pool.map(lambda _: client.admin.command("ping"), range(connections)))
 
-DATABASE_NAME = "test"
 
-# Initialize MongoDB Connection
-client = MongoClient(MONGO_URI)
-db = client[DATABASE_NAME]  # Only specify the database, collections will be handled in views
+client = LazyClient(lambda: MongoClient(MONGO_URI, **client_options()))
+db = LazyDatabase(client)  # Only specify the database, collections will be handled in views
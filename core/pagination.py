@@ -0,0 +1,112 @@
+import base64
+from bson import json_util
+from bson.errors import BSONError
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING
+
+
+class InvalidPageRequest(ValueError):
+    """Raised when the `cursor` or `limit` query parameters cannot be used."""
+
+
+def encode_cursor(document, sort_key):
+    """Opaque cursor pointing just past `document` in `(sort_key, _id)` order."""
+    position = {"id": document["_id"]}
+    if sort_key != "_id":
+        position["key"] = document.get(sort_key)
+    raw = json_util.dumps(position).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json_util.loads(raw)
+    except (ValueError, TypeError, BSONError):
+        raise InvalidPageRequest("Invalid cursor")
+    if not isinstance(position, dict) or "id" not in position:
+        raise InvalidPageRequest("Invalid cursor")
+    return position
+
+
+def page_params(request):
+    """Read `cursor` and `limit` from the query string; returns `(position, limit)`."""
+    limit = request.GET.get("limit")
+    if limit is None:
+        limit = settings.API_PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidPageRequest("limit must be an integer")
+        if limit < 1:
+            raise InvalidPageRequest("limit must be positive")
+        limit = min(limit, settings.API_MAX_PAGE_SIZE)
+
+    cursor = request.GET.get("cursor")
+    position = decode_cursor(cursor) if cursor else None
+    return position, limit
+
+
+def sort_spec(sort_key="_id", direction=ASCENDING):
+    if sort_key == "_id":
+        return [("_id", direction)]
+    # _id breaks ties so that pages never skip or repeat documents
+    return [(sort_key, direction), ("_id", direction)]
+
+
+def keyset_filter(query, position, sort_key="_id", direction=ASCENDING):
+    """Narrow `query` to the documents that sort after `position`."""
+    if position is None:
+        return query
+    operator = "$lt" if direction == DESCENDING else "$gt"
+    if sort_key == "_id":
+        after = {"_id": {operator: position["id"]}}
+    else:
+        key = position.get("key")
+        # Documents with a null or missing key sort before every other value, so they are
+        # the first page ascending and the last page descending; range operators on a
+        # value never match them, so they get their own branch
+        if key is None:
+            after = {sort_key: None, "_id": {operator: position["id"]}}
+            if direction == ASCENDING:
+                after = {"$or": [after, {sort_key: {"$ne": None}}]}
+        else:
+            after = {"$or": [
+                {sort_key: {operator: key}},
+                {sort_key: key, "_id": {operator: position["id"]}},
+            ]}
+            if direction == DESCENDING:
+                after["$or"].append({sort_key: None})
+    return {"$and": [query, after]} if query else after
+
+
+def _page_cursor(collection, query, page, sort_key, direction, projection):
+    position, limit = page
+    # One extra document tells us whether there is a next page
+    return (
+        collection.find(keyset_filter(query, position, sort_key, direction), projection)
+        .sort(sort_spec(sort_key, direction))
+        .limit(limit + 1)
+    )
+
+
+def _split_page(documents, page, sort_key):
+    limit = page[1]
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], sort_key)
+    return documents, next_cursor
+
+
+def find_page(collection, query, page, sort_key="_id", direction=ASCENDING, projection=None):
+    """Fetch one page of `query`; returns `(documents, next_cursor)`."""
+    documents = list(_page_cursor(collection, query, page, sort_key, direction, projection))
+    return _split_page(documents, page, sort_key)
+
+
+async def afind_page(collection, query, page, sort_key="_id", direction=ASCENDING, projection=None):
+    """`find_page` for an async collection."""
+    documents = await _page_cursor(collection, query, page, sort_key, direction, projection).to_list()
+    return _split_page(documents, page, sort_key)
@@ -0,0 +1,91 @@
+"""
+Password hashing on a bounded worker pool.
+
+bcrypt releases the GIL while it hashes, so a small thread pool runs hashes in
+parallel without letting a login burst take every request thread. When the pool
+and its queue are full, callers get PasswordHasherBusy instead of piling up.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from django.conf import settings
+from core.metrics import Counter, Gauge, Histogram
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when no hashing slot frees up within PASSWORD_HASH_QUEUE_TIMEOUT."""
+
+
+HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Password hash/verify jobs running or waiting in the pool.",
+)
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Password hash/verify jobs rejected because the pool was saturated.",
+)
+HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing or verifying a password, including queueing.",
+    ["operation"],
+)
+
+_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# Running jobs plus the ones allowed to wait for a worker
+_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE)
+
+
+def _release(future):
+    HASH_QUEUE_DEPTH.dec()
+    _slots.release()
+
+
+def _run(operation, func, *args):
+    if not _slots.acquire(timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT):
+        HASH_REJECTED.inc()
+        raise PasswordHasherBusy("Too many concurrent password operations")
+
+    HASH_QUEUE_DEPTH.inc()
+    started = time.perf_counter()
+    try:
+        future = _executor.submit(func, *args)
+    except Exception:
+        HASH_QUEUE_DEPTH.dec()
+        _slots.release()
+        raise
+    future.add_done_callback(_release)
+    try:
+        return future.result()
+    finally:
+        HASH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def hash_password(password: str) -> str:
+    return _run("hash", _hash, password, settings.BCRYPT_ROUNDS)
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return _run("verify", _verify, password, hashed_password)
+
+
+def hash_rounds(hashed_password: str) -> int:
+    # bcrypt hashes look like $2b$12$<salt+hash>; the middle field is the cost
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash was made with a different cost than BCRYPT_ROUNDS."""
+    return hash_rounds(hashed_password) != settings.BCRYPT_ROUNDS
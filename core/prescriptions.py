@@ -1,13 +1,38 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from bson.errors import InvalidId
 import json
 from datetime import datetime
-from core.collections import users_collection ,prescriptions_collection
+from core.collections import prescriptions_collection
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.hydration import hydrate_users, lookup
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+from core.bulk import InvalidBulkRequest, bulk_items, insert_items, bulk_response
 
 
+def build_prescription(data, user):
+    """Prescription document for one posted item, or (None, error) if the item is invalid."""
+    patient_id = data.get("patient_id")
+    medications = data.get("medications")
 
+    # Validate required fields
+    if not all([patient_id, medications]):
+        return None, "Missing required fields"
+
+    try:
+        patient_id = ObjectId(patient_id)
+    except (InvalidId, TypeError):
+        return None, "Invalid patient_id"
+
+    return {
+        "patient_id": patient_id,
+        "doctor_id": ObjectId(user.user_id),  # The logged-in doctor's ID
+        "prescribed_date": datetime.utcnow(),
+        "medications": medications
+    }, None
 
 
 # Function for doctors to post prescriptions
@@ -16,34 +41,20 @@ from core.users import jwt_required
 def post_prescription(request):
     if request.method == "POST":
         try:
-            # Get the logged-in user's ID from the request
-            user_id = request.user_id
-
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a doctor
-            if user.get("role") != "doctor":
+            if user.role != "doctor":
                 return JsonResponse({"error": "Only doctors can post prescriptions"}, status=403)
 
             # Parse the request body
             data = json.loads(request.body)
-            patient_id = data.get("patient_id")
-            medications = data.get("medications")
-
-            # Validate required fields
-            if not all([patient_id, medications]):
-                return JsonResponse({"error": "Missing required fields"}, status=400)
 
-            # Create the prescription document
-            prescription = {
-                "patient_id": ObjectId(patient_id),
-                "doctor_id": ObjectId(user_id),  # The logged-in doctor's ID
-                "prescribed_date": datetime.utcnow(),
-                "medications": medications
-            }
+            # Validate the fields and create the prescription document
+            prescription, error = build_prescription(data, user)
+            if error:
+                return JsonResponse({"error": error}, status=400)
 
             # Insert the prescription into the collection
             result = prescriptions_collection.insert_one(prescription)
@@ -56,47 +67,90 @@ def post_prescription(request):
             return JsonResponse({"error": str(e)}, status=500)
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
-    
+
+
+# Function for doctors to post many prescriptions at once
+@csrf_exempt
+@jwt_required
+def post_prescriptions_bulk(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        # The caller's identity and role come from the access token; checked once for the whole batch
+        user = request.principal
+        if user.role != "doctor":
+            return JsonResponse({"error": "Only doctors can post prescriptions"}, status=403)
+
+        # Parse the list of prescriptions
+        try:
+            items = bulk_items(request)
+        except InvalidBulkRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Validate each item and insert the valid ones in one round trip
+        results = insert_items(prescriptions_collection, items, lambda item: build_prescription(item, user))
+
+        return bulk_response(results)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def format_prescriptions(prescriptions, doctors):
+    """Attach the prescribing doctor's name from a `hydrate_users` lookup to raw prescriptions."""
+    for prescription in prescriptions:
+        # Attach the doctor's details
+        doctor = lookup(doctors, prescription["doctor_id"])
+        if doctor:
+            prescription["doctor_first_name"] = doctor["personal_details"]["first_name"]
+            prescription["doctor_last_name"] = doctor["personal_details"]["last_name"]
+
+        # Remove patient_id and doctor_id from response
+        prescription.pop("patient_id", None)
+        prescription.pop("doctor_id", None)
+    return prescriptions
+
 
 # Function for patients to view their prescriptions
 @jwt_required
 @csrf_exempt
-
 def get_patient_prescriptions(request):
     if request.method == "GET":
         try:
             # Get the logged-in user's ID from the request
             user_id = request.user_id
 
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a patient
-            if user.get("role") != "patient":
+            if user.role != "patient":
                 return JsonResponse({"error": "Only patients can view their prescriptions"}, status=403)
 
-            # Retrieve prescriptions for the logged-in patient
-            prescriptions = list(prescriptions_collection.find({"patient_id": ObjectId(user_id)}))
+            # Read the requested page
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
 
-            # Convert ObjectId to string for JSON serialization and fetch doctor's name
-            for prescription in prescriptions:
-                prescription["_id"] = str(prescription["_id"])
+            # Repeat loads are answered from the validator alone
+            query = {"patient_id": ObjectId(user_id)}
+            # Retrieve one page of prescriptions for the logged-in patient
+            prescriptions, next_cursor = find_page(prescriptions_collection, query, page)
+            etag = page_etag(request, prescriptions, next_cursor)
+            response = not_modified(request, etag)
+            if response:
+                return response
 
-                # Fetch the doctor's details
-                doctor = users_collection.find_one({"_id": ObjectId(prescription["doctor_id"])})
-                if doctor:
-                    prescription["doctor_first_name"] = doctor["personal_details"]["first_name"]
-                    prescription["doctor_last_name"] = doctor["personal_details"]["last_name"]
-                
-                # Remove patient_id and doctor_id from response
-                prescription.pop("patient_id", None)
-                prescription.pop("doctor_id", None)
+            # Fetch every prescribing doctor in one round trip
+            doctors = hydrate_users(prescriptions, "doctor_id")
 
             # Return the list of prescriptions as a JSON response
-            return JsonResponse({"prescriptions": prescriptions}, status=200, safe=False)
+            return with_etag(BSONResponse({
+                "prescriptions": format_prescriptions(prescriptions, doctors),
+                "next_cursor": next_cursor
+            }, status=200), etag)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
     else:
-        return JsonResponse({"error": "Method not allowed"}, status=405)
\ No newline at end of file
+        return JsonResponse({"error": "Method not allowed"}, status=405)
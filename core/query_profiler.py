@@ -0,0 +1,235 @@
+"""
+Per-request MongoDB profiler and N+1 detector, for development and staging.
+
+With MONGO_PROFILER=True, QueryProfilerMiddleware records every command a
+request issues (through core.mongo_monitoring's listener) and groups them by
+shape: collection, command and filter with the values taken out, so
+`find Users {_id: ?}` run once per row of a list shows up as one shape repeated
+N times. Every response carries the totals in X-Mongo-* headers and a
+`core.query_profiler` log record. Requests over MONGO_PROFILER_QUERY_BUDGET
+commands, or repeating a shape more than MONGO_PROFILER_REPEAT_LIMIT times, are
+logged as warnings; with MONGO_PROFILER_STRICT they raise QueryBudgetExceeded
+instead, so a test or staging run fails on them. MONGO_PROFILER_EXPLAIN adds the
+winning plan of the request's slowest query.
+
+Commands issued while a streamed body is sent, after the view has returned, are
+not counted. Without MONGO_PROFILER the middleware removes itself at startup.
+"""
+import json
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from core.mongo_monitoring import start_profiling, stop_profiling
+from core.mongodb import db
+
+logger = logging.getLogger(__name__)
+
+# Commands whose plan `explain` can show without running a write
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+
+# Parts of a command that say what it does rather than how it is sent
+SHAPE_FIELDS = {
+    "find": ("filter", "sort", "projection"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort", "update"),
+    "update": ("updates",),
+    "delete": ("deletes",),
+}
+
+# Fields that only matter to the wire protocol or the session; dropped before `explain`
+SESSION_FIELDS = {"lsid", "txnNumber", "startTransaction", "autocommit", "$db", "$clusterTime",
+                  "$readPreference", "readConcern", "writeConcern"}
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised under MONGO_PROFILER_STRICT when a request issues too many or repeated queries."""
+
+    def __init__(self, message, summary):
+        super().__init__(message)
+        self.summary = summary
+
+
+def _values_out(value):
+    """`value` with every literal replaced by '?' and every list collapsed to one element."""
+    if isinstance(value, dict):
+        return {key: _values_out(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # `$in` lists of any length are the same query
+        return [_values_out(value[0])] if value else []
+    return "?"
+
+
+def command_shape(name, command):
+    """What identifies a command as "the same query", whatever values it was sent with."""
+    shape = {}
+    for field in SHAPE_FIELDS.get(name, ()):
+        value = command.get(field)
+        if value is None:
+            continue
+        if field in ("sort", "projection", "key"):
+            shape[field] = value
+        elif field == "pipeline":
+            shape[field] = [{stage: _values_out(body) for stage, body in step.items()} for step in value]
+        elif field in ("updates", "deletes"):
+            shape[field] = [_values_out(statement.get("q")) for statement in value[:1]]
+        else:
+            shape[field] = _values_out(value)
+    return json.dumps(shape, sort_keys=True, default=str)
+
+
+def summarize(commands):
+    """Totals, per-shape counts and the slowest command of one request's profile."""
+    shapes = {}
+    for command in commands:
+        key = (command.collection, command.name, command_shape(command.name, command.command))
+        entry = shapes.setdefault(key, {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += command.seconds
+    slowest = max(commands, key=lambda command: command.seconds, default=None)
+    return {
+        "commands": len(commands),
+        "time_ms": round(sum(command.seconds for command in commands) * 1000, 3),
+        "failed": sum(command.failed for command in commands),
+        "shapes": [
+            {"collection": collection, "command": name, "shape": shape,
+             "count": entry["count"], "time_ms": round(entry["seconds"] * 1000, 3)}
+            for (collection, name, shape), entry in sorted(shapes.items(), key=lambda item: -item[1]["count"])
+        ],
+        "slowest": slowest,
+    }
+
+
+def plan_summary(explanation):
+    """The winning plan's stages, outermost first, e.g. 'FETCH < IXSCAN patient_id_1'."""
+    def find_plan(node):
+        if isinstance(node, dict):
+            if "winningPlan" in node:
+                return node["winningPlan"]
+            for value in node.values():
+                plan = find_plan(value)
+                if plan is not None:
+                    return plan
+        elif isinstance(node, list):
+            for value in node:
+                plan = find_plan(value)
+                if plan is not None:
+                    return plan
+        return None
+
+    plan = find_plan(explanation)
+    if plan is None:
+        return ""
+    plan = plan.get("queryPlan", plan)  # slot-based engine
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f" {plan['indexName']}"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " < ".join(stages)
+
+
+def explain(command):
+    """`plan_summary` of a recorded command, or '' if it cannot be explained."""
+    if command.name not in EXPLAINABLE:
+        return ""
+    body = {key: value for key, value in command.command.items() if key not in SESSION_FIELDS}
+    try:
+        return plan_summary(db.command({"explain": body, "verbosity": "queryPlanner"}))
+    except Exception:
+        logger.debug("Could not explain %s on %s", command.name, command.collection, exc_info=True)
+        return ""
+
+
+def problems(summary):
+    """Why this request's queries deserve a look; empty if they do not."""
+    found = []
+    budget = settings.MONGO_PROFILER_QUERY_BUDGET
+    if budget and summary["commands"] > budget:
+        found.append(f"{summary['commands']} MongoDB commands (budget {budget})")
+    for shape in summary["shapes"]:
+        if shape["count"] > settings.MONGO_PROFILER_REPEAT_LIMIT:
+            found.append(f"{shape['command']} on {shape['collection']} repeated {shape['count']} times "
+                         f"(possible N+1): {shape['shape']}")
+    return found
+
+
+def _report(request, response, summary, plan, started):
+    slowest = summary["slowest"]
+    response["X-Mongo-Commands"] = str(summary["commands"])
+    response["X-Mongo-Time-Ms"] = f"{summary['time_ms']:.3f}"
+    repeated = max((shape["count"] for shape in summary["shapes"]), default=0)
+    response["X-Mongo-Max-Repeats"] = str(repeated)
+    if slowest is not None:
+        response["X-Mongo-Slowest"] = f"{slowest.name} {slowest.collection} {slowest.seconds * 1000:.3f}ms"
+    if plan:
+        response["X-Mongo-Slowest-Plan"] = plan
+
+    found = problems(summary)
+    record = {
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        "commands": summary["commands"],
+        "mongo_ms": summary["time_ms"],
+        "shapes": summary["shapes"],
+        "slowest_plan": plan,
+        "problems": found,
+    }
+    if found:
+        logger.warning("%s %s: %s", request.method, request.path, "; ".join(found), extra={"mongo_profile": record})
+        if settings.MONGO_PROFILER_STRICT:
+            raise QueryBudgetExceeded(f"{request.method} {request.path}: {'; '.join(found)}", record)
+    else:
+        logger.info("%s %s: %d MongoDB command(s) in %.1fms", request.method, request.path,
+                    summary["commands"], summary["time_ms"], extra={"mongo_profile": record})
+
+
+def _slowest_plan(summary):
+    if not settings.MONGO_PROFILER_EXPLAIN or summary["slowest"] is None:
+        return ""
+    return explain(summary["slowest"])
+
+
+class QueryProfilerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.MONGO_PROFILER:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        commands, token = start_profiling()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_profiling(token)
+        # Explained after profiling stops, so the explain is not counted against the request
+        summary = summarize(commands)
+        _report(request, response, summary, _slowest_plan(summary), started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        commands, token = start_profiling()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_profiling(token)
+        summary = summarize(commands)
+        plan = await sync_to_async(_slowest_plan)(summary)
+        _report(request, response, summary, plan, started)
+        return response
@@ -0,0 +1,38 @@
+"""
+JSON rendering for documents straight out of MongoDB.
+
+`BSONResponse` is a drop-in for `JsonResponse` that encodes with orjson, which
+writes `datetime`, `date` and plain containers in C and returns bytes, so views
+can hand back raw documents instead of converting every `_id` and date in Python
+first. The few BSON types orjson does not know fall through to `bson_default`.
+"""
+from decimal import Decimal
+import orjson
+from bson import Decimal128, ObjectId
+from django.http import HttpResponse
+
+
+def bson_default(value):
+    """Encode the types orjson leaves to us; called once per such value."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """`data` as UTF-8 JSON bytes."""
+    return orjson.dumps(data, default=bson_default)
+
+
+class BSONResponse(HttpResponse):
+    """`JsonResponse` for payloads that may contain ObjectIds, datetimes and Decimal128s."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,200 @@
+"""
+Doctor working hours, slot length and free-slot search.
+
+A doctor's schedule lives in DoctorSchedules under the doctor's id:
+
+    {"_id": doctor_id, "slot_minutes": 30,
+     "working_hours": {"mon": [["09:00", "12:00"], ["13:00", "17:00"]], ...}}
+
+Doctors without one get DOCTOR_DEFAULT_SLOT_MINUTES and DOCTOR_DEFAULT_WORKING_HOURS
+on weekdays. Times are UTC. Every booked appointment carries a `slot_key` naming
+its doctor and slot start; a unique index on it makes the database reject a
+second booking of the same slot, so booking needs no read-modify-write.
+"""
+import json
+from bisect import bisect_left
+from datetime import datetime, time, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from core.collections import appointments_collection, doctor_schedules_collection
+from core.users import jwt_required
+from core.responses import BSONResponse
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class InvalidSchedule(ValueError):
+    """Raised when a posted schedule cannot be used."""
+
+
+def default_schedule():
+    start, end = settings.DOCTOR_DEFAULT_WORKING_HOURS.split("-")
+    return {
+        "slot_minutes": settings.DOCTOR_DEFAULT_SLOT_MINUTES,
+        "working_hours": {day: [[start, end]] for day in DAYS[:5]},
+    }
+
+
+def _parse_time(value):
+    try:
+        return time.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidSchedule(f"Invalid time {value!r}, expected HH:MM")
+
+
+def parse_schedule(data):
+    """Validated schedule document fields from a request body."""
+    slot_minutes = data.get("slot_minutes")
+    if isinstance(slot_minutes, bool) or not isinstance(slot_minutes, int) or not 5 <= slot_minutes <= 480:
+        raise InvalidSchedule("slot_minutes must be an integer between 5 and 480")
+
+    working_hours = data.get("working_hours")
+    if not isinstance(working_hours, dict) or not working_hours:
+        raise InvalidSchedule("working_hours must map days (mon..sun) to [start, end] ranges")
+
+    cleaned = {}
+    for day, ranges in working_hours.items():
+        if day not in DAYS:
+            raise InvalidSchedule(f"Unknown day {day!r}")
+        if not isinstance(ranges, list):
+            raise InvalidSchedule(f"working_hours.{day} must be a list of [start, end] ranges")
+        cleaned[day] = []
+        for entry in ranges:
+            if not isinstance(entry, list) or len(entry) != 2:
+                raise InvalidSchedule(f"working_hours.{day} must be a list of [start, end] ranges")
+            start, end = _parse_time(entry[0]), _parse_time(entry[1])
+            if start >= end:
+                raise InvalidSchedule(f"Range {entry} on {day} ends before it starts")
+            cleaned[day].append([start.strftime("%H:%M"), end.strftime("%H:%M")])
+        cleaned[day].sort()
+    return {"slot_minutes": slot_minutes, "working_hours": cleaned}
+
+
+def get_schedule(doctor_id):
+    schedule = doctor_schedules_collection.find_one({"_id": ObjectId(doctor_id)}, {"_id": 0, "updated_at": 0})
+    return schedule or default_schedule()
+
+
+def as_utc(moment):
+    """Naive UTC datetime, the form appointment dates are stored and compared in."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def day_slots(schedule, day):
+    """Start times of every slot on `day` (a date) under `schedule`."""
+    length = timedelta(minutes=schedule["slot_minutes"])
+    for start, end in schedule["working_hours"].get(DAYS[day.weekday()], []):
+        slot = datetime.combine(day, _parse_time(start))
+        close = datetime.combine(day, _parse_time(end))
+        while slot + length <= close:
+            yield slot
+            slot += length
+
+
+def is_slot_start(schedule, moment):
+    return moment in set(day_slots(schedule, moment.date()))
+
+
+def slot_key(doctor_id, slot_start):
+    # The canonical (lowercase) id, so one slot has one key however the id was spelled
+    return f"{ObjectId(doctor_id)}:{slot_start.strftime('%Y-%m-%dT%H:%M')}"
+
+
+def free_slots(doctor_id, schedule, first_day, last_day, now=None):
+    """Unbooked slot starts from `first_day` through `last_day`, skipping past ones."""
+    now = now or datetime.utcnow()
+    range_start = datetime.combine(first_day, time.min)
+    range_end = datetime.combine(last_day + timedelta(days=1), time.min)
+
+    # Covered by the (doctor_id, appointment_date, _id) index
+    booked = appointments_collection.find(
+        {"doctor_id": ObjectId(doctor_id), "appointment_date": {"$gte": range_start, "$lt": range_end}},
+        {"_id": 0, "appointment_date": 1}
+    )
+    booked_times = sorted(as_utc(appointment["appointment_date"]) for appointment in booked)
+
+    length = timedelta(minutes=schedule["slot_minutes"])
+    slots = []
+    day = first_day
+    while day <= last_day:
+        for slot in day_slots(schedule, day):
+            if slot < now:
+                continue
+            # Taken if any appointment starts inside it (covers bookings made under an older slot length)
+            index = bisect_left(booked_times, slot)
+            if index < len(booked_times) and booked_times[index] < slot + length:
+                continue
+            slots.append(slot)
+        day += timedelta(days=1)
+    return slots
+
+
+@csrf_exempt
+@jwt_required
+def doctor_schedule(request):
+    if request.method not in ("GET", "PUT"):
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        # Doctors manage their own schedule
+        if request.principal.role != "doctor":
+            return JsonResponse({"error": "Only doctors have a schedule"}, status=403)
+        doctor_id = request.user_id
+
+        if request.method == "PUT":
+            # Validate and store the new schedule
+            try:
+                schedule = parse_schedule(json.loads(request.body))
+            except InvalidSchedule as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            doctor_schedules_collection.update_one(
+                {"_id": ObjectId(doctor_id)},
+                {"$set": {**schedule, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+            return JsonResponse({"message": "Schedule updated", "schedule": schedule}, status=200)
+
+        return JsonResponse({"schedule": get_schedule(doctor_id)}, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_required
+def get_free_slots(request, doctor_id):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        try:
+            ObjectId(doctor_id)
+        except InvalidId:
+            return JsonResponse({"error": "Invalid doctor ID"}, status=400)
+
+        # Read the date range; defaults to the coming week
+        today = datetime.utcnow().date()
+        try:
+            first_day = datetime.fromisoformat(request.GET["from"]).date() if request.GET.get("from") else today
+            last_day = datetime.fromisoformat(request.GET["to"]).date() if request.GET.get("to") else first_day + timedelta(days=6)
+        except ValueError:
+            return JsonResponse({"error": "Invalid date, expected YYYY-MM-DD"}, status=400)
+        if last_day < first_day:
+            return JsonResponse({"error": "to must not be before from"}, status=400)
+        if (last_day - first_day).days >= settings.FREE_SLOT_MAX_DAYS:
+            return JsonResponse({"error": f"At most {settings.FREE_SLOT_MAX_DAYS} days per search"}, status=400)
+
+        schedule = get_schedule(doctor_id)
+        slots = free_slots(doctor_id, schedule, first_day, last_day)
+
+        return BSONResponse({
+            "doctor_id": doctor_id,
+            "slot_minutes": schedule["slot_minutes"],
+            "slots": slots
+        }, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
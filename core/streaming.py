@@ -0,0 +1,102 @@
+from itertools import islice
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from core.responses import dumps
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def wants_stream(request):
+    """True when the client asked for a streamed export instead of a page."""
+    if request.GET.get("stream") in ("1", "true"):
+        return True
+    return wants_ndjson(request)
+
+
+def wants_ndjson(request):
+    if request.GET.get("format") == "ndjson":
+        return True
+    return NDJSON_CONTENT_TYPE in request.headers.get("Accept", "")
+
+
+def _batches(cursor, batch_size):
+    """Yield lists of at most `batch_size` documents, matching the cursor's own batches."""
+    cursor.batch_size(batch_size)
+    iterator = iter(cursor)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+async def _abatches(cursor, batch_size):
+    cursor.batch_size(batch_size)
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _json_array(cursor, key, format_batch, batch_size):
+    yield f'{{"{key}": ['.encode()
+    first = True
+    for batch in _batches(cursor, batch_size):
+        items = b",".join(dumps(item) for item in format_batch(batch))
+        if not items:
+            continue
+        yield items if first else b"," + items
+        first = False
+    yield b"]}"
+
+
+def _ndjson(cursor, format_batch, batch_size):
+    for batch in _batches(cursor, batch_size):
+        lines = b"".join(dumps(item) + b"\n" for item in format_batch(batch))
+        if lines:
+            yield lines
+
+
+async def _ajson_array(cursor, key, aformat_batch, batch_size):
+    yield f'{{"{key}": ['.encode()
+    first = True
+    async for batch in _abatches(cursor, batch_size):
+        items = b",".join(dumps(item) for item in await aformat_batch(batch))
+        if not items:
+            continue
+        yield items if first else b"," + items
+        first = False
+    yield b"]}"
+
+
+async def _andjson(cursor, aformat_batch, batch_size):
+    async for batch in _abatches(cursor, batch_size):
+        lines = b"".join(dumps(item) + b"\n" for item in await aformat_batch(batch))
+        if lines:
+            yield lines
+
+
+def stream_response(request, cursor, key, format_batch):
+    """
+    Stream every document of `cursor` as `{key: [...]}` (or NDJSON when requested).
+
+    `format_batch` turns a list of raw documents into a list of JSON-ready dicts,
+    so per-batch lookups stay batched while memory stays bounded by the batch size.
+    """
+    batch_size = settings.STREAM_BATCH_SIZE
+    if wants_ndjson(request):
+        return StreamingHttpResponse(_ndjson(cursor, format_batch, batch_size), content_type=NDJSON_CONTENT_TYPE)
+    return StreamingHttpResponse(_json_array(cursor, key, format_batch, batch_size), content_type="application/json")
+
+
+def astream_response(request, cursor, key, aformat_batch):
+    """`stream_response` for an async cursor; `aformat_batch` is a coroutine function."""
+    batch_size = settings.STREAM_BATCH_SIZE
+    if wants_ndjson(request):
+        return StreamingHttpResponse(_andjson(cursor, aformat_batch, batch_size), content_type=NDJSON_CONTENT_TYPE)
+    return StreamingHttpResponse(_ajson_array(cursor, key, aformat_batch, batch_size), content_type="application/json")
@@ -0,0 +1,387 @@
+"""
+Synthetic hospital data for load and scale testing.
+
+`generate` writes users, appointments, medical records and history,
+prescriptions, test results, bills, consultations and messages (with their
+conversation summaries), all referencing each other consistently. How many of
+each there are comes from DISTRIBUTIONS: per-patient counts are drawn from a
+Poisson distribution around the configured mean, and patients are spread over
+doctors uniformly or, with `doctor_skew`, Zipf-like so a few doctors carry most
+of the load.
+
+Documents are generated one patient at a time by a single seeded `Random`, and
+`_id`s come from a counter rather than the clock, so the same seed, settings and
+`as_of` date always produce the same data. Only the writes are parallel:
+`BatchWriter` hands `insert_many` batches to a thread pool, with a bounded number
+in flight so memory stays flat however many millions of documents are written.
+Indexes are built once the data is in.
+"""
+import math
+import random
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate, count
+from bson import ObjectId
+from core import collections as c
+from core.billing_analytics import rebuild_rollups
+from core.conversations import MESSAGE_PREVIEW_LENGTH, participant_name, thread_id_for
+from core.indexes import ensure_indexes
+from core.mongodb import db
+from core.passwords import hash_password
+from core.schedules import default_schedule, day_slots, slot_key
+from core.versioning import FIRST_VERSION
+
+# Every generated user logs in with this password
+SYNTHETIC_PASSWORD = "synthetic-password"
+
+# name -> (default, help); counts are Poisson means unless noted
+DISTRIBUTIONS = {
+    "patients": (1000, "Number of patients."),
+    "patients_per_doctor": (20, "Average patients per doctor; sets the number of doctors."),
+    "doctor_skew": (0.0, "Zipf exponent of patients over doctors (0 spreads them evenly)."),
+    "receptionists": (5, "Number of receptionists."),
+    "admins": (2, "Number of admins."),
+    "appointments_per_patient": (4, "Appointments per patient."),
+    "future_appointment_fraction": (0.25, "Share of appointments still to come."),
+    "medical_records_per_patient": (3, "Medical records per patient."),
+    "test_results_per_record": (1, "Test results per medical record."),
+    "history_per_patient": (1, "Medical history entries per patient."),
+    "prescriptions_per_patient": (2, "Prescriptions per patient."),
+    "bills_per_patient": (3, "Bills per patient."),
+    "paid_bill_fraction": (0.7, "Share of bills that are paid."),
+    "consultations_per_patient": (1, "Video consultations per patient."),
+    "messages_per_thread": (8, "Messages between each patient and their doctor."),
+    "history_days": (365, "How far back dates are spread."),
+}
+
+FIRST_NAMES = ["Amara", "Ben", "Chen", "Dana", "Elif", "Femi", "Grace", "Hiro", "Ines", "Jonas", "Kavya", "Luis",
+               "Maya", "Noah", "Olga", "Priya", "Quinn", "Rosa", "Sami", "Tariq", "Uma", "Viktor", "Wen", "Yusuf"]
+LAST_NAMES = ["Smith", "Okafor", "Nguyen", "Garcia", "Kowalski", "Haddad", "Tanaka", "Silva", "Ivanova", "Murphy",
+              "Khan", "Rossi", "Novak", "Jensen", "Mensah", "Cohen"]
+SPECIALIZATIONS = ["Cardiology", "Dermatology", "General Practice", "Neurology", "Oncology", "Pediatrics", "Psychiatry"]
+RECORD_TYPES = ["Lab Report", "Imaging", "Discharge Summary", "Visit Note", "Referral"]
+TESTS = [("CBC", "10^9/L", 4.0, 11.0), ("HbA1c", "%", 4.5, 9.5), ("LDL", "mmol/L", 1.5, 5.5), ("TSH", "mIU/L", 0.3, 6.0)]
+MEDICATIONS = ["Amoxicillin", "Atorvastatin", "Levothyroxine", "Lisinopril", "Metformin", "Omeprazole", "Sertraline"]
+CONDITIONS = ["Asthma", "Diabetes", "Hypertension", "Hypothyroidism", "Migraine", "Osteoarthritis"]
+SERVICES = ["Consultation", "Blood Test", "X-Ray", "MRI", "Vaccination", "Physiotherapy"]
+PAYMENT_METHODS = ["card", "card", "cash", "insurance"]
+
+
+def username(role, index):
+    """Username of the `index`-th generated user of `role`."""
+    return f"synthetic-{role}-{index}"
+
+
+def options(**overrides):
+    """DISTRIBUTIONS defaults with `overrides` applied; unknown names are an error."""
+    unknown = set(overrides) - set(DISTRIBUTIONS)
+    if unknown:
+        raise ValueError(f"Unknown distribution(s): {', '.join(sorted(unknown))}")
+    return {name: overrides.get(name, default) for name, (default, _) in DISTRIBUTIONS.items()}
+
+
+def poisson(rng, mean):
+    """A Poisson-distributed count; normal approximation for large means."""
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    limit, k, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        k += 1
+        product *= rng.random()
+    return k
+
+
+class BatchWriter:
+    """Buffers documents per collection and writes them with parallel unordered `insert_many`s."""
+
+    def __init__(self, batch_size=1000, workers=4):
+        self.batch_size = batch_size
+        self.counts = {}
+        self._buffers = {}  # collection name -> (collection, documents)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._in_flight = deque()
+        self._max_in_flight = workers * 2
+
+    def add(self, collection, document):
+        _, documents = self._buffers.setdefault(collection.name, (collection, []))
+        documents.append(document)
+        if len(documents) >= self.batch_size:
+            self._submit(collection.name)
+
+    def _submit(self, name):
+        collection, documents = self._buffers.pop(name)
+        self.counts[name] = self.counts.get(name, 0) + len(documents)
+        # Wait for the oldest batch rather than queueing without bound
+        while len(self._in_flight) >= self._max_in_flight:
+            self._in_flight.popleft().result()
+        self._in_flight.append(self._pool.submit(collection.insert_many, documents, ordered=False))
+
+    def close(self):
+        """Write what is left and wait for every batch; re-raises the first failed write."""
+        try:
+            for name in list(self._buffers):
+                self._submit(name)
+            while self._in_flight:
+                self._in_flight.popleft().result()
+        finally:
+            self._pool.shutdown()
+
+
+def weekday_slots(schedule, first_day, step):
+    """Slot starts under `schedule` from `first_day`, one day at a time in `step` direction."""
+    day = first_day
+    while True:
+        slots = list(day_slots(schedule, day))
+        yield from (slots if step > 0 else reversed(slots))
+        day += timedelta(days=step)
+
+
+class _Generator:
+    def __init__(self, seed, settings, as_of, writer, password):
+        self.rng = random.Random(seed)
+        self.settings = settings
+        self.now = datetime.combine(as_of, time(12))
+        self.writer = writer
+        self.password = password
+        # `_id`s from a counter under one fixed timestamp: unique and reproducible
+        self._timestamp = (as_of - date(1970, 1, 1)).days * 86400
+        self._ids = count()
+        self.schedule = default_schedule()
+
+    def object_id(self):
+        return ObjectId(struct.pack(">IQ", self._timestamp, next(self._ids)))
+
+    def moment(self, max_days_ago=None):
+        """A time within the last `history_days` (or `max_days_ago`) days."""
+        days = self.settings["history_days"] if max_days_ago is None else max_days_ago
+        return self.now - timedelta(seconds=self.rng.randint(0, max(1, int(days * 86400))))
+
+    def user(self, role, index):
+        rng = self.rng
+        name = username(role, index)
+        phone = f"+1555{rng.randint(0, 9999999):07d}"
+        user = {
+            "_id": self.object_id(),
+            "username": name,
+            "password": self.password,
+            "role": role,
+            "personal_details": {
+                "first_name": rng.choice(FIRST_NAMES),
+                "last_name": rng.choice(LAST_NAMES),
+                "age": rng.randint(18, 95) if role == "patient" else rng.randint(28, 70),
+                "gender": rng.choice(["Female", "Male", "Other"]),
+                "email": f"{name}@synthetic.example",
+                "phone": phone,
+            },
+            "contact": {"email": f"{name}@synthetic.example", "phone": [phone]},
+        }
+        if role == "doctor":
+            user["specialization"] = rng.choice(SPECIALIZATIONS)
+            user["license_number"] = f"LIC-{index:07d}"
+        self.writer.add(c.users_collection, user)
+        return user
+
+    def run(self):
+        settings, rng = self.settings, self.rng
+        doctor_count = max(1, math.ceil(settings["patients"] / max(settings["patients_per_doctor"], 1)))
+        doctors = [self.user("doctor", i) for i in range(doctor_count)]
+        receptionists = [self.user("receptionist", i) for i in range(max(1, settings["receptionists"]))]
+        for i in range(settings["admins"]):
+            self.user("admin", i)
+
+        weights = [1 / (rank + 1) ** settings["doctor_skew"] for rank in range(doctor_count)]
+        cum_weights = list(accumulate(weights))
+        # Past appointments are laid out backwards from yesterday and future ones forwards from tomorrow
+        today = self.now.date()
+        past_slots = {d["_id"]: weekday_slots(self.schedule, today - timedelta(days=1), -1) for d in doctors}
+        future_slots = {d["_id"]: weekday_slots(self.schedule, today + timedelta(days=1), 1) for d in doctors}
+
+        for index in range(settings["patients"]):
+            patient = self.user("patient", index)
+            doctor = rng.choices(doctors, cum_weights=cum_weights)[0]
+            self.appointments(patient, doctor, past_slots[doctor["_id"]], future_slots[doctor["_id"]])
+            self.medical_records(patient, doctor)
+            self.history(patient, doctor)
+            self.prescriptions(patient, doctor)
+            self.bills(patient, receptionists)
+            self.consultations(patient, doctor)
+            self.messages(patient, doctor)
+
+    def appointments(self, patient, doctor, past_slots, future_slots):
+        rng = self.rng
+        for _ in range(poisson(rng, self.settings["appointments_per_patient"])):
+            upcoming = rng.random() < self.settings["future_appointment_fraction"]
+            slot = next(future_slots if upcoming else past_slots)
+            self.writer.add(c.appointments_collection, {
+                "_id": self.object_id(),
+                "patient_id": patient["_id"],
+                "doctor_id": doctor["_id"],
+                "appointment_date": slot,
+                "slot_key": slot_key(str(doctor["_id"]), slot),
+                "status": "Scheduled" if upcoming else rng.choice(["Completed", "Completed", "Completed", "Cancelled"]),
+                "notes": "",
+                "version": FIRST_VERSION,
+            })
+
+    def medical_records(self, patient, doctor):
+        rng = self.rng
+        uploaded_by = f"{doctor['personal_details']['first_name']} {doctor['personal_details']['last_name']}"
+        for n in range(poisson(rng, self.settings["medical_records_per_patient"])):
+            record = {
+                "_id": self.object_id(),
+                "patient_id": patient["_id"],
+                "doctor_id": doctor["_id"],
+                "record_type": rng.choice(RECORD_TYPES),
+                "description": f"{rng.choice(RECORD_TYPES)} for {rng.choice(CONDITIONS).lower()} follow-up",
+                "file_url": f"https://files.synthetic.example/{patient['_id']}/{n}.pdf",
+                "uploaded_at": self.moment(),
+            }
+            self.writer.add(c.medical_records_collection, record)
+            for _ in range(poisson(rng, self.settings["test_results_per_record"])):
+                test_name, unit, low, high = rng.choice(TESTS)
+                self.writer.add(c.test_results_collection, {
+                    "_id": self.object_id(),
+                    "medical_record_id": record["_id"],
+                    "patient_id": patient["_id"],
+                    "doctor_id": doctor["_id"],
+                    "test_name": test_name,
+                    "test_date": record["uploaded_at"],
+                    "results": {"value": round(rng.uniform(low * 0.8, high * 1.2), 2), "unit": unit},
+                    "status": "Completed",
+                    "remarks": "",
+                    "uploaded_by": uploaded_by,
+                })
+
+    def history(self, patient, doctor):
+        rng = self.rng
+        for _ in range(poisson(rng, self.settings["history_per_patient"])):
+            self.writer.add(c.medical_history_collection, {
+                "_id": self.object_id(),
+                "patient_id": patient["_id"],
+                "diagnosed_by": doctor["_id"],
+                "conditions": rng.sample(CONDITIONS, rng.randint(1, 3)),
+                "documents": [f"https://files.synthetic.example/{patient['_id']}/history.pdf"],
+                "registered_at": self.moment(),
+            })
+
+    def prescriptions(self, patient, doctor):
+        rng = self.rng
+        for _ in range(poisson(rng, self.settings["prescriptions_per_patient"])):
+            self.writer.add(c.prescriptions_collection, {
+                "_id": self.object_id(),
+                "patient_id": patient["_id"],
+                "doctor_id": doctor["_id"],
+                "prescribed_date": self.moment(),
+                "medications": [
+                    {"name": name, "dosage": f"{rng.choice([5, 10, 20, 50, 100, 500])}mg", "frequency": "daily"}
+                    for name in rng.sample(MEDICATIONS, rng.randint(1, 3))
+                ],
+            })
+
+    def bills(self, patient, receptionists):
+        rng = self.rng
+        for _ in range(poisson(rng, self.settings["bills_per_patient"])):
+            created_at = self.moment()
+            bill = {
+                "_id": self.object_id(),
+                "patient_id": patient["_id"],
+                "receptionist_id": rng.choice(receptionists)["_id"],
+                "total_amount": round(rng.uniform(20, 1500), 2),
+                "payment_status": "Unpaid",
+                "services": rng.sample(SERVICES, rng.randint(1, 3)),
+                "created_at": created_at,
+                "version": FIRST_VERSION,
+            }
+            if rng.random() < self.settings["paid_bill_fraction"]:
+                bill["payment_status"] = "Paid"
+                bill["version"] += 1
+                bill["payment_method"] = rng.choice(PAYMENT_METHODS)
+                bill["paid_at"] = bill["updated_at"] = min(self.now, created_at + timedelta(days=rng.randint(0, 30)))
+            self.writer.add(c.billing_collection, bill)
+
+    def consultations(self, patient, doctor):
+        rng = self.rng
+        uploaded_by = f"{doctor['personal_details']['first_name']} {doctor['personal_details']['last_name']}"
+        for _ in range(poisson(rng, self.settings["consultations_per_patient"])):
+            self.writer.add(c.consultations_collection, {
+                "_id": self.object_id(),
+                "doctor_id": doctor["_id"],
+                "patient_id": patient["_id"],
+                "meeting_link": f"https://meet.synthetic.example/{self.rng.getrandbits(48):012x}",
+                "consultation_date": self.now + timedelta(days=rng.randint(-60, 60), hours=rng.randint(-4, 4)),
+                "status": "Scheduled",
+                "uploaded_by": uploaded_by,
+                "created_at": self.moment(max_days_ago=60),
+            })
+
+    def messages(self, patient, doctor):
+        rng = self.rng
+        total = poisson(rng, self.settings["messages_per_thread"])
+        if not total:
+            return
+        thread_id = thread_id_for(patient["_id"], doctor["_id"])
+        unread = {str(patient["_id"]): 0, str(doctor["_id"]): 0}
+        # The last few messages are still unread by whoever received them
+        unread_from = total - rng.randint(0, min(3, total))
+        sent_at = self.moment()
+        for n in range(total):
+            sender, receiver = (patient, doctor) if rng.random() < 0.5 else (doctor, patient)
+            sent_at = min(self.now, sent_at + timedelta(minutes=rng.randint(1, 2880)))
+            message = {
+                "_id": self.object_id(),
+                "sender_id": sender["_id"],
+                "receiver_id": receiver["_id"],
+                "message": f"Synthetic message {n} about the {rng.choice(SERVICES).lower()}",
+                "sent_at": sent_at,
+                "status": "unread" if n >= unread_from else "read",
+                "thread_id": thread_id,
+            }
+            if n >= unread_from:
+                unread[str(receiver["_id"])] += 1
+            self.writer.add(c.messages_collection, message)
+
+        names = {
+            str(user["_id"]): participant_name(user["personal_details"]["first_name"],
+                                               user["personal_details"]["last_name"], user["role"])
+            for user in (patient, doctor)
+        }
+        self.writer.add(c.conversations_collection, {
+            "_id": thread_id,
+            "participants": sorted([patient["_id"], doctor["_id"]]),
+            "names": names,
+            "last_message": {
+                "message_id": message["_id"],
+                "sender_id": message["sender_id"],
+                "preview": message["message"][:MESSAGE_PREVIEW_LENGTH],
+            },
+            "last_message_at": message["sent_at"],
+            "updated_at": message["sent_at"],
+            "unread": unread,
+        })
+
+
+def is_empty():
+    return not any(db[name].estimated_document_count() for name in db.list_collection_names())
+
+
+def generate(seed=0, as_of=None, batch_size=1000, workers=4, **distributions):
+    """Write a full synthetic dataset into the (empty) database; returns `{collection: count}`.
+
+    `as_of` (a date, default today) anchors every generated date, so together
+    with `seed` and `distributions` it fixes the data exactly.
+    """
+    settings = options(**distributions)
+    writer = BatchWriter(batch_size, workers)
+    # One bcrypt hash for everybody; hashing per user would take longer than the rest
+    generator = _Generator(seed, settings, as_of or date.today(), writer, hash_password(SYNTHETIC_PASSWORD))
+    try:
+        generator.run()
+    finally:
+        writer.close()
+    ensure_indexes()
+    rebuild_rollups()
+    return writer.counts
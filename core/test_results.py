@@ -1,60 +1,75 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
+from bson.errors import InvalidId
 import json
 from datetime import datetime
-from core.collections import users_collection ,test_results_collection
+from core.collections import test_results_collection
 from core.users import jwt_required
+from core.pagination import InvalidPageRequest, page_params, find_page
+from core.hydration import hydrate_users, lookup, patient_details, full_name
+from core.responses import BSONResponse
+from core.conditional import not_modified, page_etag, with_etag
+from core.bulk import InvalidBulkRequest, bulk_items, insert_items, bulk_response
+
+
+def build_test_result(data, user):
+    """Test result document for one posted item, or (None, error) if the item is invalid."""
+    medical_record_id = data.get("medical_record_id")
+    patient_id = data.get("patient_id")
+    test_name = data.get("test_name")
+    test_date = data.get("test_date")  # Expected in ISO format
+    results = data.get("results")
+    remarks = data.get("remarks", "")
+
+    # Validate required fields
+    if not all([medical_record_id, patient_id, test_name, test_date, results]):
+        return None, "Missing required fields"
+
+    # Convert test_date to datetime object
+    try:
+        test_date = datetime.fromisoformat(test_date)
+    except (TypeError, ValueError):
+        return None, "Invalid date format"
+
+    try:
+        medical_record_id = ObjectId(medical_record_id)
+        patient_id = ObjectId(patient_id)
+    except (InvalidId, TypeError):
+        return None, "Invalid medical_record_id or patient_id"
+
+    return {
+        "medical_record_id": medical_record_id,
+        "patient_id": patient_id,
+        "doctor_id": ObjectId(user.user_id),
+        "test_name": test_name,
+        "test_date": test_date,
+        "results": results,
+        "status": "Completed",
+        "remarks": remarks,
+        "uploaded_by": user.full_name
+    }, None
+
 
 @csrf_exempt
 @jwt_required
 def post_test_result(request):
     if request.method == "POST":
         try:
-            # Get the logged-in user's ID from the request
-            user_id = request.user_id
-
-            # Fetch the user from the database
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return JsonResponse({"error": "User not found"}, status=404)
+            # The caller's identity and role come from the access token
+            user = request.principal
 
             # Check if the user is a doctor
-            if user.get("role") != "doctor":
+            if user.role != "doctor":
                 return JsonResponse({"error": "Only doctors can post test results"}, status=403)
 
             # Parse the request body
             data = json.loads(request.body)
 
-            medical_record_id = data.get("medical_record_id")
-            patient_id = data.get("patient_id")
-            test_name = data.get("test_name")
-            test_date = data.get("test_date")  # Expected in ISO format
-            results = data.get("results")
-            remarks = data.get("remarks", "")
-
-            # Validate required fields
-            if not all([medical_record_id, patient_id, test_name, test_date, results]):
-                return JsonResponse({"error": "Missing required fields"}, status=400)
-
-            # Convert test_date to datetime object
-            try:
-                test_date = datetime.fromisoformat(test_date)
-            except ValueError:
-                return JsonResponse({"error": "Invalid date format"}, status=400)
-
-            # Create the test result document
-            test_result = {
-                "medical_record_id": ObjectId(medical_record_id),
-                "patient_id": ObjectId(patient_id),
-                "doctor_id": ObjectId(user_id),
-                "test_name": test_name,
-                "test_date": test_date,
-                "results": results,
-                "status": "Completed",
-                "remarks": remarks,
-                "uploaded_by": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-            }
+            # Validate the fields and build the test result document
+            test_result, error = build_test_result(data, user)
+            if error:
+                return JsonResponse({"error": error}, status=400)
 
             # Insert into the test results collection
             result = test_results_collection.insert_one(test_result)
@@ -69,64 +84,113 @@ def post_test_result(request):
 
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
-    
+
+
+@csrf_exempt
+@jwt_required
+def post_test_results_bulk(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        # The caller's identity and role come from the access token; checked once for the whole batch
+        user = request.principal
+        if user.role != "doctor":
+            return JsonResponse({"error": "Only doctors can post test results"}, status=403)
+
+        # Parse the list of test results
+        try:
+            items = bulk_items(request)
+        except InvalidBulkRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Validate each item and insert the valid ones in one round trip
+        results = insert_items(test_results_collection, items, lambda item: build_test_result(item, user))
+
+        return bulk_response(results)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def test_results_query(user_role, user_id):
+    """Query for the test results `user_role` may list, or None if it may not list any."""
+    if user_role == "doctor":
+        return {"doctor_id": ObjectId(user_id)}  # Doctor sees only the tests they uploaded
+    elif user_role == "patient":
+        return {"patient_id": ObjectId(user_id)}  # Patient sees only their own results
+    return None
+
+
+def test_result_participant_field(user_role):
+    # Each side sees the other party
+    return "patient_id" if user_role == "doctor" else "doctor_id"
+
+
+def format_test_results(test_results, user_role, users):
+    """Shape raw test results, attaching the other party from a `hydrate_users` lookup."""
+    results_list = []
+    for result in test_results:
+        result_data = {
+            "_id": result["_id"],
+            "medical_record_id": result["medical_record_id"],
+            "test_name": result["test_name"],
+            "test_date": result.get("test_date"),
+            "results": result["results"],
+            "status": result["status"],
+            "remarks": result["remarks"]
+        }
+
+        # Attach patient details if doctor is logged in
+        if user_role == "doctor":
+            patient = lookup(users, result["patient_id"])
+            if patient:
+                result_data["patient_details"] = patient_details(patient)
+
+        # Attach doctor details if patient is logged in
+        if user_role == "patient":
+            doctor = lookup(users, result["doctor_id"])
+            if doctor:
+                result_data["uploaded_by"] = f"Dr.{full_name(doctor)}"
+
+        results_list.append(result_data)
+    return results_list
+
+
 @jwt_required
 @csrf_exempt
 def get_test_results(request):
     try:
-        # Get the logged-in user's ID and role
-        user_id = request.user_id
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        
-        if not user:
-            return JsonResponse({"error": "User not found"}, status=404)
-
-        user_role = user.get("role")
+        # The caller's identity and role come from the access token
+        user_role = request.principal.role
 
         # Define query filter based on role
-        query = {}
-        if user_role == "doctor":
-            query["doctor_id"] = ObjectId(user_id)  # Doctor sees only the tests they uploaded
-        elif user_role == "patient":
-            query["patient_id"] = ObjectId(user_id)  # Patient sees only their own results
-        else:
+        query = test_results_query(user_role, request.user_id)
+        if query is None:
             return JsonResponse({"error": "Unauthorized access"}, status=403)
 
-        # Fetch test results
-        test_results = list(test_results_collection.find(query))
-
-        results_list = []
-        for result in test_results:
-            result_data = {
-                "_id": str(result["_id"]),
-                "medical_record_id": str(result["medical_record_id"]),
-                "test_name": result["test_name"],
-                "test_date": result["test_date"].isoformat() if "test_date" in result else None,
-                "results": result["results"],
-                "status": result["status"],
-                "remarks": result["remarks"]
-            }
-
-            # Fetch patient details if doctor is logged in
-            if user_role == "doctor":
-                patient = users_collection.find_one({"_id": result["patient_id"]})
-                if patient:
-                    result_data["patient_details"] = {
-                        "first_name": patient["personal_details"]["first_name"],
-                        "last_name": patient["personal_details"]["last_name"],
-                        "age": patient["personal_details"]["age"],
-                        "gender": patient["personal_details"]["gender"]
-                    }
-
-            # Fetch doctor details if patient is logged in
-            if user_role == "patient":
-                doctor = users_collection.find_one({"_id": result["doctor_id"]})
-                if doctor:
-                    result_data["uploaded_by"] = f"Dr.{doctor['personal_details']['first_name']} {doctor['personal_details']['last_name']}"
-
-            results_list.append(result_data)
-
-        return JsonResponse({"test_results": results_list}, status=200)
+        # Read the requested page
+        try:
+            page = page_params(request)
+        except InvalidPageRequest as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Fetch one page of test results
+        test_results, next_cursor = find_page(test_results_collection, query, page)
+
+        # A repeat load of an unchanged page skips hydration and serialization
+        etag = page_etag(request, test_results, next_cursor)
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+        # Fetch every referenced participant in one round trip
+        users = hydrate_users(test_results, test_result_participant_field(user_role))
+
+        return with_etag(BSONResponse({
+            "test_results": format_test_results(test_results, user_role, users),
+            "next_cursor": next_cursor
+        }, status=200), etag)
     
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -1,3 +1,561 @@
-from django.test import TestCase
+import json
+import os
+import threading
+from io import StringIO
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import mongomock
+from pymongo import ASCENDING, DESCENDING
+from django.conf import settings
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import async_collections, calendars, events, hydration, mongodb, passwords, synthetic, user_directory as directory_module, user_store, users
+from core.bulk import bulk_response, insert_items
+from core.collections import appointments_collection, billing_collection, billing_rollups_collection, \
+    consultations_collection, conversations_collection, prescriptions_collection, users_collection
+from core.indexes import ensure_indexes
+from core.pagination import decode_cursor, find_page
+from core.passwords import PasswordHasherBusy, hash_password, hash_rounds
+from core.schedules import slot_key
+from core.token_cache import token_cache
+from core.user_directory import user_directory
+
+# A Monday slot inside the default working hours
+SLOT = "2030-01-07T10:00:00"
+NEXT_SLOT = "2030-01-07T10:30:00"
+
+
+@override_settings(BCRYPT_ROUNDS=4)
+class MongoTestCase(SimpleTestCase):
+    """Runs each test against a fresh in-memory MongoDB (mongomock) carrying the declared indexes."""
+
+    def setUp(self):
+        mongodb.client.close()
+        patcher = mock.patch.object(mongodb.client, "_factory", mongomock.MongoClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(mongodb.client.close)
+        token_cache.clear()
+        users._token_versions.clear()
+        user_directory.invalidate()
+        ensure_indexes()
+
+        self.users = {role: self.create_user(role) for role in ("patient", "doctor", "receptionist", "admin")}
+        self.ids = {role: str(user["_id"]) for role, user in self.users.items()}
+
+    def create_user(self, role, username=None):
+        user = {
+            "username": username or role,
+            "password": hash_password("password"),
+            "role": role,
+            "personal_details": {"first_name": role.title(), "last_name": "Test", "age": 40, "gender": "Other"},
+            "contact": {"email": f"{username or role}@example.com"},
+        }
+        user["_id"] = users_collection.insert_one(user).inserted_id
+        return user
+
+    def api(self, method, path, user=None, body=None, **extra):
+        if user is not None:
+            user = self.users.get(user, user)
+            token = users.create_access_token(users.token_claims(user))
+            extra["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        data = json.dumps(body) if body is not None else ""
+        return self.client.generic(method, f"/api/{path}", data, content_type="application/json", **extra)
+
+
+class SlotBookingTests(MongoTestCase):
+    def book(self, doctor_id, appointment_date=SLOT):
+        return self.api("POST", "book/appointments/", "patient",
+                        {"doctor_id": doctor_id, "appointment_date": appointment_date})
+
+    def test_second_booking_of_a_slot_is_rejected(self):
+        self.assertEqual(self.book(self.ids["doctor"]).status_code, 201)
+        self.assertEqual(self.book(self.ids["doctor"]).status_code, 409)
+
+    def test_doctor_id_spelling_does_not_bypass_the_slot_index(self):
+        self.assertEqual(self.book(self.ids["doctor"].lower()).status_code, 201)
+        self.assertEqual(self.book(self.ids["doctor"].upper()).status_code, 409)
+        self.assertEqual(appointments_collection.count_documents({}), 1)
+        self.assertEqual(appointments_collection.find_one()["slot_key"], f"{self.ids['doctor']}:2030-01-07T10:00")
+
+    def test_moving_into_a_taken_slot_is_rejected(self):
+        self.book(self.ids["doctor"], NEXT_SLOT)
+        appointment_id = self.book(self.ids["doctor"]).json()["appointment_id"]
+        response = self.api("PATCH", "update/user/appointments/", "patient", {
+            "appointment_id": appointment_id,
+            "doctor_id": self.ids["doctor"].upper(),
+            "appointment_date": NEXT_SLOT,
+        })
+        self.assertEqual(response.status_code, 409)
+
+
+class CalendarTests(MongoTestCase):
+    def book_day(self, count):
+        doctor_id = self.users["doctor"]["_id"]
+        slots = [datetime(2030, 1, 7, 9) + timedelta(minutes=30 * n) for n in range(count)]
+        appointments_collection.insert_many([
+            {"patient_id": self.users["patient"]["_id"], "doctor_id": doctor_id, "appointment_date": slot,
+             "slot_key": slot_key(doctor_id, slot), "status": "Scheduled"}
+            for slot in slots
+        ])
+
+    def test_full_window_is_not_truncated(self):
+        self.book_day(3)
+        with mock.patch.object(calendars, "CALENDAR_MAX_ENTRIES", 3):
+            calendar = self.api("GET", "get/calendar/?view=day&date=2030-01-07", "doctor").json()
+        self.assertEqual(len(calendar["entries"]), 3)
+        self.assertFalse(calendar["truncated"])
+
+    def test_window_over_the_cap_is_flagged(self):
+        self.book_day(4)
+        with mock.patch.object(calendars, "CALENDAR_MAX_ENTRIES", 3):
+            calendar = self.api("GET", "get/calendar/?view=day&date=2030-01-07", "doctor").json()
+        self.assertEqual(len(calendar["entries"]), 3)
+        self.assertTrue(calendar["truncated"])
+
+
+class ConcurrentUpdateTests(MongoTestCase):
+    def create_bill(self):
+        response = self.api("POST", "post/bill/", "receptionist",
+                            {"patient_id": self.ids["patient"], "total_amount": 120, "services": ["consultation"]})
+        return response.json()["billing_id"]
+
+    def pay(self, billing_id, **body):
+        return self.api("POST", "post/bill/", "patient", {"billing_id": billing_id, "payment_method": "card", **body})
+
+    def test_stale_appointment_version_is_rejected(self):
+        appointment_id = self.api("POST", "book/appointments/", "patient",
+                                  {"doctor_id": self.ids["doctor"], "appointment_date": SLOT}).json()["appointment_id"]
+
+        first = self.api("PATCH", "update/user/appointments/", "doctor",
+                         {"appointment_id": appointment_id, "notes": "first", "version": 1})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()["appointment"]["version"], 2)
+
+        second = self.api("PATCH", "update/user/appointments/", "doctor",
+                          {"appointment_id": appointment_id, "notes": "second", "version": 1})
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.json()["current_version"], 2)
+        self.assertEqual(second.json()["appointment"]["notes"], "first")
+
+    def test_stale_bill_version_is_rejected(self):
+        billing_id = self.create_bill()
+        self.assertEqual(self.pay(billing_id, version=1).status_code, 200)
+
+        response = self.pay(billing_id, version=1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["current_version"], 2)
+        self.assertEqual(response.json()["billing"]["payment_status"], "Paid")
+
+    def test_paying_a_bill_twice_counts_it_once(self):
+        billing_id = self.create_bill()
+        self.assertEqual(self.pay(billing_id).status_code, 200)
+
+        retry = self.pay(billing_id)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()["billing"]["version"], 2)
+
+        rollup = billing_rollups_collection.find_one()
+        self.assertEqual((rollup["paid_count"], rollup["paid_amount"]), (1, 120))
+
+
+class BillingRollupTests(MongoTestCase):
+    def test_rebuild_leaves_out_undated_bills(self):
+        patient_id = self.users["patient"]["_id"]
+        billing_collection.insert_many([
+            {"patient_id": patient_id, "total_amount": 100, "payment_status": "Paid", "payment_method": "card",
+             "created_at": datetime(2030, 1, 7, 9), "paid_at": datetime(2030, 1, 7, 10)},
+            {"patient_id": patient_id, "total_amount": 50, "payment_status": "Unpaid"},
+        ])
+
+        output = StringIO()
+        call_command("rebuild_billing_rollups", stdout=output)
+
+        rollup = billing_rollups_collection.find_one({"_id": "2030-01-07"})
+        self.assertEqual((rollup["billed_amount"], rollup["billed_count"]), (100, 1))
+        self.assertEqual(rollup["payment_methods"], {"card": {"amount": 100, "count": 1}})
+        self.assertEqual(billing_rollups_collection.count_documents({}), 1)
+        self.assertIn("1 bill(s) have no created_at date", output.getvalue())
+
+
+class PaginationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        billing_collection.insert_many([
+            {"patient_id": self.users["patient"]["_id"], "total_amount": n, "payment_status": "Unpaid",
+             "services": ["consultation"], "created_at": datetime(2030, 1, 1), "version": 1}
+            for n in range(5)
+        ])
+
+    def bills(self, query=""):
+        return self.api("GET", f"get/user/bills/{query}", "patient")
+
+    def test_cursor_walks_every_item_once(self):
+        seen, query = [], "?limit=2"
+        while True:
+            page = self.bills(query).json()
+            self.assertLessEqual(len(page["bills"]), 2)
+            seen += [bill["total_amount"] for bill in page["bills"]]
+            if page["next_cursor"] is None:
+                break
+            query = f"?limit=2&cursor={page['next_cursor']}"
+        self.assertEqual(seen, list(range(5)))
+
+    def test_documents_without_a_sort_key_are_paged(self):
+        dates = [datetime(2030, 1, day) for day in (1, 2, 3)] + [None, None]
+        consultations_collection.insert_many([
+            {"patient_id": self.users["patient"]["_id"], "doctor_id": self.users["doctor"]["_id"],
+             **({"consultation_date": date} if date else {"created_at": datetime(2030, 1, 9)})}
+            for date in dates
+        ])
+        expected = [consultation["_id"] for consultation in consultations_collection.find()]
+
+        for direction in (ASCENDING, DESCENDING):
+            with self.subTest(direction=direction):
+                seen, position = [], None
+                while True:
+                    documents, next_cursor = find_page(
+                        consultations_collection, {}, (position, 2), sort_key="consultation_date", direction=direction
+                    )
+                    seen += [document["_id"] for document in documents]
+                    if next_cursor is None:
+                        break
+                    position = decode_cursor(next_cursor)
+                self.assertCountEqual(seen, expected)
+                self.assertEqual(len(seen), len(expected))
+
+        response = self.api("GET", "get/meeting/link/?limit=4", "patient").json()
+        rest = self.api("GET", f"get/meeting/link/?limit=4&cursor={response['next_cursor']}", "patient").json()
+        self.assertEqual(len(response["consultations"]) + len(rest["consultations"]), 5)
+
+    def test_unusable_cursor_or_limit_is_rejected(self):
+        for query in ("?cursor=not-a-cursor", "?cursor=bm90LWpzb24", "?limit=0", "?limit=ten"):
+            with self.subTest(query=query):
+                self.assertEqual(self.bills(query).status_code, 400)
+
+    def test_unchanged_page_is_not_modified(self):
+        etag = self.bills("?limit=2")["ETag"]
+        self.assertEqual(self.bills("?limit=2").status_code, 200)
+        self.assertEqual(self.api("GET", "get/user/bills/?limit=2", "patient", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        billing_collection.update_one({"total_amount": 0}, {"$set": {"payment_status": "Paid", "updated_at": datetime.utcnow()}})
+        self.assertEqual(self.api("GET", "get/user/bills/?limit=2", "patient", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ConversationTests(MongoTestCase):
+    def send(self, receiver_id, message="hello"):
+        return self.api("POST", "send/message/", "patient", {"receiver_id": receiver_id, "message": message})
+
+    def test_receiver_id_spelling_does_not_split_the_thread(self):
+        thread_id = self.send(self.ids["doctor"]).json()["thread_id"]
+        self.assertEqual(self.send(self.ids["doctor"].upper()).json()["thread_id"], thread_id)
+        self.assertEqual(conversations_collection.count_documents({}), 1)
+
+        thread = self.api("GET", f"get/conversations/{thread_id.upper()}/messages/", "doctor")
+        self.assertEqual(thread.status_code, 200)
+        self.assertEqual(len(thread.json()["messages"]), 2)
+
+        read = self.api("POST", "conversations/read/", "doctor", {"thread_ids": [thread_id.upper()]})
+        self.assertEqual(read.json()["messages_updated"], 2)
+        self.assertEqual(conversations_collection.find_one()["unread"][self.ids["doctor"]], 0)
+
+
+class UserDirectoryTests(MongoTestCase):
+    def test_waiter_loads_itself_when_the_loader_is_stuck(self):
+        lookups = directory_module.DIRECTORY_CACHE_LOOKUPS
+        misses, coalesced = lookups.value(result="miss"), lookups.value(result="coalesced")
+        # Another request registered a load of the doctor directory and never finished it
+        user_directory._loading["doctor"] = threading.Event()
+        self.addCleanup(user_directory._loading.pop, "doctor", None)
+
+        with mock.patch.object(directory_module, "LOAD_WAIT_SECONDS", 0.01):
+            users, _ = user_directory.get("doctor")
+
+        self.assertEqual([user["_id"] for user in users], [self.users["doctor"]["_id"]])
+        self.assertEqual(lookups.value(result="miss"), misses + 1)
+        self.assertEqual(lookups.value(result="coalesced"), coalesced)
+
+
+class TokenRevocationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = users.create_access_token(users.token_claims(self.users["patient"]))
+
+    def get_messages(self):
+        return self.api("GET", "get/message/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def test_revoked_token_is_refused_and_dropped_from_the_cache(self):
+        self.assertEqual(self.get_messages().status_code, 200)
+        self.assertIsNotNone(token_cache.get(self.token))
+
+        users.revoke_user_tokens(self.ids["patient"])
+
+        self.assertIsNone(token_cache.get(self.token))
+        response = self.get_messages()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["error"], "Token has been revoked")
+
+    def test_revocation_by_another_worker_applies_after_the_ttl(self):
+        self.assertEqual(self.get_messages().status_code, 200)
+
+        # Another worker revokes: only MongoDB changes, this process still holds the old version
+        user_store.bump_token_version(self.ids["patient"])
+        self.assertEqual(self.get_messages().status_code, 200)
+
+        version, read_at = users._token_versions[self.ids["patient"]]
+        users._token_versions[self.ids["patient"]] = (version, read_at - settings.TOKEN_VERSION_TTL)
+        self.assertEqual(self.get_messages().status_code, 401)
+
+    def test_tokens_issued_after_revocation_are_accepted(self):
+        user = users.revoke_user_tokens(self.ids["patient"])
+        self.token = users.create_access_token(users.token_claims({**self.users["patient"], **user}))
+        self.assertEqual(self.get_messages().status_code, 200)
+
+
+class LoginTests(MongoTestCase):
+    def login(self, username="patient"):
+        return self.api("POST", "login/", body={"username": username, "password": "password"})
+
+    def stored_hash(self, username="patient"):
+        return users_collection.find_one({"username": username})["password"]
+
+    @override_settings(PASSWORD_HASH_QUEUE_TIMEOUT=0.01)
+    def test_saturated_hasher_answers_503(self):
+        slots = settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+        for _ in range(slots):
+            passwords._slots.acquire()
+        try:
+            response = self.login()
+        finally:
+            for _ in range(slots):
+                passwords._slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_hash_with_an_old_cost_is_upgraded(self):
+        users_collection.update_one({"username": "patient"}, {"$set": {"password": passwords._hash("password", 5)}})
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(hash_rounds(self.stored_hash()), 4)
+
+    def test_busy_rehash_does_not_fail_the_login(self):
+        old_hash = passwords._hash("password", 5)
+        users_collection.update_one({"username": "patient"}, {"$set": {"password": old_hash}})
+        with mock.patch.object(users, "hash_password", side_effect=PasswordHasherBusy("busy")):
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("access_token", response.json())
+        self.assertEqual(self.stored_hash(), old_hash)
+
+
+class BulkInsertTests(MongoTestCase):
+    def post(self, items):
+        return self.api("POST", "post/prescriptions/bulk/", "doctor", {"items": items})
+
+    def test_invalid_item_gives_a_partial_result(self):
+        valid = {"patient_id": self.ids["patient"], "medications": ["ibuprofen"]}
+        response = self.post([valid, {"patient_id": "nope", "medications": ["x"]}, valid, "not an object"])
+
+        self.assertEqual(response.status_code, 207)
+        results = response.json()["results"]
+        self.assertEqual([result["ok"] for result in results], [True, False, True, False])
+        self.assertEqual(results[1], {"index": 1, "ok": False, "error": "Invalid patient_id"})
+        self.assertEqual(results[3]["error"], "Item must be an object")
+        self.assertEqual(prescriptions_collection.count_documents({}), 2)
+
+    def test_all_valid_or_all_invalid(self):
+        self.assertEqual(self.post([{"patient_id": self.ids["patient"], "medications": ["x"]}]).status_code, 201)
+        self.assertEqual(self.post([{"medications": ["x"]}]).status_code, 400)
+
+    def test_write_errors_are_reported_per_item(self):
+        collection = mongodb.db["BulkTest"]
+        collection.insert_one({"_id": "taken"})
+        results = insert_items(collection, [{"_id": "new"}, {"_id": "taken"}], lambda item: (dict(item), None))
+
+        self.assertEqual([result["ok"] for result in results], [True, False])
+        self.assertEqual(bulk_response(results).status_code, 207)
+
+
+class HydrationTests(MongoTestCase):
+    def test_participants_are_read_in_one_round_trip(self):
+        patients = [self.create_user("patient", f"patient-{n}") for n in range(3)]
+        for n, patient in enumerate(patients):
+            slot = datetime(2030, 1, 7, 9) + timedelta(minutes=30 * n)
+            appointments_collection.insert_one({
+                "patient_id": patient["_id"], "doctor_id": self.users["doctor"]["_id"], "appointment_date": slot,
+                "slot_key": slot_key(self.users["doctor"]["_id"], slot), "status": "Scheduled",
+            })
+
+        with mock.patch.object(hydration, "get_users", wraps=hydration.get_users) as get_users:
+            response = self.api("GET", "get/user/appointments/", "doctor")
+
+        self.assertEqual(response.status_code, 200)
+        get_users.assert_called_once()
+        self.assertEqual(get_users.call_args.args[0], {patient["_id"] for patient in patients})
+        names = [appointment["patient_details"]["first_name"] for appointment in response.json()["appointments"]]
+        self.assertEqual(names, ["Patient"] * 3)
+
+
+class UserProjectionTests(MongoTestCase):
+    def test_only_the_auth_view_reads_the_password(self):
+        for view in user_store.PROJECTIONS:
+            with self.subTest(view=view):
+                user = user_store.get_user(self.ids["doctor"], view)
+                self.assertEqual("password" in user, view == "auth")
+
+    def test_user_endpoints_never_return_the_password(self):
+        for path in ("all/users/", "all/users/?role=doctor", "all/users/?role=patient", f"users/{self.ids['doctor']}/",
+                     "all/users/?stream=true"):
+            with self.subTest(path=path):
+                response = self.api("GET", path, "admin")
+                self.assertEqual(response.status_code, 200)
+                body = b"".join(response.streaming_content) if response.streaming else response.content
+                self.assertNotIn(b"password", body)
+                self.assertNotIn(b"$2b$", body)
+
+
+class DetailETagTests(MongoTestCase):
+    def get(self, path, etag=None, user="patient"):
+        extra = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.api("GET", path, user, **extra)
+
+    def test_unchanged_consultation_is_not_modified(self):
+        consultation_id = consultations_collection.insert_one({
+            "patient_id": self.users["patient"]["_id"], "doctor_id": self.users["doctor"]["_id"],
+            "consultation_date": datetime(2030, 1, 7, 11), "meeting_link": "https://meet.example/a", "status": "Scheduled",
+        }).inserted_id
+        path = f"get/meeting/link/{consultation_id}/"
+
+        etag = self.get(path)["ETag"]
+        response = self.get(path, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        consultations_collection.update_one({"_id": consultation_id}, {"$set": {"updated_at": datetime.utcnow()}})
+        self.assertEqual(self.get(path, etag).status_code, 200)
+
+    def test_user_change_invalidates_the_user_etag(self):
+        path = f"users/{self.ids['doctor']}/"
+        etag = self.get(path)["ETag"]
+        self.assertEqual(self.get(path, etag).status_code, 304)
+
+        users.revoke_user_tokens(self.ids["doctor"])
+        self.assertEqual(self.get(path, etag).status_code, 200)
+
+
+class AsyncCollection:
+    """The coroutine methods of an async collection, run against a mongomock collection."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class EventTicketTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            async_collections, "event_tickets_collection", AsyncCollection(mongodb.db["EventTickets"])
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The access token's version is current, so the async views need not re-read the user
+        users._remember_token_version(self.ids["patient"], 0)
+
+    async def open_stream(self, ticket):
+        return await events.get_events(RequestFactory().get("/api/events/", {"ticket": ticket}))
+
+    async def test_ticket_opens_one_stream(self):
+        token = users.create_access_token(users.token_claims(self.users["patient"]))
+        request = RequestFactory().post("/api/events/ticket/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        response = await events.issue_event_ticket(request)
+        self.assertEqual(response.status_code, 201)
+        ticket = json.loads(response.content)["ticket"]
+
+        stream = await self.open_stream(ticket)
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(stream["Content-Type"], "text/event-stream")
+        stream.close()
+
+        self.assertEqual((await self.open_stream(ticket)).status_code, 401)
+
+    async def test_expired_ticket_is_refused(self):
+        mongodb.db["EventTickets"].insert_one({
+            "_id": events._ticket_key("old"), "user_id": self.ids["patient"], "expires_at": datetime.utcnow()
+        })
+        self.assertEqual((await self.open_stream("old")).status_code, 401)
+
+
+class SyntheticDataTests(MongoTestCase):
+    def generate(self, seed):
+        mongodb.client.drop_database(mongodb.DATABASE_NAME)
+        synthetic.generate(seed=seed, as_of=date(2030, 1, 1), workers=1, patients=12, patients_per_doctor=4,
+                           receptionists=2, admins=1)
+        # Password hashes are salted, so they are the one thing a seed does not fix
+        return {
+            name: list(mongodb.db[name].find({}, {"password": 0}).sort("_id"))
+            for name in sorted(mongodb.db.list_collection_names())
+        }
+
+    def test_same_seed_gives_the_same_documents(self):
+        first = self.generate(seed=7)
+        self.assertGreater(len(first["Appointments"]), 0)
+        self.assertEqual(self.generate(seed=7), first)
+        self.assertNotEqual(self.generate(seed=8), first)
+
+
+class LazyClientTests(SimpleTestCase):
+    def test_client_is_created_on_first_use_and_after_close(self):
+        factory = mock.Mock(side_effect=lambda: mock.Mock())
+        lazy = mongodb.LazyClient(factory)
+        factory.assert_not_called()
+
+        first = lazy.get()
+        self.assertIs(lazy.get(), first)
+
+        lazy.close()
+        first.close.assert_called_once()
+        self.assertIsNot(lazy.get(), first)
+        self.assertEqual(factory.call_count, 2)
+
+    @skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_forked_child_creates_its_own_client(self):
+        lazy = mongodb.LazyClient(object)
+        parent_client = lazy.get()
+
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                child_client = lazy.get()
+                fresh = child_client is not parent_client and lazy.get() is child_client
+                os.write(write_end, b"fresh" if fresh else b"reused")
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(read_end, 16), b"fresh")
+        os.close(read_end)
+        self.assertIs(lazy.get(), parent_client)
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=False)
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=True)
+    def test_public_only_when_opted_in(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="scrape-secret", METRICS_PUBLIC=True)
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-secret").status_code, 200)
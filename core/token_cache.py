@@ -0,0 +1,95 @@
+"""
+Per-process LRU cache of verified access tokens.
+
+Entries are keyed by a SHA-256 of the token, so raw tokens are never held, and
+each entry lives until the token's own `exp`. Revoking a user's tokens drops
+their entries so the next request goes back through full verification.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from core.metrics import Counter, Gauge
+
+
+TOKEN_CACHE_LOOKUPS = Counter(
+    "token_cache_lookups_total",
+    "Verified-token cache lookups by result (hit or miss).",
+    ["result"],
+)
+TOKEN_CACHE_EVICTIONS = Counter(
+    "token_cache_evictions_total",
+    "Entries removed from the verified-token cache by reason (capacity, expired, revoked).",
+    ["reason"],
+)
+TOKEN_CACHE_SIZE = Gauge(
+    "token_cache_entries",
+    "Verified tokens currently cached.",
+)
+
+
+def _token_key(token):
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """Cached payload for `token`, or None if it was never verified or has expired."""
+        key = _token_key(token)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None and payload.get("exp", 0) <= time.time():
+                del self._entries[key]
+                TOKEN_CACHE_EVICTIONS.inc(reason="expired")
+                payload = None
+            if payload is None:
+                TOKEN_CACHE_LOOKUPS.inc(result="miss")
+                TOKEN_CACHE_SIZE.set(len(self._entries))
+                return None
+            self._entries.move_to_end(key)
+        TOKEN_CACHE_LOOKUPS.inc(result="hit")
+        return payload
+
+    def put(self, token, payload):
+        if self.max_size <= 0:
+            return
+        key = _token_key(token)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                TOKEN_CACHE_EVICTIONS.inc(reason="capacity")
+            TOKEN_CACHE_SIZE.set(len(self._entries))
+
+    def invalidate(self, token):
+        """Forget a single token, e.g. on logout."""
+        with self._lock:
+            if self._entries.pop(_token_key(token), None) is not None:
+                TOKEN_CACHE_EVICTIONS.inc(reason="revoked")
+            TOKEN_CACHE_SIZE.set(len(self._entries))
+
+    def invalidate_subject(self, user_id):
+        """Forget every cached token issued to `user_id`."""
+        user_id = str(user_id)
+        with self._lock:
+            stale = [key for key, payload in self._entries.items() if payload.get("sub") == user_id]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                TOKEN_CACHE_EVICTIONS.inc(len(stale), reason="revoked")
+            TOKEN_CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            TOKEN_CACHE_SIZE.set(0)
+
+
+token_cache = VerifiedTokenCache(settings.TOKEN_CACHE_SIZE)
@@ -1,15 +1,32 @@
+from django.conf import settings
 from django.urls import path
 from core.users import create_user_view,get_users_view, get_user_by_id_view,\
 register_user, authenticate_user
-from core.medical_records import  post_medical_record,post_medical_history , get_medical_records
-from core.prescriptions import post_prescription, get_patient_prescriptions
+from core.medical_records import  post_medical_record,post_medical_history , get_medical_records, \
+post_medical_records_bulk
+from core.prescriptions import post_prescription, get_patient_prescriptions, post_prescriptions_bulk
 from core.appointments import book_appointment, get_appointments ,update_appointment,\
 cancel_appointment
 from core.billings import manage_billing, get_user_bills
-from core.test_results import post_test_result, get_test_results
+from core.billing_analytics import get_revenue, get_payment_methods, get_outstanding_balances
+from core.test_results import post_test_result, get_test_results, post_test_results_bulk
 from core.messages import send_message, get_messages
+from core.conversations import get_conversations, get_thread_messages, mark_threads_read
+from core.schedules import doctor_schedule, get_free_slots
+from core.calendars import get_calendar
 from core.consultations import post_meeting_link, get_meeting_details, get_user_consultations
- 
+
+if settings.ASYNC_VIEWS:
+    # Same routes, served by the async views (see core/async_views.py)
+    from core.async_views import create_user_view, get_users_view, get_user_by_id_view, \
+    register_user, authenticate_user, post_medical_record, post_medical_history, get_medical_records, \
+    post_prescription, get_patient_prescriptions, book_appointment, get_appointments, update_appointment, \
+    cancel_appointment, manage_billing, get_user_bills, post_test_result, get_test_results, send_message, \
+    get_messages, post_meeting_link, get_meeting_details, get_user_consultations, post_medical_records_bulk, \
+    post_prescriptions_bulk, post_test_results_bulk, get_revenue, get_payment_methods, get_outstanding_balances, \
+    get_conversations, get_thread_messages, mark_threads_read, doctor_schedule, get_free_slots, get_calendar
+    from core.events import get_events, issue_event_ticket
+
 
 urlpatterns = [
     path("users/", create_user_view, name="create-user"),  # Register user (POST)
@@ -18,20 +35,32 @@ urlpatterns = [
     path('register/user/', register_user, name='register'),
     path('login/', authenticate_user, name='login'),
     path('post/medical-records/', post_medical_record, name='post-medical-record'),
+    path('post/medical-records/bulk/', post_medical_records_bulk, name='post-medical-records-bulk'),
     path('get/user/medical-records/', get_medical_records, name='get-medical-record'),
     path('medical-history/', post_medical_history, name='post-medical-history'),
     path('post/prescriptions/', post_prescription, name='post-prescription'),
+    path('post/prescriptions/bulk/', post_prescriptions_bulk, name='post-prescriptions-bulk'),
     path('get/patient/prescriptions/', get_patient_prescriptions, name='get-patient-prescriptions'),
     path('book/appointments/', book_appointment, name='book-appointment'),
     path('get/user/appointments/', get_appointments, name='get-appointments'),
     path('update/user/appointments/', update_appointment, name='update-appointments'),
+    path('get/calendar/', get_calendar, name='get-calendar'),
+    path('doctor/schedule/', doctor_schedule, name='doctor-schedule'),
+    path('doctors/<str:doctor_id>/slots/', get_free_slots, name='doctor-free-slots'),
     path('cancel/appointments/<str:appointment_id>/', cancel_appointment, name='cancel-appointment'),
     path('post/bill/', manage_billing, name='invoicing'),
     path('get/user/bills/', get_user_bills, name='get-invoices'),
+    path('analytics/billing/revenue/', get_revenue, name='billing-revenue'),
+    path('analytics/billing/payment-methods/', get_payment_methods, name='billing-payment-methods'),
+    path('analytics/billing/outstanding/', get_outstanding_balances, name='billing-outstanding'),
     path('post/test/results/', post_test_result, name='test-results'),
+    path('post/test/results/bulk/', post_test_results_bulk, name='test-results-bulk'),
     path('get/user/test/results/', get_test_results, name='get-test-results'),
     path('send/message/', send_message, name='send-message'),
     path('get/message/', get_messages, name='get-message'),
+    path('get/conversations/', get_conversations, name='get-conversations'),
+    path('get/conversations/<str:thread_id>/messages/', get_thread_messages, name='get-thread-messages'),
+    path('conversations/read/', mark_threads_read, name='mark-threads-read'),
     path('post/meeting/link/', post_meeting_link, name='meeting'),
     path('get/meeting/link/<consultation_id>/', get_meeting_details, name='get-meeting'),
     path('get/meeting/link/', get_user_consultations, name='get-meeting'),
@@ -40,3 +69,7 @@ urlpatterns = [
 
 ]
 
+if settings.ASYNC_VIEWS:
+    # Long-lived event streams only make sense on the ASGI app
+    urlpatterns.append(path('events/', get_events, name='events'))
+    urlpatterns.append(path('events/ticket/', issue_event_ticket, name='events-ticket'))
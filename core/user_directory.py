@@ -0,0 +1,212 @@
+"""
+Cached role directories (e.g. every doctor) behind `all/users/?role=...`.
+
+The full directory of each role in USER_DIRECTORY_CACHE_ROLES is read once and
+served from memory, pages included, for USER_DIRECTORY_CACHE_TTL seconds or
+until a user is created or changed, whichever comes first. Concurrent misses
+for the same role wait for a single load instead of each querying MongoDB.
+
+Entries live in this process unless USER_DIRECTORY_CACHE_ALIAS names a Django
+cache shared by all workers, in which case invalidations reach every worker
+through a generation counter kept in that cache. The async views read that
+cache inline, so it should be a fast one (memcached, Redis).
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_right
+from django.conf import settings
+from django.core.cache import caches
+from core import user_store
+from core.metrics import Counter
+from core.pagination import encode_cursor
+
+DIRECTORY_CACHE_LOOKUPS = Counter(
+    "user_directory_cache_lookups_total",
+    "Role directory lookups by result (hit, miss, or coalesced onto another request's load).",
+    ["result"],
+)
+DIRECTORY_CACHE_INVALIDATIONS = Counter(
+    "user_directory_cache_invalidations_total",
+    "Times the role directories were dropped because a user was created or changed.",
+)
+
+# How long a request waits for another request's load before loading the directory itself
+LOAD_WAIT_SECONDS = 5
+
+
+def is_cached_role(role):
+    return settings.USER_DIRECTORY_CACHE_TTL > 0 and role in settings.USER_DIRECTORY_CACHE_ROLES
+
+
+def directory_validator(users):
+    """The `core.conditional` validator of a directory, computed from its documents."""
+    if not users:
+        return "0"
+    last_updated = max((user["updated_at"] for user in users if user.get("updated_at")), default=None)
+    return f"{len(users)}:{users[-1]['_id']}:{last_updated.isoformat() if last_updated else ''}"
+
+
+def directory_page(users, page):
+    """One keyset page of a cached directory, exactly as `find_page` would return it."""
+    position, limit = page
+    start = 0
+    if position is not None:
+        start = bisect_right([user["_id"] for user in users], position["id"])
+    documents = users[start:start + limit + 1]
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], "_id")
+    return documents, next_cursor
+
+
+class _LocalStore:
+    def __init__(self):
+        self._entries = {}  # role -> (expires_at, generation, entry)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        return self._generation
+
+    def get(self, role):
+        with self._lock:
+            cached = self._entries.get(role)
+            if cached is None:
+                return None
+            expires_at, generation, entry = cached
+            if generation != self._generation or expires_at <= time.monotonic():
+                del self._entries[role]
+                return None
+            return entry
+
+    def set(self, role, generation, entry, ttl):
+        with self._lock:
+            # An invalidation during the load means the entry may already be stale
+            if generation == self._generation:
+                self._entries[role] = (time.monotonic() + ttl, generation, entry)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class _SharedStore:
+    GENERATION_KEY = "user-directory:generation"
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def _cache(self):
+        return caches[self.alias]
+
+    def generation(self):
+        return self._cache.get(self.GENERATION_KEY, 0)
+
+    def get(self, role):
+        return self._cache.get(f"user-directory:{self.generation()}:{role}")
+
+    def set(self, role, generation, entry, ttl):
+        # Written under the generation read before the load, so a stale entry is never read again
+        self._cache.set(f"user-directory:{generation}:{role}", entry, ttl)
+
+    def clear(self):
+        try:
+            self._cache.incr(self.GENERATION_KEY)
+        except ValueError:
+            self._cache.set(self.GENERATION_KEY, 1, None)
+
+
+class UserDirectoryCache:
+    def __init__(self, alias=""):
+        self._store = _SharedStore(alias) if alias else _LocalStore()
+        self._lock = threading.Lock()
+        self._loading = {}  # role -> threading.Event
+        self._aloading = {}  # role -> asyncio.Event
+
+    def get(self, role):
+        """`(users, validator)` for `role`, loading it on a miss."""
+        entry = self._store.get(role)
+        if entry is not None:
+            DIRECTORY_CACHE_LOOKUPS.inc(result="hit")
+            return entry
+        with self._lock:
+            loading = self._loading.get(role)
+            owner = loading is None
+            if owner:
+                loading = self._loading[role] = threading.Event()
+
+        if not owner:
+            # Someone else is already loading this role; use their result
+            if loading.wait(LOAD_WAIT_SECONDS):
+                entry = self._store.get(role)
+                if entry is not None:
+                    DIRECTORY_CACHE_LOOKUPS.inc(result="coalesced")
+                    return entry
+            # Their load failed, was invalidated or is taking too long
+            DIRECTORY_CACHE_LOOKUPS.inc(result="miss")
+            return self._load(role)
+
+        DIRECTORY_CACHE_LOOKUPS.inc(result="miss")
+        try:
+            return self._load(role)
+        finally:
+            with self._lock:
+                del self._loading[role]
+            loading.set()
+
+    async def aget(self, role):
+        """`get` for the async views; coalesces misses within this event loop."""
+        entry = self._store.get(role)
+        if entry is not None:
+            DIRECTORY_CACHE_LOOKUPS.inc(result="hit")
+            return entry
+
+        loading = self._aloading.get(role)
+        if loading is not None:
+            # Another request in this event loop is already loading this role; use its result
+            try:
+                await asyncio.wait_for(loading.wait(), LOAD_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                entry = self._store.get(role)
+                if entry is not None:
+                    DIRECTORY_CACHE_LOOKUPS.inc(result="coalesced")
+                    return entry
+            # Its load failed, was invalidated or is taking too long
+            DIRECTORY_CACHE_LOOKUPS.inc(result="miss")
+            return await self._aload(role)
+
+        loading = self._aloading[role] = asyncio.Event()
+        DIRECTORY_CACHE_LOOKUPS.inc(result="miss")
+        try:
+            return await self._aload(role)
+        finally:
+            del self._aloading[role]
+            loading.set()
+
+    def _load(self, role):
+        # The generation is read first, so an invalidation during the load keeps the result out of the cache
+        generation = self._store.generation()
+        return self._keep(role, generation, list(user_store.users_cursor({"role": role})))
+
+    async def _aload(self, role):
+        generation = self._store.generation()
+        return self._keep(role, generation, await user_store.ausers_cursor({"role": role}).to_list())
+
+    def _keep(self, role, generation, users):
+        entry = (users, directory_validator(users))
+        self._store.set(role, generation, entry, settings.USER_DIRECTORY_CACHE_TTL)
+        return entry
+
+    def invalidate(self):
+        """Drop every cached directory; call after creating or changing a user."""
+        self._store.clear()
+        DIRECTORY_CACHE_INVALIDATIONS.inc()
+
+
+user_directory = UserDirectoryCache(settings.USER_DIRECTORY_CACHE_ALIAS)
@@ -0,0 +1,146 @@
+"""
+Every read and write of the Users collection, each read under a named projection.
+
+Views ask for the shape they need instead of the whole document, so the bcrypt
+hash only ever leaves MongoDB for a login and nothing decodes embedded data it
+does not render:
+
+    auth              login: credentials plus what goes into the access token
+    principal         re-reading a stale token: role, names and token version
+    role              permission checks
+    display_name      labels: names and role
+    clinical_summary  participant details shown next to records, bills, etc.
+    profile           the user's own record, everything except the password
+"""
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from core.collections import users_collection
+from core.async_collections import users_collection as async_users_collection
+from core.pagination import find_page, afind_page
+
+PROJECTIONS = {
+    "auth": {
+        "username": 1,
+        "password": 1,
+        "role": 1,
+        "personal_details": 1,
+        "contact": 1,
+        "token_version": 1,
+    },
+    "principal": {
+        "role": 1,
+        "personal_details.first_name": 1,
+        "personal_details.last_name": 1,
+        "token_version": 1,
+    },
+    "role": {"role": 1},
+    "display_name": {
+        "personal_details.first_name": 1,
+        "personal_details.last_name": 1,
+        "role": 1,
+    },
+    "clinical_summary": {
+        "personal_details.first_name": 1,
+        "personal_details.last_name": 1,
+        "personal_details.age": 1,
+        "personal_details.gender": 1,
+        "personal_details.email": 1,
+        "personal_details.phone": 1,
+        "specialization": 1,
+        "license_number": 1,
+        "contact.email": 1,
+        "contact.phone": 1,
+        "role": 1,
+    },
+    "profile": {"password": 0},
+}
+
+
+def projection(name):
+    """The projection registered as `name`; unknown names are a programming error."""
+    try:
+        return PROJECTIONS[name]
+    except KeyError:
+        raise ValueError(f"Unknown user projection {name!r}") from None
+
+
+def _as_id(user_id):
+    if user_id is None or isinstance(user_id, ObjectId):
+        return user_id
+    return ObjectId(user_id)
+
+
+def get_user(user_id, view):
+    """One user by id under the `view` projection, or None."""
+    return users_collection.find_one({"_id": _as_id(user_id)}, projection(view))
+
+
+async def aget_user(user_id, view):
+    """`get_user` over the async client."""
+    return await async_users_collection.find_one({"_id": _as_id(user_id)}, projection(view))
+
+
+def get_user_by_username(username, view):
+    return users_collection.find_one({"username": username}, projection(view))
+
+
+def username_exists(username):
+    return users_collection.find_one({"username": username}, {"_id": 1}) is not None
+
+
+def get_users(ids, view):
+    """Every user in `ids` with a single `$in` query, keyed by `_id`."""
+    if not ids:
+        return {}
+    cursor = users_collection.find({"_id": {"$in": list(ids)}}, projection(view))
+    return {user["_id"]: user for user in cursor}
+
+
+async def aget_users(ids, view):
+    """`get_users` over the async client."""
+    if not ids:
+        return {}
+    cursor = async_users_collection.find({"_id": {"$in": list(ids)}}, projection(view))
+    return {user["_id"]: user async for user in cursor}
+
+
+def find_users_page(query, page, view="profile"):
+    """One keyset page of users matching `query`; see `core.pagination.find_page`."""
+    return find_page(users_collection, query, page, projection=projection(view))
+
+
+async def afind_users_page(query, page, view="profile"):
+    return await afind_page(async_users_collection, query, page, projection=projection(view))
+
+
+def users_cursor(query, view="profile"):
+    """All users matching `query` in `_id` order, for streaming exports."""
+    return users_collection.find(query, projection(view)).sort("_id", ASCENDING)
+
+
+def ausers_cursor(query, view="profile"):
+    return async_users_collection.find(query, projection(view)).sort("_id", ASCENDING)
+
+
+def insert_user(document):
+    """Store a new user and return its id."""
+    return users_collection.insert_one(document).inserted_id
+
+
+def replace_password_hash(user_id, old_hash, new_hash):
+    """Swap in `new_hash` unless the password changed since `old_hash` was read."""
+    users_collection.update_one(
+        {"_id": _as_id(user_id), "password": old_hash},
+        {"$set": {"password": new_hash}}
+    )
+
+
+def bump_token_version(user_id):
+    """Increment the user's token version; returns `{"_id", "token_version"}` or None."""
+    return users_collection.find_one_and_update(
+        {"_id": _as_id(user_id)},
+        {"$inc": {"token_version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"token_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
@@ -3,11 +3,20 @@ from django.views.decorators.csrf import csrf_exempt
 from bson import ObjectId
 import json
 import os
-import bcrypt
+import time
 import jwt
 from datetime import datetime, timedelta
 from functools import wraps
-from core.collections import users_collection
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from core.token_cache import token_cache
+from core.passwords import hash_password, verify_password, needs_rehash, PasswordHasherBusy
+from core.pagination import InvalidPageRequest, page_params
+from core import user_store
+from core.responses import BSONResponse
+from core.conditional import document_validator, etag_for, not_modified, page_validator, with_etag
+from core.user_directory import user_directory, is_cached_role, directory_page
+from core.streaming import wants_stream, stream_response
 
 
 
@@ -23,9 +32,10 @@ def create_user_view(request):
         try:
             data = json.loads(request.body)
             
-            result = users_collection.insert_one(data)
+            user_id = user_store.insert_user(data)
+            user_directory.invalidate()
             return JsonResponse(
-                {"message": "User created", "id": str(result.inserted_id)},
+                {"message": "User created", "id": str(user_id)},
                 status=201,
             )
         except Exception as e:
@@ -44,15 +54,34 @@ def get_users_view(request):
             if role:
                 query["role"] = role
 
-            # Retrieve users based on the query, excluding the password field
-            users = list(users_collection.find(query, {"password": 0}))
-
-            # Convert ObjectId to string for JSON serialization
-            for user in users:
-                user["_id"] = str(user["_id"])
+            # Large exports stream straight from the cursor instead of being paged
+            if wants_stream(request):
+                cursor = user_store.users_cursor(query)
+                return stream_response(request, cursor, "users", list)
+
+            # Read the requested page
+            try:
+                page = page_params(request)
+            except InvalidPageRequest as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # Role directories (the doctor picker) are served from the cache
+            if is_cached_role(role):
+                directory, validator = user_directory.get(role)
+                users, next_cursor = directory_page(directory, page)
+            else:
+                # Retrieve one page of users based on the query, excluding the password field
+                users, next_cursor = user_store.find_users_page(query, page)
+                validator = page_validator(users, next_cursor)
+
+            # A repeat load of an unchanged page skips serialization
+            etag = etag_for(request, validator)
+            response = not_modified(request, etag)
+            if response:
+                return response
 
             # Return the list of users as a JSON response
-            return JsonResponse({"users": users}, status=200, safe=False)
+            return with_etag(BSONResponse({"users": users, "next_cursor": next_cursor}, status=200), etag)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
     else:
@@ -66,48 +95,209 @@ def get_user_by_id_view(request, user_id):
             user_id = ObjectId(user_id)
 
             # Find the user by their _id
-            user = users_collection.find_one({"_id": user_id}, {"password": 0})  # Exclude password field
+            user = user_store.get_user(user_id, "profile")  # Excludes the password field
 
             # If the user is not found, return a 404 error
             if not user:
                 return JsonResponse({"error": "User not found"}, status=404)
 
-            # Convert ObjectId to string for JSON serialization
-            user["_id"] = str(user["_id"])
+            # The user itself is the validator
+            etag = etag_for(request, document_validator(user))
+            response = not_modified(request, etag)
+            if response:
+                return response
 
             # Return the user as a JSON response
-            return JsonResponse({"user": user}, status=200)
+            return with_etag(BSONResponse({"user": user}, status=200), etag)
 
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
     else:
         return JsonResponse({"error": "Method not allowed"}, status=405)
     
-def jwt_required(view_func):
-    @wraps(view_func)
-    def wrapper(request, *args, **kwargs):
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return JsonResponse({"error": "Unauthorized"}, status=401)
+class Principal:
+    """Authenticated caller, built from access token claims without a user lookup."""
+
+    __slots__ = ("user_id", "role", "first_name", "last_name", "token_version")
+
+    def __init__(self, user_id, role, first_name="", last_name="", token_version=0):
+        self.user_id = user_id
+        self.role = role
+        self.first_name = first_name
+        self.last_name = last_name
+        self.token_version = token_version
+
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}".strip()
+
+    @classmethod
+    def from_user(cls, user):
+        personal_details = user.get("personal_details") or {}
+        return cls(
+            str(user["_id"]),
+            user.get("role", ""),
+            personal_details.get("first_name", ""),
+            personal_details.get("last_name", ""),
+            user.get("token_version", 0),
+        )
+
+    @classmethod
+    def from_claims(cls, payload):
+        """Build a principal from token claims, or None if the token predates them."""
+        if "role" not in payload or "ver" not in payload:
+            return None
+        name = payload.get("name") or {}
+        return cls(
+            payload["sub"],
+            payload["role"],
+            name.get("first_name", ""),
+            name.get("last_name", ""),
+            payload["ver"],
+        )
+
+
+# Each user's token_version as this process last read it from MongoDB, and when
+_token_versions = {}
+
+
+def token_claims(user) -> dict:
+    """Claims identifying `user` in an access token."""
+    principal = Principal.from_user(user)
+    return {
+        "sub": principal.user_id,
+        "role": principal.role,
+        "name": {"first_name": principal.first_name, "last_name": principal.last_name},
+        "ver": principal.token_version,
+    }
+
+
+def revoke_user_tokens(user_id):
+    """Invalidate every token issued to `user_id` so far by bumping its token version.
+
+    This process refuses them at once; other workers once their copy of the
+    version is TOKEN_VERSION_TTL seconds old.
+    """
+    user = user_store.bump_token_version(user_id)
+    user_directory.invalidate()
+    if user:
+        _remember_token_version(str(user_id), user["token_version"])
+    token_cache.invalidate_subject(user_id)
+    return user
+
+
+def _remember_token_version(user_id, version):
+    if user_id not in _token_versions and len(_token_versions) >= settings.TOKEN_CACHE_SIZE:
+        _token_versions.clear()
+    _token_versions[user_id] = (version, time.monotonic())
+
+
+def _known_token_version(user_id):
+    """The user's token_version if it was read within TOKEN_VERSION_TTL seconds, else None."""
+    entry = _token_versions.get(user_id)
+    if entry is None or time.monotonic() - entry[1] >= settings.TOKEN_VERSION_TTL:
+        return None
+    return entry[0]
+
+
+def _is_stale(principal):
+    if principal is None:
+        return True
+    current_version = _known_token_version(principal.user_id)
+    return current_version is None or principal.token_version < current_version
+
+
+def _principal_after_reload(payload, user):
+    """Principal for a stale token once its user has been re-read; None if it is revoked."""
+    if not user:
+        return None
+    current_version = user.get("token_version", 0)
+    _remember_token_version(payload["sub"], current_version)
+    if payload.get("ver", 0) < current_version:
+        return None
+    return Principal.from_user(user)
+
+
+def _reload_principal(payload):
+    """Re-read the user behind a stale token; None if it no longer authorizes anyone."""
+    if not ObjectId.is_valid(payload.get("sub")):
+        return None
+    user = user_store.get_user(payload["sub"], "principal")
+    return _principal_after_reload(payload, user)
+
+
+async def _areload_principal(payload):
+    """`_reload_principal` over the async client."""
+    if not ObjectId.is_valid(payload.get("sub")):
+        return None
+    user = await user_store.aget_user(payload["sub"], "principal")
+    return _principal_after_reload(payload, user)
+
+
+def _authenticate(request):
+    """Verify the bearer token; returns `(payload, principal, error_response)`.
+
+    `principal` is None without an error when the token is stale and the user must be re-read.
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None, None, JsonResponse({"error": "Unauthorized"}, status=401)
+
+    token = auth_header.split(" ")[1]
+    payload = decode_access_token(token)
+
+    if "error" in payload:
+        return None, None, JsonResponse({"error": payload["error"]}, status=401)
+
+    # Trust the claims unless the token predates them, or the user's current token
+    # version has not been read recently enough to tell whether it was revoked
+    principal = Principal.from_claims(payload)
+    if _is_stale(principal):
+        return payload, None, None
+    return payload, principal, None
+
 
-        token = auth_header.split(" ")[1]
-        payload = decode_access_token(token)
+def _attach_principal(request, principal):
+    request.user_id = principal.user_id
+    request.principal = principal
 
-        if "error" in payload:
-            return JsonResponse({"error": payload["error"]}, status=401)
 
-        request.user_id = payload["sub"]
+def jwt_required(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            payload, principal, error = _authenticate(request)
+            if error:
+                return error
+            if principal is None:
+                principal = await _areload_principal(payload)
+                if principal is None:
+                    return JsonResponse({"error": "Token has been revoked"}, status=401)
+
+            _attach_principal(request, principal)
+            return await view_func(request, *args, **kwargs)
+        return markcoroutinefunction(async_wrapper)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        payload, principal, error = _authenticate(request)
+        if error:
+            return error
+        if principal is None:
+            principal = _reload_principal(payload)
+            if principal is None:
+                return JsonResponse({"error": "Token has been revoked"}, status=401)
+
+        _attach_principal(request, principal)
         return view_func(request, *args, **kwargs)
     return wrapper
 
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password.decode('utf-8')
-
-def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+def busy_response(error):
+    # Ask the client to back off instead of queueing more bcrypt work
+    response = JsonResponse({"error": str(error)}, status=503)
+    response["Retry-After"] = "1"
+    return response
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -117,8 +307,13 @@ def create_access_token(data: dict) -> str:
     return encoded_jwt
 
 def decode_access_token(token: str):
+    # Tokens verified earlier in this process skip the signature check until they expire
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(token, payload)
         return payload
     except jwt.ExpiredSignatureError:
         return {"error": "Token has expired"}
@@ -144,11 +339,14 @@ def register_user(request):
                 return JsonResponse({"error": "Missing required fields"}, status=400)
 
             # Check if the username already exist
-            if users_collection.find_one({"username": username}):
+            if user_store.username_exists(username):
                 return JsonResponse({"error": "Username already exists"}, status=400)
 
             # Hash the password
-            hashed_password = hash_password(password)
+            try:
+                hashed_password = hash_password(password)
+            except PasswordHasherBusy as e:
+                return busy_response(e)
 
             # Create the user document
             user = {
@@ -160,11 +358,12 @@ def register_user(request):
             }
 
             # Insert the user into the database
-            result = users_collection.insert_one(user)
+            user_id = user_store.insert_user(user)
+            user_directory.invalidate()
 
             return JsonResponse({
                 "message": "User registered successfully",
-                "user_id": str(result.inserted_id)
+                "user_id": str(user_id)
             }, status=201)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
@@ -181,16 +380,27 @@ def authenticate_user(request):
         
 
         # Find the user by username
-        user = users_collection.find_one({"username": username})
+        user = user_store.get_user_by_username(username, "auth")
         if not user:
             return JsonResponse({"error": "User not found"}, status=404)
 
         # Verify the password
-        if not verify_password(password, user["password"]):
-            return JsonResponse({"error": "Incorrect password"}, status=401)
+        try:
+            if not verify_password(password, user["password"]):
+                return JsonResponse({"error": "Incorrect password"}, status=401)
+        except PasswordHasherBusy as e:
+            return busy_response(e)
+
+        # Upgrade hashes made with an older cost factor while we know the plaintext;
+        # best effort, so a busy hasher skips it instead of failing a verified login
+        if needs_rehash(user["password"]):
+            try:
+                user_store.replace_password_hash(user["_id"], user["password"], hash_password(password))
+            except PasswordHasherBusy:
+                pass
 
         # Generate the access token
-        access_token = create_access_token({"sub": str(user["_id"])})
+        access_token = create_access_token(token_claims(user))
 
         # Prepare the user details to return
         user_details = {
@@ -0,0 +1,49 @@
+"""
+Optimistic concurrency for documents that carry a `version` number.
+
+A writer sends back the `version` it last read. The update matches only while
+the document still has that version and increments it, so two concurrent edits
+cannot silently overwrite each other: the slower one gets a 409 with the
+current document. Documents written before versions were added have none and
+count as version 0.
+"""
+from core.responses import BSONResponse
+
+VERSION_FIELD = "version"
+FIRST_VERSION = 1
+
+# Merged into every versioned update
+NEXT_VERSION = {"$inc": {VERSION_FIELD: 1}}
+
+
+class InvalidVersion(ValueError):
+    """Raised when a request's `version` is not a non-negative integer."""
+
+
+def requested_version(data):
+    """The version a request body expects to replace, or None if it sent none."""
+    version = data.get(VERSION_FIELD)
+    if version is None:
+        return None
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0:
+        raise InvalidVersion("version must be a non-negative integer")
+    return version
+
+
+def current_version(document):
+    return document.get(VERSION_FIELD, 0)
+
+
+def version_filter(version):
+    """Filter terms matching a document still at `version`; none when the caller sent no version."""
+    if version is None:
+        return {}
+    if version == 0:
+        # Unversioned documents, which null also matches
+        return {VERSION_FIELD: {"$in": [0, None]}}
+    return {VERSION_FIELD: version}
+
+
+def conflict_response(message, key, document):
+    """409 carrying the document as it is now, for the client to merge and retry."""
+    return BSONResponse({"error": message, "current_version": current_version(document), key: document}, status=409)
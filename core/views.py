@@ -0,0 +1,19 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from core.metrics import collect, render_prometheus
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_view(request):
+    # Scrapers present a shared secret; without one the endpoint only exists if made public on purpose
+    if settings.METRICS_TOKEN:
+        auth_header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth_header, f"Bearer {settings.METRICS_TOKEN}"):
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+    elif not settings.METRICS_PUBLIC:
+        return JsonResponse({"error": "Not found"}, status=404)
+
+    return HttpResponse(render_prometheus(collect()), content_type=PROMETHEUS_CONTENT_TYPE)
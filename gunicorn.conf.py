@@ -0,0 +1,80 @@
+"""
+Gunicorn settings, sized from the container's CPUs and overridable from the environment.
+
+    GUNICORN_WORKER_CLASS   gthread (default), sync, or uvicorn_worker.UvicornWorker,
+                            which serves health_care.asgi instead of health_care.wsgi
+    WEB_CONCURRENCY         worker processes (default from the CPUs available)
+    GUNICORN_THREADS        threads per gthread worker (default 4)
+    GUNICORN_PRELOAD        import the app once in the master before forking (default True)
+    GUNICORN_MAX_REQUESTS   recycle a worker after this many requests, plus up to
+                            GUNICORN_MAX_REQUESTS_JITTER more (defaults 1000 and 100)
+    GUNICORN_TIMEOUT        seconds a worker may spend on one request (default 30)
+    GUNICORN_KEEPALIVE      seconds to hold an idle keep-alive connection (default 5)
+    PORT                    port to listen on (default 8000)
+"""
+import math
+import os
+import sys
+
+
+def available_cpus():
+    """CPUs this process may use: its affinity, capped by a cgroup v2 CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+ASGI = 'uvicorn' in worker_class.lower()
+wsgi_app = 'health_care.asgi:application' if ASGI else 'health_care.wsgi:application'
+
+# One event loop per CPU; threaded workers a little over one per CPU; sync workers the classic 2n+1
+CPUS = available_cpus()
+if ASGI:
+    default_workers = CPUS
+elif worker_class == 'gthread':
+    default_workers = CPUS + 1
+else:
+    default_workers = CPUS * 2 + 1
+workers = int(os.getenv('WEB_CONCURRENCY', default_workers))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+accesslog = '-'
+# Worker heartbeats in memory rather than on a possibly slow container filesystem
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def when_ready(server):
+    # A preloaded app may have used MongoDB in the master (verify_required_indexes).
+    # Close that client so workers do not start with its sockets and monitor threads.
+    mongodb = sys.modules.get('core.mongodb')
+    if mongodb is not None:
+        mongodb.client.close()
+
+
+def post_worker_init(worker):
+    # Open this worker's connections before it accepts its first request: one per
+    # thread that may query at once (the async client connects on first use)
+    from core.mongodb import warm_up
+    try:
+        warm_up(threads if worker_class == 'gthread' else 1)
+    except Exception:
+        worker.log.warning("MongoDB warm-up failed; connecting on the first request", exc_info=True)
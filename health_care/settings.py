@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.query_profiler.QueryProfilerMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -105,10 +107,27 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'health_care.wsgi.application'
 
+# Serve core's routes with the async views; health_care/asgi.py turns this on by default
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == 'True'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+MONGO_URI = os.getenv('MONGO_URI')
+MONGO_DATABASE = os.getenv('MONGO_DATABASE', 'test')
+
+# Connection pool sizing and timeouts, per client (each process has one sync and one async client)
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 60000))
+
+# Refuse to start when an index declared in core/indexes.py is missing
+MONGO_STRICT_INDEXES = os.getenv('MONGO_STRICT_INDEXES') == 'True'
 
 
 # Password validation
@@ -130,6 +149,52 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# bcrypt cost for new hashes; stored hashes with another cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+# Verified access tokens cached per process (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+# Seconds a worker trusts the token_version it last read for a user; a token
+# revoked in any process is refused by every worker within this time
+TOKEN_VERSION_TTL = int(os.getenv('TOKEN_VERSION_TTL', 30))
+
+# Worker threads hashing passwords, and how many jobs may wait for one before
+# requests are turned away with 503 after PASSWORD_HASH_QUEUE_TIMEOUT seconds
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 32))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 2))
+
+# Directories of these roles (all/users/?role=...) are served from a cache for
+# USER_DIRECTORY_CACHE_TTL seconds (0 disables it) or until a user is created or
+# changed. Set USER_DIRECTORY_CACHE_ALIAS to a Django cache shared by all workers
+# to share entries and invalidations; otherwise each process keeps its own.
+USER_DIRECTORY_CACHE_TTL = int(os.getenv('USER_DIRECTORY_CACHE_TTL', 300))
+USER_DIRECTORY_CACHE_ROLES = [role for role in os.getenv('USER_DIRECTORY_CACHE_ROLES', 'doctor').split(',') if role]
+USER_DIRECTORY_CACHE_ALIAS = os.getenv('USER_DIRECTORY_CACHE_ALIAS', '')
+
+
+# Prometheus /metrics. With several worker processes, point METRICS_MULTIPROCESS_DIR
+# at a directory they share (wiped on deploy); each worker writes its numbers there
+# at most every METRICS_FLUSH_INTERVAL seconds and a scrape merges them.
+METRICS_MULTIPROCESS_DIR = os.getenv('METRICS_MULTIPROCESS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Without METRICS_TOKEN the endpoint answers 404 unless it is explicitly made public
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC') == 'True'
+
+# Per-request MongoDB profiler for development and staging (off in production).
+# Requests issuing more than MONGO_PROFILER_QUERY_BUDGET commands (0: no limit) or
+# the same query shape more than MONGO_PROFILER_REPEAT_LIMIT times are logged as
+# warnings, or fail with MONGO_PROFILER_STRICT. MONGO_PROFILER_EXPLAIN also
+# explains the slowest query of every request.
+MONGO_PROFILER = os.getenv('MONGO_PROFILER') == 'True'
+MONGO_PROFILER_QUERY_BUDGET = int(os.getenv('MONGO_PROFILER_QUERY_BUDGET', 10))
+MONGO_PROFILER_REPEAT_LIMIT = int(os.getenv('MONGO_PROFILER_REPEAT_LIMIT', 2))
+MONGO_PROFILER_STRICT = os.getenv('MONGO_PROFILER_STRICT') == 'True'
+MONGO_PROFILER_EXPLAIN = os.getenv('MONGO_PROFILER_EXPLAIN') == 'True'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -147,6 +212,33 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Keyset pagination for list endpoints (?cursor=...&limit=...)
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 1000))
+
+# Documents fetched per round trip when streaming exports (?stream=true / ?format=ndjson)
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+
+# Largest batch accepted by the bulk ingestion endpoints (post/.../bulk/)
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 1000))
+
+# Schedule for doctors who have not set their own (UTC, Monday to Friday), and the
+# longest date range one free-slot search may cover
+DOCTOR_DEFAULT_SLOT_MINUTES = int(os.getenv('DOCTOR_DEFAULT_SLOT_MINUTES', 30))
+DOCTOR_DEFAULT_WORKING_HOURS = os.getenv('DOCTOR_DEFAULT_WORKING_HOURS', '09:00-17:00')
+FREE_SLOT_MAX_DAYS = int(os.getenv('FREE_SLOT_MAX_DAYS', 31))
+
+# Server-Sent Events (api/events/, ASGI only): fallback poll period when change
+# streams are unavailable and how far back each poll re-reads (covers clock skew
+# between app servers), idle heartbeat, per-client backlog, client retry delay and
+# how long a stream ticket stays valid
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', 2))
+EVENTS_POLL_OVERLAP = float(os.getenv('EVENTS_POLL_OVERLAP', 30))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', 15))
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', 100))
+EVENTS_RETRY_MS = int(os.getenv('EVENTS_RETRY_MS', 3000))
+EVENTS_TICKET_TTL = int(os.getenv('EVENTS_TICKET_TTL', 30))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_care.settings')
 
 application = get_wsgi_application()
+
+from core.indexes import verify_required_indexes
+
+verify_required_indexes()